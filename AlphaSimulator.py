@@ -1,16 +1,23 @@
 import requests
 import json
 from os.path import expanduser
-from requests.auth import HTTPBasicAuth
 import logging
 import time
 import csv
-import requests
 import os
-import ast
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pytz import timezone
 
+from brain_api import BRAIN_API_URL, BrainClient
+from concurrency_controller import AIMDController
+from dedup_index import default_index, payload_key
+from metrics import SIMULATION_BUCKETS, default_metrics
+from pending_queue import PendingQueue
+from poll_scheduler import PollScheduler
+from result_sink import ResultSink, error_result
+
 # 获取美国东部时间
 eastern = timezone('US/Eastern')
 fmt = '%Y-%m-%d'
@@ -22,79 +29,79 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 class AlphaSimulator:
 
-    def __init__(self, max_concurrent, username, password, alpha_list_file_path,batch_number_for_every_queue):
+    def __init__(self, max_concurrent, username, password, alpha_list_file_path,batch_number_for_every_queue, multi_simulation_size=1,
+                 result_sink=None, sim_queue_file='sim_queue.csv', sign_in=True):
         self.fail_alphas = 'fail_alphas.csv'
-        self.simulated_alphas = f'simulated_alphas_{loc_dt.strftime(fmt)}.csv'
+        self.simulated_alphas = f'simulated_alphas_{loc_dt.strftime(fmt)}.jsonl'
+        # 多个账号在同一个进程里跑时共用一个 ResultSink，不会各自往同一个文件里交错写
+        self.result_sink = result_sink or ResultSink(self.simulated_alphas)
+        self.sim_queue_file = sim_queue_file
         self.max_concurrent = max_concurrent
         self.active_simulations = []
         self.username = username
         self.password = password
-        self.session = self.sign_in(username, password)
+        # max_concurrent是上限，实际并发窗口由AIMD根据429和延迟自适应调整
+        self.concurrency = AIMDController(max_window=max_concurrent)
+        # 所有请求共用一个连接池，掉线后由BrainClient统一重新登录一次；每个响应都经record_response交给AIMD
+        self.client = BrainClient(username, password, pool_size=2 * max_concurrent, on_response=self.record_response)
+        # sign_in=False 时由调用方自己登录（AccountPool 并发登录所有账号）
+        if sign_in:
+            self.client.reauthenticate(None)
         self.alpha_list_file_path = alpha_list_file_path
+        self.pending_queue = PendingQueue(os.path.splitext(alpha_list_file_path)[0] + '.sqlite')
+        self.location_queue_ids = {}
         self.sim_queue_ls = []
         self.batch_number_for_every_queue = batch_number_for_every_queue
-
-    def sign_in(self, username, password):
-        s = requests.Session()
-        s.auth = (username, password)
-        count = 0
-        count_limit = 30
-
-        while True:
-            try:
-                response = s.post('https://api.worldquantbrain.com/authentication')
-                response.raise_for_status()
-                break
-            except:
-                count += 1
-                logging.error("Connection down, trying to login again...")
-                time.sleep(15)
-                if count > count_limit:
-                    logging.error(f"{username} failed too many times, returning None.")
-                    return None
-
-        logging.info("Login to BRAIN successfully.")
-        return s
+        # >1 时开启multi-simulation：每个槽位一次POST multi_simulation_size个children
+        self.multi_simulation_size = multi_simulation_size
+        self.poll_scheduler = PollScheduler()
+        self.submit_pool = ThreadPoolExecutor(max_workers=max_concurrent)
+        # 后台还没返回的 POST：future -> 这次提交的 alphas，占着槽位但还没有 Location
+        self.submitting = {}
+        # 每个空闲槽位从什么时候开始空闲，用来统计槽位空闲时长
+        self.slot_free_since = deque([time.monotonic()] * max_concurrent)
+        self.slot_idle_seconds = 0.0
+        self.slot_refills = 0
+        # 账号连续出错后暂停提交到这个时间点（time.monotonic），AccountPool据此跳过该账号
+        self.backoff_until = 0.0
+        # 提交过的 payload 不再重复提交，命中的直接用上次的结果
+        self.dedup_index = default_index()
+        self.duplicates_skipped = 0
+        self.metrics = default_metrics()
+        # Location -> 提交时间（time.monotonic），算 simulation 耗时；completion_times 算每分钟完成数
+        self.posted_at = {}
+        self.completion_times = deque()
+        self.restore_inflight()
+
+    def restore_inflight(self):
+        '''
+        进程重启后从队列的inflight日志恢复：已提交的继续轮询，已取出但没提交的放回sim_queue_ls
+        '''
+        queued, posted = self.pending_queue.restore(self.username)
+        self.sim_queue_ls = queued + self.sim_queue_ls
+        for location_url, queue_ids in posted.items():
+            self.active_simulations.append(location_url)
+            self.location_queue_ids[location_url] = queue_ids
+            # 原来的提交时间没有记下来，从恢复时开始算
+            self.posted_at[location_url] = time.monotonic()
+            self.poll_scheduler.schedule(location_url)
+
+    @property
+    def session(self):
+        return self.client.session
 
     def read_alphas_from_csv_in_batches(self, batch_size=50):
         '''
-        1. 打开alpha_list_pending_simulated
-        2. 取出batch_size个alpha,放入列表变量alphas
-        3. 取出后覆写（overwrite）alpha_list_pending_simulated
-        4. 把取出的alphas,写到sim_queue.csv文件中，方便随时监控在排队的alpha有多少
-        5. 返回列表变量alphas
+        1. 把alpha_list_pending_simulated.csv里新追加的alpha导入SQLite队列（按字节偏移增量导入，全部导入且空闲后截断到只剩表头）
+        2. 从队列取出batch_size个alpha,放入列表变量alphas,同时登记到inflight表
+        3. 把取出的alphas,写到sim_queue_file（默认sim_queue.csv）中，方便随时监控在排队的alpha有多少
+        4. 返回列表变量alphas
         '''
 
-        alphas = []
-        temp_file_name = self.alpha_list_file_path + '.tmp'
-        with open(self.alpha_list_file_path, 'r') as file, open(temp_file_name, 'w', newline='') as temp_file:
-            reader = csv.DictReader(file)
-            fieldnames = reader.fieldnames
-            writer = csv.DictWriter(temp_file, fieldnames=fieldnames)
-            writer.writeheader()
-            for _ in range(batch_size):
-                try:
-                    row = next(reader)
-                    if 'settings' in row:
-                        if isinstance(row['settings'], str):
-                            try:
-                                row['settings'] = ast.literal_eval(row['settings'])
-                            except (ValueError, SyntaxError):
-                                print(f"Error evaluating settings: {row['settings']}")
-                        elif isinstance(row['settings'], dict):
-                            pass
-                        else:
-                            print(f"Unexpected type for settings: {type(row['settings'])}")
-                    alphas.append(row)
-                except StopIteration:
-                    break
-
-            for remaining_row in reader:
-                writer.writerow(remaining_row)
-
-        os.replace(temp_file_name, self.alpha_list_file_path)
+        self.pending_queue.import_csv(self.alpha_list_file_path)
+        alphas = self.pending_queue.pop(batch_size, owner=self.username)
         if alphas:
-            with open('sim_queue.csv', 'w', newline='') as file:
+            with open(self.sim_queue_file, 'w', newline='') as file:
                 writer = csv.DictWriter(file, fieldnames=alphas[0].keys())
                 if file.tell() == 0:
                     writer.writeheader()
@@ -106,7 +113,7 @@ class AlphaSimulator:
         count = 0
         while True:
             try:
-                response = self.session.post('https://api.worldquantbrain.com/simulations', json=alpha)
+                response = self.client.post(f'{BRAIN_API_URL}/simulations', json=alpha)
                 response.raise_for_status()
                 if "Location" in response.headers:
                     logging.info("Alpha location retrieved successfully.")
@@ -114,8 +121,10 @@ class AlphaSimulator:
                     return response.headers['Location']
             except requests.exceptions.RequestException as e:
                 logging.error(f"Error in sending simulation request: {e}")
+                self.metrics.count_retry(f'{BRAIN_API_URL}/simulations', 'error')
                 if count > 35:
-                    self.session = self.sign_in(self.username, self.password)
+                    self.client.reauthenticate(self.session)
+                    self.backoff_until = time.monotonic() + 60
                     logging.error("Error occurred too many times, skipping this alpha and re-logging in.")
                     break
 
@@ -126,83 +135,269 @@ class AlphaSimulator:
         logging.error(f"Simulation request failed after {count} attempts.")
 
         with open(self.fail_alphas, 'a', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=alpha.keys())
-            writer.writerow(alpha)
+            for failed_alpha in (alpha if isinstance(alpha, list) else [alpha]):
+                writer = csv.DictWriter(file, fieldnames=failed_alpha.keys())
+                writer.writerow(failed_alpha)
 
         return None
 
+    def record_response(self, method, url, status_code, latency, retry_after):
+        '''
+        client 每收到一个响应的回调，包括连接池内部重发之前的 429（GET 的 429 调用方看不到）；
+        轮询 simulation 时的 Retry-After 是轮询间隔，不是限流信号，不交给 AIMD
+        '''
+        if method == 'GET' and status_code != 429:
+            retry_after = None
+        self.concurrency.record(latency, status_code, retry_after)
+
+    def free_slots(self):
+        return self.concurrency.window - len(self.active_simulations) - len(self.submitting)
+
     def load_new_alpha_and_simulate(self):
-        if len(self.sim_queue_ls) < 1:
-            self.sim_queue_ls = self.read_alphas_from_csv_in_batches(self.batch_number_for_every_queue)  
-       
-        if len(self.active_simulations) >= self.max_concurrent:
-            logging.info(f"Max concurrent simulations reached ({self.max_concurrent}). Waiting 2 seconds")
-            time.sleep(2)
+        '''
+        一次把所有空闲槽位补满：空闲槽位 = 并发窗口 - 在途的 simulation - 还在 POST 的，
+        这些alpha交给submit_pool在后台并行POST，不等它们返回，
+        一个POST重试很久也不会卡住轮询；拿到的Location由collect_submissions登记
+        '''
+        free_slots = self.free_slots()
+        if free_slots <= 0:
+            logging.info(f"Concurrency window reached ({self.concurrency.window}/{self.max_concurrent}).")
             return
-       
-        logging.info('Loading new alpha...')
 
-        try:
-            alpha = self.sim_queue_ls.pop(0)
+        needed = free_slots * self.multi_simulation_size
+        alphas = []
+        # 重复的 alpha 不占槽位，被跳过后接着从队列里补
+        while len(alphas) < needed:
+            missing = needed - len(alphas)
+            if len(self.sim_queue_ls) < missing:
+                self.sim_queue_ls += self.read_alphas_from_csv_in_batches(max(self.batch_number_for_every_queue, missing))
+            if not self.sim_queue_ls:
+                break
+            candidates = self.sim_queue_ls[:missing]
+            del self.sim_queue_ls[:missing]
+            alphas += self.skip_duplicates(candidates, alphas)
+
+        if not alphas:
+            logging.info("No more alphas available in the queue.")
+            return
+
+        tasks = [alphas[i:i + self.multi_simulation_size] for i in range(0, len(alphas), self.multi_simulation_size)]
+        logging.info(f'Loading {len(alphas)} new alphas in {len(tasks)} simulations for {free_slots} free slots...')
+        self.record_slot_idle_time(len(tasks))
+        for alpha in alphas:
             logging.info(f"Starting simulation for alpha: {alpha['regular']} with settings: {alpha['settings']}")
-            location_url = self.simulate_alpha(alpha)
+
+        for task in tasks:
+            # 只有一个child时按普通simulation提交
+            future = self.submit_pool.submit(self.simulate_alpha, task if len(task) > 1 else task[0])
+            self.submitting[future] = task
+            future.add_done_callback(lambda _: self.poll_scheduler.wake())
+
+    def collect_submissions(self):
+        '''
+        非阻塞：登记已经返回的POST，拿到Location的开始轮询，最终失败的从队列日志里删掉
+        '''
+        for future in [future for future in self.submitting if future.done()]:
+            task = self.submitting.pop(future)
+            queue_ids = [alpha.queue_id for alpha in task]
+            try:
+                location_url = future.result()
+            except Exception as e:
+                # simulate_alpha 只处理 RequestException，其余异常在这里记下，这些 alpha 留在 inflight 里等重启恢复
+                logging.error(f"Unexpected error in sending simulation request: {e}")
+                self.slot_free_since.append(time.monotonic())
+                continue
             if location_url:
+                self.pending_queue.mark_posted(queue_ids, location_url)
+                self.dedup_index.record_posted(task, location_url, self.username)
+                self.posted_at[location_url] = time.monotonic()
                 self.active_simulations.append(location_url)
-        except IndexError:
-            logging.info("No more alphas available in the queue.")
+                self.location_queue_ids[location_url] = queue_ids
+                self.poll_scheduler.schedule(location_url)
+            else:
+                # 已经写进fail_alphas.csv
+                self.pending_queue.complete(queue_ids)
+                self.slot_free_since.append(time.monotonic())
+
+    def is_duplicate(self, hit):
+        '''
+        去重索引命中且有结果，或者就是本模拟器正在轮询的 simulation，才算重复；
+        只提交过、不在自己在途列表里的（别的脚本提交后没人取结果、提交的进程崩了）照常提交
+        '''
+        return hit is not None and (hit['result'] is not None or hit['location'] in self.active_simulations)
+
+    def skip_duplicates(self, candidates, selected):
+        '''
+        去掉已经提交过的 alpha（包括和本轮已选中的重复的），返回需要提交的那些:
+        1. 去重索引里已有结果的，直接把上次的结果写进结果文件
+        2. 本模拟器还在轮询或者还在后台 POST 的，直接跳过，结果由那个 simulation 写
+        '''
+        submitting = [alpha for task in self.submitting.values() for alpha in task]
+        selected_keys = {payload_key(alpha) for alpha in selected + submitting}
+        fresh = []
+        skipped_queue_ids = []
+        for alpha in candidates:
+            key = payload_key(alpha)
+            hit = None if key in selected_keys else self.dedup_index.lookup(alpha)
+            if key not in selected_keys and not self.is_duplicate(hit):
+                selected_keys.add(key)
+                fresh.append(alpha)
+                continue
+            self.duplicates_skipped += 1
+            self.metrics.inc('brain_simulator_duplicates_skipped_total', account=self.username)
+            logging.info(f"Skipping duplicate alpha ({self.duplicates_skipped} so far): {alpha['regular']}")
+            if hit and hit['result']:
+                self.result_sink.add(hit['result'])
+            skipped_queue_ids.append(alpha.queue_id)
+        self.complete_written(skipped_queue_ids)
+        return fresh
+
+    def record_slot_idle_time(self, filled_slots):
+        '''
+        槽位空闲时长指标：从槽位被释放到再次被占用之间的时间累加到slot_idle_seconds
+        '''
+        now = time.monotonic()
+        for _ in range(min(filled_slots, len(self.slot_free_since))):
+            self.slot_idle_seconds += now - self.slot_free_since.popleft()
+            self.slot_refills += 1
+        if self.slot_refills:
+            logging.info(f"Slot idle time: {self.slot_idle_seconds:.1f}s in total, "
+                         f"{self.slot_idle_seconds / self.slot_refills:.2f}s per refill.")
 
     def check_simulation_progress(self, simulation_progress_url):
         try:
-            simulation_progress = self.session.get(simulation_progress_url)
+            simulation_progress = self.client.get(simulation_progress_url)
             simulation_progress.raise_for_status()
             if simulation_progress.headers.get("Retry-After", 0) == 0:
-                alpha_id = simulation_progress.json().get("alpha")
+                progress = simulation_progress.json()
+                alpha_id = progress.get("alpha")
                 if alpha_id:
-                    alpha_response = self.session.get(f"https://api.worldquantbrain.com/alphas/{alpha_id}")
+                    alpha_response = self.client.get(f"{BRAIN_API_URL}/alphas/{alpha_id}")
                     alpha_response.raise_for_status()
                     return alpha_response.json()
+                elif progress.get("children"):
+                    return progress
                 else:
-                    return simulation_progress.json()
+                    return error_result(progress)
             else:
+                # 还没跑完，按 Retry-After 排下一次轮询
+                self.poll_scheduler.schedule(simulation_progress_url, simulation_progress.headers["Retry-After"])
                 return None
 
         except requests.exceptions.RequestException as e:
             logging.error(f"Error fetching simulation progress: {e}")
-            self.session = self.sign_in(self.username, self.password)
+            self.poll_scheduler.schedule(simulation_progress_url, 5)
             return None
 
+    def check_children_results(self, children):
+        '''
+        multi-simulation的parent完成后，逐个取child的alpha详情
+        '''
+        results = []
+        for child in children:
+            try:
+                child_progress = self.client.get(f"{BRAIN_API_URL}/simulations/{child}")
+                child_progress.raise_for_status()
+                progress = child_progress.json()
+                alpha_id = progress.get("alpha")
+                if not alpha_id:
+                    results.append(error_result(progress, child))
+                    continue
+                alpha_response = self.client.get(f"{BRAIN_API_URL}/alphas/{alpha_id}")
+                alpha_response.raise_for_status()
+                results.append(alpha_response.json())
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Error fetching child simulation {child}: {e}")
+                results.append(error_result({"status": "ERROR", "message": str(e)}, child))
+        return results
+
     def check_simulation_status(self):
-        count = 0
+        self.collect_submissions()
         if len(self.active_simulations) == 0:
             logging.info("No one is in active simulation now")
             return None
 
-        for sim_url in self.active_simulations:
+        # 只轮询 Retry-After 已经到期的 simulation
+        finished_queue_ids = []
+        for sim_url in self.poll_scheduler.pop_ready():
             sim_progress = self.check_simulation_progress(sim_url)
             if sim_progress is None:
-                count += 1
                 continue
 
-            alpha_id = sim_progress.get("id")
-            status = sim_progress.get("status")
-            logging.info(f"Alpha id: {alpha_id} ended with status: {status}. Removing from active list.")
+            # multi-simulation的parent结束后，每个child各写一行结果
+            children = sim_progress.get("children")
+            results = self.check_children_results(children) if children else [sim_progress]
+            logging.info(f"Simulation {sim_url} ended with status: {sim_progress.get('status')}. Removing from active list.")
             self.active_simulations.remove(sim_url)
+            finished_queue_ids += self.location_queue_ids.pop(sim_url)
+            self.dedup_index.record_results(sim_url, results)
+            self.slot_free_since.append(time.monotonic())
+            self.record_completion(sim_url, len(results))
 
-            with open(self.simulated_alphas, 'a', newline='') as file:
-                writer = csv.DictWriter(file, fieldnames=sim_progress.keys())
-                writer.writerow(sim_progress)
+            for result in results:
+                logging.info(f"Alpha id: {result.get('id')} ended with status: {result.get('status')}.")
+                self.result_sink.add(result)
 
+        # 结果落盘之后才把队列日志里的这些 alpha 标记完成，进程中途被杀时它们会在重启后重新轮询
+        self.complete_written(finished_queue_ids)
+
+        count = len(self.active_simulations)
         logging.info(f"Total {count} simulations are in process for account {self.username}.")
+        self.concurrency.publish()
+        self.publish_metrics()
+
+    def complete_written(self, queue_ids):
+        if queue_ids:
+            self.result_sink.flush()
+            self.pending_queue.complete(queue_ids)
+
+    def record_completion(self, location_url, alpha_count):
+        now = time.monotonic()
+        self.metrics.observe('brain_simulation_duration_seconds', now - self.posted_at.pop(location_url, now),
+                             SIMULATION_BUCKETS, account=self.username)
+        self.metrics.inc('brain_simulator_completions_total', alpha_count, account=self.username)
+        self.completion_times.extend([now] * alpha_count)
+
+    def publish_metrics(self):
+        '''
+        模拟器的 gauge：在途数、待回测队列深度、并发窗口、最近一分钟完成数
+        '''
+        now = time.monotonic()
+        while self.completion_times and now - self.completion_times[0] > 60:
+            self.completion_times.popleft()
+        self.metrics.set_gauge('brain_simulator_inflight', len(self.active_simulations), account=self.username)
+        self.metrics.set_gauge('brain_simulator_queue_depth', len(self.pending_queue) + len(self.sim_queue_ls),
+                               account=self.username)
+        self.metrics.set_gauge('brain_simulator_window', self.concurrency.window, account=self.username)
+        self.metrics.set_gauge('brain_simulator_completions_per_minute', len(self.completion_times),
+                               account=self.username)
+
+    def drained(self):
+        '''
+        队列和在途的 simulation 都空了
+        '''
+        return (not self.active_simulations and not self.submitting and not self.sim_queue_ls
+                and len(self.pending_queue) == 0)
 
-    def manage_simulations(self):
+    def manage_simulations(self, stop_when_empty=False):
+        '''
+        stop_when_empty=True 时队列跑空就返回（压测用），否则一直等新的 alpha
+        '''
         if not self.session:
             logging.error("Failed to sign in. Exiting...")
             return
 
+        self.metrics.start_exporter()
         while True:
             self.check_simulation_status()
             self.load_new_alpha_and_simulate()
-            time.sleep(3)
+            # csv 不会被删掉，跑空的判断是队列、在途都空了，而且 csv 里也没有新追加的行
+            if stop_when_empty and self.drained() and self.pending_queue.import_csv(self.alpha_list_file_path) == 0:
+                logging.info("Queue drained, stopping.")
+                self.result_sink.flush()
+                return
+            # 睡到最早的 Retry-After 到期，最多 3 秒
+            self.poll_scheduler.wait(timeout=3)
 
 if __name__ == "__main__":
     # Example usage
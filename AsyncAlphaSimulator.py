@@ -0,0 +1,365 @@
+import asyncio
+import json
+import logging
+import csv
+import os
+import time
+from collections import deque
+from os.path import expanduser
+
+import aiohttp
+
+from AlphaSimulator import AlphaSimulator, loc_dt, fmt
+from brain_api import BRAIN_API_URL
+from concurrency_controller import AIMDController
+from dedup_index import default_index
+from metrics import default_metrics
+from pending_queue import PendingQueue
+from rate_limiter import default_limiter
+from result_sink import ResultSink, error_result
+
+
+class AsyncAlphaSimulator(AlphaSimulator):
+    '''
+    asyncio 版本的 AlphaSimulator:
+    1. 构造参数、待回测 csv 队列与 AlphaSimulator 完全相同，可以直接替换
+    2. 提交、轮询、写结果分别是并发的 task，不再由 time.sleep(3) 的主循环驱动
+    3. 槽位数由 AIMD 并发窗口决定（上限 max_concurrent），任何一个 simulation 结束后立刻补位
+    4. 只支持普通 simulation，multi_simulation_size > 1 时构造函数直接报错，multi-simulation 请用 AlphaSimulator
+    '''
+
+    # 覆盖父类的 session property：这里的 session 是 aiohttp.ClientSession，直接存在实例上
+    session = None
+
+    def __init__(self, max_concurrent, username, password, alpha_list_file_path, batch_number_for_every_queue,
+                 multi_simulation_size=1):
+        if multi_simulation_size != 1:
+            raise ValueError("AsyncAlphaSimulator does not support multi-simulation, use AlphaSimulator instead.")
+        # 不调用父类的构造函数：登录要在事件循环里用 aiohttp 完成
+        self.multi_simulation_size = 1
+        self.fail_alphas = 'fail_alphas.csv'
+        self.simulated_alphas = f'simulated_alphas_{loc_dt.strftime(fmt)}.jsonl'
+        self.result_sink = ResultSink(self.simulated_alphas)
+        self.max_concurrent = max_concurrent
+        self.active_simulations = []
+        self.username = username
+        self.password = password
+        self.session = None
+        self.alpha_list_file_path = alpha_list_file_path
+        self.pending_queue = PendingQueue(os.path.splitext(alpha_list_file_path)[0] + '.sqlite')
+        self.sim_queue_ls = []
+        self.batch_number_for_every_queue = batch_number_for_every_queue
+        self.concurrency = AIMDController(max_window=max_concurrent)
+        self.dedup_index = default_index()
+        self.duplicates_skipped = 0
+        # 和本机其他脚本共用的令牌桶，aiohttp 的请求也要先拿令牌
+        self.rate_limiter = default_limiter()
+        self.metrics = default_metrics()
+        self.posted_at = {}
+        self.completion_times = deque()
+        self.slots_in_use = 0
+        self.sign_in_lock = asyncio.Lock()
+        # 重新登录后换下来、还没关闭的旧 session，以及延迟关闭它们的 task
+        self.stale_sessions = set()
+        self.close_tasks = set()
+
+    async def acquire_slot(self, slot_changed):
+        async with slot_changed:
+            await slot_changed.wait_for(lambda: self.slots_in_use < self.concurrency.window)
+            self.slots_in_use += 1
+
+    async def release_slot(self, slot_changed):
+        async with slot_changed:
+            self.slots_in_use -= 1
+            slot_changed.notify_all()
+
+    async def sign_in_async(self):
+        # 连接池大小跟并发数一致，keep-alive 复用连接
+        connector = aiohttp.TCPConnector(limit=2 * self.max_concurrent, keepalive_timeout=60)
+        # 默认的 CookieJar 不接受 IP 地址主机发的 cookie，连 127.0.0.1 上的测试服务器时登录 cookie 会被丢掉
+        session = aiohttp.ClientSession(auth=aiohttp.BasicAuth(self.username, self.password), connector=connector,
+                                        cookie_jar=aiohttp.CookieJar(unsafe=True))
+        count = 0
+        count_limit = 30
+
+        while True:
+            try:
+                async with session.post(f'{BRAIN_API_URL}/authentication') as response:
+                    response.raise_for_status()
+                break
+            except aiohttp.ClientError:
+                count += 1
+                logging.error("Connection down, trying to login again...")
+                await asyncio.sleep(15)
+                if count > count_limit:
+                    logging.error(f"{self.username} failed too many times, returning None.")
+                    await session.close()
+                    return None
+
+        logging.info("Login to BRAIN successfully.")
+        stale_session, self.session = self.session, session
+        if stale_session is not None:
+            self.stale_sessions.add(stale_session)
+            task = asyncio.create_task(self.close_stale_session(stale_session))
+            self.close_tasks.add(task)
+            task.add_done_callback(self.close_tasks.discard)
+        return session
+
+    async def close_stale_session(self, session, grace=30):
+        '''
+        旧 session 上可能还有在途请求，等 grace 秒再关；run 提前结束时剩下的由 close_sessions 关掉
+        '''
+        await asyncio.sleep(grace)
+        if session in self.stale_sessions:
+            self.stale_sessions.discard(session)
+            await session.close()
+
+    async def close_sessions(self):
+        for task in list(self.close_tasks):
+            task.cancel()
+        sessions = list(self.stale_sessions) + [self.session]
+        self.stale_sessions.clear()
+        for session in sessions:
+            if session is not None and not session.closed:
+                await session.close()
+
+    async def reauthenticate_async(self, stale_session):
+        '''
+        single-flight 重新登录：并发的请求同时发现 session 失效时，只有第一个真正去登录，
+        其余的等锁结束后直接用新 session
+        '''
+        async with self.sign_in_lock:
+            if self.session is not stale_session and self.session is not None:
+                return self.session
+            return await self.sign_in_async()
+
+    async def reauthenticate_if_expired(self, session, error):
+        '''
+        401 时重新登录并返回 True，调用方直接用新 session 重试，不再额外等 5s（session 有效期很短时会一直过期）
+        '''
+        if isinstance(error, aiohttp.ClientResponseError) and error.status == 401:
+            await self.reauthenticate_async(session)
+            return True
+        return False
+
+    async def wait_rate_limit(self, url):
+        # reserve/penalize 要拿跨进程的文件锁、读写状态文件，放到线程里做，不阻塞事件循环上的其他请求
+        await asyncio.sleep(await asyncio.to_thread(self.rate_limiter.reserve, url, self.username))
+
+    async def check_rate_limited(self, method, response, start):
+        self.metrics.observe_request(method, str(response.url), response.status, time.monotonic() - start)
+        if response.status == 429:
+            await asyncio.to_thread(self.rate_limiter.penalize, str(response.url), response.headers.get("Retry-After"),
+                                    self.username)
+
+    async def simulate_alpha_async(self, alpha):
+        count = 0
+        while True:
+            session = self.session
+            try:
+                await self.wait_rate_limit(f'{BRAIN_API_URL}/simulations')
+                start = time.monotonic()
+                async with session.post(f'{BRAIN_API_URL}/simulations', json=alpha) as response:
+                    self.concurrency.record(time.monotonic() - start, response.status, response.headers.get("Retry-After"))
+                    await self.check_rate_limited('POST', response, start)
+                    response.raise_for_status()
+                    if "Location" in response.headers:
+                        logging.info("Alpha location retrieved successfully.")
+                        logging.info(f"Location: {response.headers['Location']}")
+                        return response.headers['Location']
+            except aiohttp.ClientError as e:
+                logging.error(f"Error in sending simulation request: {e}")
+                self.metrics.count_retry(f'{BRAIN_API_URL}/simulations', 'error')
+                if await self.reauthenticate_if_expired(session, e) and count <= 35:
+                    count += 1
+                    continue
+                if count > 35:
+                    await self.reauthenticate_async(session)
+                    logging.error("Error occurred too many times, skipping this alpha and re-logging in.")
+                    break
+
+                logging.error("Error in sending simulation request. Retrying after 5s...")
+                await asyncio.sleep(5)
+                count += 1
+
+        logging.error(f"Simulation request failed after {count} attempts.")
+
+        with open(self.fail_alphas, 'a', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=alpha.keys())
+            writer.writerow(alpha)
+
+        return None
+
+    async def wait_simulation_result(self, simulation_progress_url):
+        '''
+        按 Retry-After 等待单个 simulation 结束，返回 alpha 详情（没有 alpha id 时返回 progress 本身）
+        '''
+        while True:
+            session = self.session
+            try:
+                await self.wait_rate_limit(simulation_progress_url)
+                start = time.monotonic()
+                async with session.get(simulation_progress_url) as progress:
+                    self.concurrency.record(time.monotonic() - start, progress.status)
+                    await self.check_rate_limited('GET', progress, start)
+                    progress.raise_for_status()
+                    retry_after = float(progress.headers.get("Retry-After", 0))
+                    if retry_after == 0:
+                        sim_progress = await progress.json()
+                        break
+                await asyncio.sleep(retry_after)
+            except aiohttp.ClientError as e:
+                logging.error(f"Error fetching simulation progress: {e}")
+                if not await self.reauthenticate_if_expired(session, e):
+                    await asyncio.sleep(5)
+
+        alpha_id = sim_progress.get("alpha")
+        if not alpha_id:
+            return error_result(sim_progress)
+
+        while True:
+            session = self.session
+            try:
+                await self.wait_rate_limit(f"{BRAIN_API_URL}/alphas/{alpha_id}")
+                start = time.monotonic()
+                async with session.get(f"{BRAIN_API_URL}/alphas/{alpha_id}") as alpha_response:
+                    await self.check_rate_limited('GET', alpha_response, start)
+                    alpha_response.raise_for_status()
+                    return await alpha_response.json()
+            except aiohttp.ClientError as e:
+                logging.error(f"Error fetching alpha {alpha_id}: {e}")
+                if not await self.reauthenticate_if_expired(session, e):
+                    await asyncio.sleep(5)
+
+    async def run_one_simulation(self, alpha, slot_changed, results):
+        try:
+            hit = self.dedup_index.lookup(alpha)
+            if self.is_duplicate(hit):
+                self.duplicates_skipped += 1
+                self.metrics.inc('brain_simulator_duplicates_skipped_total', account=self.username)
+                logging.info(f"Skipping duplicate alpha ({self.duplicates_skipped} so far): {alpha['regular']}")
+                await results.put((hit['result'], [alpha.queue_id]))
+                return
+            logging.info(f"Starting simulation for alpha: {alpha['regular']} with settings: {alpha['settings']}")
+            location_url = await self.simulate_alpha_async(alpha)
+            if not location_url:
+                self.pending_queue.complete([alpha.queue_id])
+                return
+            self.pending_queue.mark_posted([alpha.queue_id], location_url)
+            self.dedup_index.record_posted(alpha, location_url, self.username)
+            self.posted_at[location_url] = time.monotonic()
+            await self.track_simulation(location_url, [alpha.queue_id], results)
+        finally:
+            await self.release_slot(slot_changed)
+
+    async def resume_simulation(self, location_url, queue_ids, slot_changed, results):
+        try:
+            await self.track_simulation(location_url, queue_ids, results)
+        finally:
+            await self.release_slot(slot_changed)
+
+    async def track_simulation(self, location_url, queue_ids, results):
+        self.active_simulations.append(location_url)
+        try:
+            sim_progress = await self.wait_simulation_result(location_url)
+        finally:
+            self.active_simulations.remove(location_url)
+        self.dedup_index.record_results(location_url, [sim_progress])
+        self.record_completion(location_url, 1)
+        await results.put((sim_progress, queue_ids))
+
+    async def write_results(self, results):
+        '''
+        results 里是 (结果, 队列 id)：把当前排着的结果一起写进结果文件并落盘，
+        之后才把对应的 alpha 在队列日志里标记完成（重复的 alpha 结果可能是 None）
+        '''
+        while True:
+            batch = [await results.get()]
+            while not results.empty():
+                batch.append(results.get_nowait())
+            queue_ids = []
+            for sim_progress, ids in batch:
+                queue_ids += ids
+                if sim_progress is None:
+                    continue
+                alpha_id = sim_progress.get("id")
+                status = sim_progress.get("status")
+                logging.info(f"Alpha id: {alpha_id} ended with status: {status}. Removing from active list.")
+                self.result_sink.add(sim_progress)
+
+            await asyncio.to_thread(self.complete_written, queue_ids)
+            for _ in batch:
+                results.task_done()
+            self.concurrency.publish()
+            self.publish_metrics()
+
+    async def run(self, stop_when_empty=False):
+        '''
+        stop_when_empty=True 时队列跑空、在途的都写完就返回（压测用），否则一直等新的 alpha
+        '''
+        if not await self.sign_in_async():
+            logging.error("Failed to sign in. Exiting...")
+            return
+
+        self.metrics.start_exporter()
+        slot_changed = asyncio.Condition()
+        results = asyncio.Queue()
+        writer_task = asyncio.create_task(self.write_results(results))
+        running = set()
+
+        # 进程重启后先恢复上次在途的 simulation，已取出但没提交的 alpha 放回 sim_queue_ls
+        queued, posted = self.pending_queue.restore(self.username)
+        self.sim_queue_ls = queued
+        for location_url, queue_ids in posted.items():
+            await self.acquire_slot(slot_changed)
+            task = asyncio.create_task(self.resume_simulation(location_url, queue_ids, slot_changed, results))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+        try:
+            while True:
+                if len(self.sim_queue_ls) < 1:
+                    self.sim_queue_ls = await asyncio.to_thread(
+                        self.read_alphas_from_csv_in_batches, self.batch_number_for_every_queue)
+                    if not self.sim_queue_ls:
+                        if stop_when_empty and not running:
+                            await results.join()
+                            logging.info("Queue drained, stopping.")
+                            return
+                        logging.info("No more alphas available in the queue.")
+                        await asyncio.sleep(3)
+                        continue
+
+                # 等到有空闲槽位再取下一个 alpha，槽位由 run_one_simulation 结束时释放
+                await self.acquire_slot(slot_changed)
+                alpha = self.sim_queue_ls.pop(0)
+                task = asyncio.create_task(self.run_one_simulation(alpha, slot_changed, results))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        finally:
+            writer_task.cancel()
+            tasks = list(running)
+            for task in tasks:
+                task.cancel()
+            # 先等在途的 task 退出，再关它们用着的 session
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.result_sink.flush()
+            await self.close_sessions()
+
+    def manage_simulations(self, stop_when_empty=False):
+        asyncio.run(self.run(stop_when_empty))
+
+
+if __name__ == "__main__":
+    # Example usage
+    with open(expanduser('brain_credentials.txt')) as f:
+        credentials = json.load(f)
+
+    # Extract username and password from the list
+    username, password = credentials
+
+    alpha_list_file_path = 'alpha_list_pending_simulated.csv'   # replace with your actual file path
+
+    simulator = AsyncAlphaSimulator(max_concurrent=3, username=username, password=password, alpha_list_file_path=alpha_list_file_path,batch_number_for_every_queue=20)
+
+    simulator.manage_simulations()
@@ -0,0 +1,97 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import expanduser
+
+from AlphaSimulator import AlphaSimulator
+
+
+def load_credentials(credentials_path='brain_credentials.txt'):
+    '''
+    brain_credentials.txt 支持两种格式:
+        ["email","password"]                          单账号
+        [["email1","password1"],["email2","password2"]] 多账号
+    返回 [(username, password), ...]
+    '''
+    with open(expanduser(credentials_path)) as f:
+        credentials = json.load(f)
+
+    if credentials and isinstance(credentials[0], str):
+        credentials = [credentials]
+    return [tuple(pair) for pair in credentials]
+
+
+class AccountPool:
+    '''
+    多账号回测池:
+    1. 每个账号一个 AlphaSimulator，各自拥有 session、AIMD 并发窗口和退避状态
+    2. 所有账号共享同一个 SQLite 待回测队列，alpha 只会被一个账号取走
+    3. 每轮按空闲槽位从多到少给账号派活，处于退避期的账号只轮询不提交
+    4. 所有账号共用一个 ResultSink 写结果文件，在排队的 alpha 各自写 sim_queue_<账号>.csv
+    5. 所有账号并发登录，启动时间是最慢的那个账号的登录时间，而不是所有账号之和
+    '''
+
+    def __init__(self, credentials, max_concurrent, alpha_list_file_path, multi_simulation_size=1):
+        self.simulators = []
+        result_sink = None
+        for username, password in credentials:
+            # batch_number_for_every_queue=0: 每个账号只从共享队列取当前空闲槽位需要的数量，不囤积
+            simulator = AlphaSimulator(max_concurrent=max_concurrent, username=username, password=password,
+                                       alpha_list_file_path=alpha_list_file_path, batch_number_for_every_queue=0,
+                                       multi_simulation_size=multi_simulation_size, result_sink=result_sink,
+                                       sim_queue_file=f'sim_queue_{username}.csv', sign_in=False)
+            result_sink = simulator.result_sink
+            self.simulators.append(simulator)
+
+        if self.simulators:
+            with ThreadPoolExecutor(max_workers=len(self.simulators)) as pool:
+                list(pool.map(lambda simulator: simulator.client.reauthenticate(None), self.simulators))
+        for simulator in self.simulators:
+            if not simulator.session:
+                logging.error(f"{simulator.username} failed to sign in, backing off.")
+                simulator.backoff_until = time.monotonic() + 300
+
+    def available_simulators(self):
+        now = time.monotonic()
+        available = []
+        for simulator in self.simulators:
+            if simulator.backoff_until > now:
+                continue
+            if not simulator.session:
+                if not simulator.client.reauthenticate(None):
+                    simulator.backoff_until = now + 300
+                    continue
+            if simulator.free_slots() > 0:
+                available.append(simulator)
+        return sorted(available, key=lambda simulator: simulator.free_slots(), reverse=True)
+
+    def manage_simulations(self):
+        if not self.simulators:
+            logging.error("No account available. Exiting...")
+            return
+
+        self.simulators[0].metrics.start_exporter()
+        while True:
+            for simulator in self.simulators:
+                if simulator.session:
+                    simulator.check_simulation_status()
+
+            for simulator in self.available_simulators():
+                simulator.load_new_alpha_and_simulate()
+
+            # 睡到所有账号里最早的 Retry-After 到期，最多 3 秒
+            waits = [simulator.poll_scheduler.seconds_until_next() for simulator in self.simulators]
+            waits = [wait for wait in waits if wait is not None]
+            time.sleep(min(waits + [3]))
+
+
+if __name__ == "__main__":
+    # Example usage
+    credentials = load_credentials('brain_credentials.txt')
+
+    alpha_list_file_path = 'alpha_list_pending_simulated.csv'   # replace with your actual file path
+
+    pool = AccountPool(credentials, max_concurrent=3, alpha_list_file_path=alpha_list_file_path)
+
+    pool.manage_simulations()
@@ -8,6 +8,12 @@ import argparse
 import os
 import pandas as pd
 
+import brain_api
+from brain_api import BRAIN_API_URL
+from circuit_breaker import CircuitOpenError, backoff_delay, breaker_for
+from metrics import default_metrics
+from session_manager import SessionManager
+
 #  版本说明：增加打标签，方便平台查找并手动提交
 # 创建命令行参数解析器，根据需要可调整日期
 parser = argparse.ArgumentParser(description='Check Submission')
@@ -104,28 +110,30 @@ def sign_in():
         print(f"An error occurred while reading the credentials file: {e}")
         return None
 
-    s = requests.Session()
-    s.auth = (username, password)
-    while True:
-        try:
-            response = s.post('https://api.worldquantbrain.com/authentication')
-            response.raise_for_status()  # Raises a HTTPError if the status is 4xx, 5xx
-            print(f"{response.json()['user']['id']},Authentication successful.")
-            break  # Exit the loop on success
-        except requests.HTTPError as e:
-            print(f"HTTP error occurred: {e}. Retrying...")  # Provide more specific error message
-            time.sleep(10)
-        except Exception as e:
-            print(f"Error during authentication: {e}. Trying to login again.")
-            time.sleep(10)
-    return s
+    # 共用brain_api的登录：调好的连接池，网络错误一直重试；
+    # 重试只在 requests_wq 里做一层，连接池不再重试 5xx/429
+    return brain_api.sign_in(username=username, password=password, count_limit=None, retry=False)
+
+# 401 时统一通过它重新登录，同一个失效session只会触发一次登录
+session_manager = SessionManager(sign_in)
 
 def session_close(session):
     session.close()
 
-def requests_wq(s,type='get',url='',json=None,t=15):
+def requests_wq(s,type='get',url='',json=None,t=15,max_attempts=8):
+    '''
+    1. 429、5xx 和网络异常按指数退避加抖动重试，429 至少等 Retry-After 或 t 秒，最多 max_attempts 次；
+       session 由 sign_in 以 retry=False 建立，连接池本身不重试，max_attempts 就是实际发出的请求数上限
+    2. 只有 401 才重新登录后重试，网络异常按 1 退避重试，不重新登录
+    3. 其他状态（如 404）重试也没用，直接返回给调用方处理
+    4. 同一类接口连续失败会熔断，熔断期间直接抛 CircuitOpenError，直到半开探测成功
+    '''
     session = s
-    while True:
+    breaker = breaker_for(url)
+    ret = None
+    for attempt in range(max_attempts):
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit {breaker.name} is open, retry in {breaker.seconds_until_retry():.0f}s")
         try:
             if type == 'get':
                 ret = session.get(url)
@@ -136,38 +144,72 @@ def requests_wq(s,type='get',url='',json=None,t=15):
                     ret = session.post(url, json=json)
             if type == 'patch':
                 ret = session.patch(url, json=json)
-            if ret.status_code == 429:
-                print(f"状态={ret.status_code},延时{t}秒")
-                time.sleep(t)
-                continue
-            if ret.status_code in (200,201):
-                return ret, session
-            if ret.status_code == 401:
-                session = sign_in()
-                continue
-            else:
-                print(f"\033[31m状态={ret.status_code}，continue\033[0m")
-                continue
         except requests.RequestException as e:
-            print(f"Error during method execution: {e}. Retrying...")
-            time.sleep(10)
-            session = sign_in()
-            print(f"延时10秒，重新连接")
-    return None, None
+            breaker.record_failure()
+            default_metrics().count_retry(url, 'error')
+            delay = backoff_delay(attempt, base=10)
+            # 网络异常不重新登录，只有 401 才换 session
+            print(f"Error during method execution: {e}. 延时{delay:.0f}秒后重试")
+            time.sleep(delay)
+            continue
+        if ret.status_code in (200,201):
+            breaker.record_success()
+            return ret, session
+        if ret.status_code == 401:
+            breaker.record_success()
+            default_metrics().count_retry(url, '401')
+            session = session_manager.reauthenticate(session)
+            continue
+        if ret.status_code == 429 or ret.status_code >= 500:
+            breaker.record_failure()
+            default_metrics().count_retry(url, str(ret.status_code))
+            delay = max(float(ret.headers.get("Retry-After", 0)), backoff_delay(attempt, base=t if ret.status_code == 429 else 1))
+            print(f"\033[31m状态={ret.status_code},延时{delay:.0f}秒\033[0m")
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        print(f"\033[31m状态={ret.status_code}，不再重试\033[0m")
+        return ret, session
+    print(f"\033[31m{url} 重试{max_attempts}次仍失败\033[0m")
+    if ret is None:
+        raise requests.exceptions.RetryError(f"{url} failed after {max_attempts} attempts")
+    return ret, session
+def wait_for_circuit(url, error):
+    '''
+    熔断期间不发请求，也不算作检查结果：等到熔断器允许探测后由调用方重试同一个请求
+    '''
+    delay = max(breaker_for(url).seconds_until_retry(), 1)
+    print(f"\033[33m{error}，{delay:.0f}秒后重试\033[0m")
+    time.sleep(delay)
+
+
 # 检查Alpha提交状态（带超时）
+# 返回 "unavailable" 表示请求本身失败（网络、接口 5xx 等），不是检查结果，调用方不能据此打标签
 def get_check_submission(s, alpha_id):
     sess = s
+    url = f"{BRAIN_API_URL}/alphas/{alpha_id}/check"
     while True:
-        #result = s.get(f"https://api.worldquantbrain.com/alphas/{alpha_id}/check", timeout=30)
-        result,sess = requests_wq(sess,'get',f"https://api.worldquantbrain.com/alphas/{alpha_id}/check")
+        #result = s.get(f"{BRAIN_API_URL}/alphas/{alpha_id}/check", timeout=30)
+        try:
+            result,sess = requests_wq(sess,'get',url)
+        except CircuitOpenError as e:
+            wait_for_circuit(url, e)
+            continue
+        except requests.RequestException as e:
+            print(f"Alpha {alpha_id}: \033[31m 检查请求失败 {e} \033[0m")
+            return "unavailable",sess
+        if result.status_code >= 300:
+            print(f"Alpha {alpha_id}: \033[31m 检查请求失败，状态={result.status_code} \033[0m")
+            return "unavailable",sess
         if "retry-after" in result.headers:
             time.sleep(float(result.headers["Retry-After"]))
         else:
             break
-    if result.json().get("is", 0) == 0:
+    check = result.json()
+    if check.get("is", 0) == 0:
         print(f"Alpha {alpha_id}: logged out，返回 'sleep'")
         return "sleep",sess
-    checks_df = pd.DataFrame(result.json()["is"]["checks"])
+    checks_df = pd.DataFrame(check["is"]["checks"])
     # 检查 SELF_CORRELATION 是否为 "nan"
     self_correlation_value = checks_df[checks_df["name"] == "SELF_CORRELATION"]["value"].values[0]
     pc = self_correlation_value
@@ -204,8 +246,16 @@ def set_alpha_properties(
         "combo": {"description": combo_desc},
         "selection": {"description": selection_desc},
     }
-    response,sess = requests_wq(sess,'patch',"https://api.worldquantbrain.com/alphas/" + alpha_id,params)
-    return response,sess
+    url = BRAIN_API_URL + "/alphas/" + alpha_id
+    while True:
+        try:
+            response,sess = requests_wq(sess,'patch',url,params)
+            return response,sess
+        except CircuitOpenError as e:
+            wait_for_circuit(url, e)
+        except requests.RequestException as e:
+            print(f"Alpha {alpha_id}: \033[31m 设置属性失败 {e} \033[0m")
+            return None,sess
 
 # 读取凭据
 username, password = read_credentials(args.credentials_file)
@@ -231,7 +281,7 @@ region = args.region
 def get_alpha_count(s,status):
     sess = s
     try:
-        url = f"https://api.worldquantbrain.com/users/self/alphas?limit=1&status={status}"
+        url = f"{BRAIN_API_URL}/users/self/alphas?limit=1&status={status}"
         response,sess = requests_wq(sess,'get',url)
         if response.status_code < 300:
             count = response.json().get('count', 0)
@@ -250,7 +300,7 @@ def get_alphas(s,start_date, end_date, sharpe_th, fitness_th, turnover_th, regio
     current_year = datetime.now().strftime('%Y')
     for i in range(0, alpha_num, 100):
         print(i)
-        url = f"https://api.worldquantbrain.com/users/self/alphas?limit=100&offset={i}" \
+        url = f"{BRAIN_API_URL}/users/self/alphas?limit=100&offset={i}" \
               f"&status=UNSUBMITTED%1FIS_FAIL&dateCreated%3E={current_year}-{start_date}" \
               f"T00:00:00-04:00&dateCreated%3C{current_year}-{end_date}" \
               f"T00:00:00-04:00&is.fitness%3E{fitness_th}&is.sharpe%3E{sharpe_th}" \
@@ -258,7 +308,14 @@ def get_alphas(s,start_date, end_date, sharpe_th, fitness_th, turnover_th, regio
               f"&is.turnover%3C{turnover_th}"
 
         #response = s.get(url)
-        response,sess = requests_wq(sess,'get',url)
+        try:
+            response,sess = requests_wq(sess,'get',url)
+        except requests.RequestException as e:
+            print(f"\033[31m获取Alpha列表失败 {e}，只检查已取到的 {len(output)} 个\033[0m")
+            break
+        if response.status_code >= 300:
+            print(f"\033[31m获取Alpha列表失败，状态={response.status_code}，只检查已取到的 {len(output)} 个\033[0m")
+            break
         alpha_list = response.json()["results"]
         if len(alpha_list) == 0: break
         for j in range(len(alpha_list)):
@@ -310,10 +367,11 @@ def main():
     if not username or not password:
         print("未能获取有效的用户名或密码，请检查凭据文件格式。")
         exit()
-    s = sign_in()
+    s = session_manager.reauthenticate(None)
     if not s:
         print("登录失败，程序退出")
         return
+    default_metrics().start_exporter()
 
     initial_submitted_count,s = get_alpha_count(s,"ACTIVE")
     print(f"平台上已提交的Alpha数量: {initial_submitted_count}")
@@ -336,7 +394,10 @@ def main():
 
         check_result,s = get_check_submission(s, alpha_id)
 
-        if check_result in ("timeout","nan","ERROR","error"):
+        if check_result == "unavailable":
+            print(f"Alpha={alpha_id}: \033[33m 检查请求失败，不打标签，下次运行再检查 \033[0m")
+            continue
+        if check_result in ("timeout","nan","ERROR"):
             set_alpha_properties(s, alpha_id, name=datetime.now().strftime("%Y.%m.%d"), tags="timeout")
             continue
         elif check_result == "FAIL":
@@ -0,0 +1,246 @@
+'''
+整条回测流水线的吞吐压测，对着本地替身服务器（mock_brain_server.py）跑，不消耗真实额度:
+1. --driver 选被测的提交方式：alpha_simulator（AlphaSimulator 槽位调度）、async_simulator（AsyncAlphaSimulator，
+   只支持普通 simulation）、multi_simulate（machine_lib.multi_simulate）、sequential（world*.py 里一个一个 POST
+   再轮询的循环）；all 会每种各起一个子进程依次跑
+2. 默认自动起一个替身服务器子进程（--latency/--rate-429/--sim-duration 等参数透传），也可以用 --url 指定已经在跑的
+3. 所有状态文件（队列、去重索引、缓存、限流桶、结果）都放在一个新的临时目录里，每次都是冷启动
+4. 输出 JSON：alphas/hour、槽位利用率、每个完成的 alpha 平均请求数、POST 到拿到结果的 p50/p95 延迟、峰值 RSS、
+   当前 git commit；--output 给了就再追加一行到那个 jsonl 文件，方便跨 commit 对比
+
+用法:
+    python bench_pipeline.py --driver alpha_simulator --alphas 1000 --slots 8 --sim-duration 2 --rate-scale 100
+    python bench_pipeline.py --driver all --alphas 10000 --multi-size 10 --output bench_results.jsonl
+'''
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+try:
+    import resource
+except ImportError:
+    # Windows 上没有 resource，峰值 RSS 记为 None
+    resource = None
+
+DRIVERS = ('alpha_simulator', 'async_simulator', 'multi_simulate', 'sequential')
+BENCH_USER = ('bench@example.com', 'bench')
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_alphas(count, region='USA', universe='TOP3000', neut='SUBINDUSTRY'):
+    '''
+    count 个互不相同的表达式，返回 (expression, decay) 列表（machine_lib.generate_sim_data 的输入格式）
+    '''
+    return [(f'rank(ts_delta(close, {i % 250 + 1}) * ts_std_dev(volume, {i // 250 + 2}))', i % 10)
+            for i in range(count)]
+
+
+def start_mock(args):
+    command = [sys.executable, '-u', os.path.join(REPO_DIR, 'mock_brain_server.py'), '--port', '0',
+               '--latency', str(args.latency), '--rate-429', str(args.rate_429),
+               '--sim-duration', str(args.sim_duration), '--sim-sigma', str(args.sim_sigma),
+               '--poll-interval', str(args.poll_interval)]
+    if args.session_ttl is not None:
+        command += ['--session-ttl', str(args.session_ttl)]
+    if args.seed is not None:
+        command += ['--seed', str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=REPO_DIR)
+    # 第一行是 "Mock BRAIN API listening on http://127.0.0.1:<port>"
+    url = process.stdout.readline().strip().rsplit(' ', 1)[-1]
+    return process, url
+
+
+def run_alpha_simulator(alphas, args):
+    import AlphaSimulator
+    from machine_lib import generate_sim_data
+
+    simulator = AlphaSimulator.AlphaSimulator(args.slots, *BENCH_USER, 'bench_queue.csv', 100, args.multi_size)
+    simulator.pending_queue.push(generate_sim_data(alphas, 'USA', 'TOP3000', 'SUBINDUSTRY'))
+    simulator.manage_simulations(stop_when_empty=True)
+    simulator.result_sink.flush()
+    return args.slots
+
+
+def run_async_simulator(alphas, args):
+    '''
+    替身服务器的地址是 127.0.0.1，顺便覆盖 aiohttp 对 IP 主机 cookie 的处理
+    '''
+    import AsyncAlphaSimulator
+    from machine_lib import generate_sim_data
+
+    simulator = AsyncAlphaSimulator.AsyncAlphaSimulator(args.slots, *BENCH_USER, 'bench_queue.csv', 100)
+    simulator.pending_queue.push(generate_sim_data(alphas, 'USA', 'TOP3000', 'SUBINDUSTRY'))
+    simulator.manage_simulations(stop_when_empty=True)
+    return args.slots
+
+
+def run_multi_simulate(alphas, args):
+    import machine_lib
+
+    tasks = [alphas[i:i + args.multi_size] for i in range(0, len(alphas), args.multi_size)]
+    pools = [tasks[i:i + args.slots] for i in range(0, len(tasks), args.slots)]
+    machine_lib.multi_simulate(pools, 'SUBINDUSTRY', 'USA', 'TOP3000', 0)
+    return min(args.slots, len(tasks))
+
+
+def run_sequential(alphas, args):
+    '''
+    和 world*.py 的提交循环一致：每 100 个重新登录，POST 后按 Retry-After 轮询到结束再提交下一个
+    '''
+    from brain_api import sign_in, simulate, simulated_result
+    from machine_lib import generate_sim_data
+
+    sess = sign_in(username=BENCH_USER[0], password=BENCH_USER[1])
+    for index, alpha in enumerate(generate_sim_data(alphas, 'USA', 'TOP3000', 'SUBINDUSTRY'), start=1):
+        if index % 100 == 0:
+            sess = sign_in(username=BENCH_USER[0], password=BENCH_USER[1])
+        try:
+            sim_progress_url = simulate(sess, alpha)
+            if sim_progress_url is None:
+                simulated_result(alpha)['id']
+                continue
+            while True:
+                sim_progress_resp = sess.get(sim_progress_url)
+                retry_after_sec = float(sim_progress_resp.headers.get("Retry-After", 0))
+                if retry_after_sec == 0:
+                    break
+                time.sleep(retry_after_sec)
+            sim_progress_resp.json()["alpha"]
+        except Exception as e:
+            print(f"{index}: failed: {e}")
+    return 1
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(driver, url, slots, started, elapsed, args):
+    timeline = requests.get(f'{url}/__simulations').json()
+    stats = requests.get(f'{url}/__stats').json()
+    finished = [sim for sim in timeline if sim['finished'] is not None]
+    completed = sum(sim['alphas'] for sim in finished)
+    # 延迟按 alpha 加权：一个 multi-simulation 里的每个 alpha 都算一次
+    latencies = [sim['finished'] - sim['created'] for sim in finished for _ in range(sim['alphas'])]
+    busy = sum(sim['finished'] - sim['created'] for sim in finished)
+    api_stats = {key: count for key, count in stats.items() if '__' not in key}
+    total_requests = sum(api_stats.values())
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'driver': driver,
+        'commit': commit,
+        'time': started,
+        'alphas': args.alphas,
+        'completed': completed,
+        'slots': slots,
+        'multi_size': args.multi_size if driver not in ('sequential', 'async_simulator') else 1,
+        'seconds': round(elapsed, 3),
+        'alphas_per_hour': round(completed / elapsed * 3600, 1) if elapsed else None,
+        'slot_utilization': round(busy / (slots * elapsed), 4) if elapsed else None,
+        'requests': total_requests,
+        'requests_per_alpha': round(total_requests / completed, 3) if completed else None,
+        'latency_p50': round(percentile(latencies, 0.5), 3) if latencies else None,
+        'latency_p95': round(percentile(latencies, 0.95), 3) if latencies else None,
+        'responses_429': sum(count for key, count in api_stats.items() if key.endswith(' 429')),
+        'responses_401': sum(count for key, count in api_stats.items() if key.endswith(' 401')),
+        # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1) if resource else None,
+        'mock': {'latency': args.latency, 'rate_429': args.rate_429, 'sim_duration': args.sim_duration,
+                 'sim_sigma': args.sim_sigma, 'poll_interval': args.poll_interval},
+        'rate_scale': args.rate_scale,
+    }
+
+
+def run_driver(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='brain_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    mock = None
+    url = args.url
+    if url is None:
+        mock, url = start_mock(args)
+    # 这些环境变量必须在 import brain_api 之前设置
+    os.environ['BRAIN_API_URL'] = url
+    os.environ['BRAIN_DEDUP_INDEX'] = os.path.join(workdir, 'simulated_index.sqlite')
+    os.environ['BRAIN_HTTP_CACHE'] = os.path.join(workdir, 'http_cache.sqlite')
+    os.environ['BRAIN_RATE_LIMIT_DIR'] = os.path.join(workdir, 'rate_limit')
+    os.environ['BRAIN_METRICS_DIR'] = os.path.join(workdir, 'metrics')
+    os.environ['BRAIN_RATE_LIMIT_SCALE'] = str(args.rate_scale)
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(workdir)
+
+    runner = {'alpha_simulator': run_alpha_simulator, 'async_simulator': run_async_simulator,
+              'multi_simulate': run_multi_simulate, 'sequential': run_sequential}[args.driver]
+    try:
+        # 被测脚本自己的 print 都打到 stderr，stdout 只留结果 JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            alphas = make_alphas(args.alphas)
+            started = time.time()
+            slots = runner(alphas, args)
+            elapsed = time.time() - started
+        result = summarize(args.driver, url, slots, started, elapsed, args)
+        result['workdir'] = workdir
+        return result
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+
+
+def run_all(args):
+    '''
+    每种 driver 一个子进程，峰值 RSS 才不会互相影响
+    '''
+    results = []
+    for driver in DRIVERS:
+        command = [sys.executable, os.path.abspath(__file__), '--driver', driver]
+        for name, value in vars(args).items():
+            if name in ('driver', 'output', 'workdir') or value is None:
+                continue
+            command += [f'--{name.replace("_", "-")}', str(value)]
+        completed = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True)
+        results.append(json.loads(completed.stdout))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the simulation pipeline against the local mock BRAIN API')
+    parser.add_argument('--driver', choices=DRIVERS + ('all',), default='alpha_simulator')
+    parser.add_argument('--alphas', type=int, default=1000, help='number of queued alphas')
+    parser.add_argument('--slots', type=int, default=8, help='concurrent simulations (AlphaSimulator max_concurrent, '
+                                                             'tasks per pool for multi_simulate)')
+    parser.add_argument('--multi-size', type=int, default=1, help='alphas per multi-simulation')
+    parser.add_argument('--rate-scale', type=float, default=1.0, help='multiply the client-side rate limits')
+    parser.add_argument('--url', default=None, help='use an already running mock server instead of starting one')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--sim-duration', type=float, default=2.0)
+    parser.add_argument('--sim-sigma', type=float, default=0.3)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--session-ttl', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workdir', default=None, help='directory for queue/index/cache files (default: new temp dir)')
+    parser.add_argument('--output', default=None, help='append the JSON results to this jsonl file')
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    results = run_all(args) if args.driver == 'all' else [run_driver(args)]
+    print(json.dumps(results if args.driver == 'all' else results[0], indent=2))
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(result, ensure_ascii=False) + '\n' for result in results)
@@ -0,0 +1,155 @@
+'''
+HTTP/1.1 (requests) 与 HTTP/2 (httpx) 两种传输的轮询吞吐对比，不访问真实的 BRAIN:
+1. 本地起两个替身服务器：HTTP/1.1 用 ThreadingHTTPServer（keep-alive），HTTP/2 用 h2 写的 asyncio 服务器（h2c prior knowledge）
+2. 两个服务器对 /simulations/{id} 都是延迟 --delay 秒后返回一个已完成的 simulation，并统计收到的 TCP 连接数
+3. --concurrency 个线程共用一个 session 一共发 --requests 个 GET，输出每种传输的 requests/sec 和 socket 数（JSON）
+
+用法: python bench_transport.py --requests 2000 --concurrency 64 --delay 0.05
+需要 pip install httpx[http2]
+'''
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from brain_api import HTTP2Adapter, RateLimitedAdapter
+
+BODY = json.dumps({'id': 'bench', 'status': 'COMPLETE', 'alpha': 'A1'}).encode()
+
+
+class NoLimit:
+    '''
+    压测时不经过本机共享的令牌桶，只比较传输本身
+    '''
+
+    def acquire(self, url, account=''):
+        return 0.0
+
+    def penalize(self, url, retry_after=None, account=''):
+        pass
+
+
+def start_http1_server(delay):
+    stats = {'connections': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            stats['connections'] += 1
+            super().setup()
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def start_http2_server(delay):
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    stats = {'connections': 0}
+
+    class H2Protocol(asyncio.Protocol):
+        def connection_made(self, transport):
+            stats['connections'] += 1
+            self.transport = transport
+            self.conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+            self.conn.initiate_connection()
+            self.transport.write(self.conn.data_to_send())
+
+        def data_received(self, data):
+            for event in self.conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    asyncio.ensure_future(self.respond(event.stream_id))
+                elif isinstance(event, h2.events.DataReceived):
+                    self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            self.transport.write(self.conn.data_to_send())
+
+        async def respond(self, stream_id):
+            await asyncio.sleep(delay)
+            if self.transport.is_closing():
+                return
+            self.conn.send_headers(stream_id, [(':status', '200'), ('content-type', 'application/json'),
+                                               ('content-length', str(len(BODY)))])
+            self.conn.send_data(stream_id, BODY, end_stream=True)
+            self.transport.write(self.conn.data_to_send())
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(loop.create_server(H2Protocol, '127.0.0.1', 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server, stats
+
+
+def run(session, url, total, concurrency):
+    def poll(i):
+        response = session.get(f'{url}/simulations/{i}')
+        response.raise_for_status()
+        return response.json()['status']
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        statuses = list(pool.map(poll, range(total)))
+    elapsed = time.perf_counter() - start
+    assert statuses.count('COMPLETE') == total
+    return elapsed
+
+
+def bench_http1(total, concurrency, delay):
+    server, stats = start_http1_server(delay)
+    session = requests.Session()
+    session.mount('http://', RateLimitedAdapter(limiter=NoLimit(), pool_connections=concurrency,
+                                                pool_maxsize=concurrency))
+    elapsed = run(session, f'http://127.0.0.1:{server.server_address[1]}', total, concurrency)
+    server.shutdown()
+    return {'transport': 'http1', 'requests': total, 'seconds': round(elapsed, 3),
+            'requests_per_sec': round(total / elapsed, 1), 'sockets': stats['connections']}
+
+
+def bench_http2(total, concurrency, delay, connections):
+    import httpx
+
+    server, stats = start_http2_server(delay)
+    port = server.sockets[0].getsockname()[1]
+    # 本地替身服务器没有 TLS，用 prior knowledge 直接说 HTTP/2（http1=False）
+    adapter = HTTP2Adapter(limiter=NoLimit(), pool_size=connections, http1=False)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    elapsed = run(session, f'http://127.0.0.1:{port}', total, concurrency)
+    adapter.close()
+    return {'transport': 'http2', 'requests': total, 'seconds': round(elapsed, 3),
+            'requests_per_sec': round(total / elapsed, 1), 'sockets': stats['connections']}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark HTTP/1.1 vs HTTP/2 polling against a local stand-in server')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--delay', type=float, default=0.05, help='server-side latency per request in seconds')
+    parser.add_argument('--http2-connections', type=int, default=2, help='max connections for the HTTP/2 client')
+    args = parser.parse_args()
+
+    results = [bench_http1(args.requests, args.concurrency, args.delay)]
+    try:
+        results.append(bench_http2(args.requests, args.concurrency, args.delay, args.http2_connections))
+    except ImportError as e:
+        results.append({'transport': 'http2', 'error': f'httpx[http2] not installed: {e}'})
+    print(json.dumps(results, indent=2))
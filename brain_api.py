@@ -0,0 +1,473 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import expanduser
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+from dedup_index import default_index
+from fast_json import FastJSONResponse
+from http_cache import cached_get, invalidate
+from metrics import default_metrics
+from rate_limiter import default_limiter
+from result_sink import error_result
+from session_manager import SessionManager
+
+# 可以用环境变量指向本地的 mock 服务器
+BRAIN_API_URL = os.environ.get('BRAIN_API_URL', 'https://api.worldquantbrain.com')
+
+# 所有脚本共用的重试策略，在连接池层面生效:
+# 连接失败、读超时、5xx 按指数退避重试，并遵守 Retry-After；429 交给 RateLimitedAdapter 和共享限流器处理；
+# POST 不在 allowed_methods 里，避免一次 simulation 被重复提交
+RETRY_POLICY = Retry(
+    total=5,
+    connect=5,
+    read=3,
+    status=5,
+    backoff_factor=1,
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS', 'PATCH']),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+
+def read_credentials(credentials_path='brain_credentials.txt'):
+    '''
+    brain_credentials.txt 的格式: ["your email","password"]
+    '''
+    with open(expanduser(credentials_path)) as f:
+        username, password = json.load(f)
+    return username, password
+
+
+# 不改服务器上资源的方法，其余方法成功后要让缓存失效
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    '''
+    1. 每个请求发送前先从本机共享的令牌桶（rate_limiter）拿令牌
+    2. 收到 429 时通知限流器减速，GET 等幂等请求等到 Retry-After 之后重发，POST 直接把 429 交给调用方
+    3. 返回的 Response 是 FastJSONResponse，json() 只解析一次
+    4. 每次发送的耗时、状态码和 429 重试次数记到 metrics
+    5. PATCH/POST 等改资源的请求成功后，去掉这个资源在 http_cache 里的缓存（如改了 tags 的 /alphas/{id}）
+    6. on_response(method, url, status_code, latency, retry_after) 在每次收到响应后调用，包括这里内部重发前的 429，
+       AlphaSimulator 用它把所有请求（不只是 POST）的 429 和 Retry-After 交给 AIMD 并发窗口
+    '''
+
+    def __init__(self, account='', limiter=None, max_429_retries=5, metrics=None, on_response=None, **kwargs):
+        self.account = account
+        self.limiter = limiter or default_limiter()
+        self.max_429_retries = max_429_retries
+        self.metrics = metrics or default_metrics()
+        self.on_response = on_response
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        for attempt in range(self.max_429_retries + 1):
+            self.limiter.acquire(request.url, self.account)
+            start = time.monotonic()
+            try:
+                response = self.send_once(request, **kwargs)
+            except requests.exceptions.RequestException:
+                self.metrics.observe_request(request.method, request.url, 'error', time.monotonic() - start)
+                raise
+            latency = time.monotonic() - start
+            self.metrics.observe_request(request.method, request.url, response.status_code, latency)
+            if self.on_response is not None:
+                self.on_response(request.method, request.url, response.status_code, latency,
+                                 response.headers.get('Retry-After'))
+            if response.status_code != 429:
+                if request.method not in SAFE_METHODS and response.status_code < 400:
+                    invalidate(request.url)
+                return response
+            self.limiter.penalize(request.url, response.headers.get('Retry-After'), self.account)
+            if request.method == 'POST' or attempt == self.max_429_retries:
+                return response
+            self.metrics.count_retry(request.url, '429')
+            response.close()
+
+    def send_once(self, request, **kwargs):
+        return super().send(request, **kwargs)
+
+    def build_response(self, req, resp):
+        response = super().build_response(req, resp)
+        response.__class__ = FastJSONResponse
+        return response
+
+
+# HTTP/2 下不允许出现的逐跳首部，requests 默认会带 Connection: keep-alive
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade', 'host'}
+
+
+class HTTP2Adapter(RateLimitedAdapter):
+    '''
+    HTTP/2 传输：底层换成 httpx.Client(http2=True)，并发的轮询在少数几个连接上多路复用，
+    不再是一个请求占一个 socket。服务器不支持 HTTP/2 时 httpx 经 ALPN 协商自动退回 HTTP/1.1。
+    限流、429 处理、FastJSONResponse 与 RateLimitedAdapter 相同；
+    连接失败由 httpx 重试 3 次，urllib3 的 RETRY_POLICY 在这里不生效。
+    需要 pip install httpx[http2]，没装时构造函数抛 ImportError
+    '''
+
+    def __init__(self, account='', limiter=None, max_429_retries=5, metrics=None, on_response=None, pool_size=10,
+                 client=None, http1=True):
+        import httpx
+
+        # 传了 transport 时 httpx.Client 会忽略自己的 limits 参数，连接池上限要设在 transport 上；
+        # http1=False 是 prior knowledge 模式，直接说 HTTP/2（没有 TLS 的本地测试服务器用）
+        self.client = client or httpx.Client(
+            transport=httpx.HTTPTransport(
+                http1=http1,
+                http2=True,
+                retries=3,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            ),
+        )
+        super().__init__(account=account, limiter=limiter, max_429_retries=max_429_retries, metrics=metrics,
+                         on_response=on_response)
+
+    def send_once(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        import httpx
+
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        elif timeout is None:
+            timeout = httpx.Timeout(None)
+        headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+        try:
+            resp = self.client.request(request.method, request.url, headers=headers, content=request.body,
+                                       timeout=timeout)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e, request=request)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+
+        response = FastJSONResponse()
+        response.status_code = resp.status_code
+        response.reason = resp.reason_phrase
+        response.headers = CaseInsensitiveDict(resp.headers)
+        response._content = resp.content
+        response.encoding = resp.encoding
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        self.client.close()
+        super().close()
+
+
+def new_session(username, password, pool_size=10, transport=None, retry=True, on_response=None):
+    '''
+    建一个调好连接池的 session：连接池大小和并发数一致，keep-alive 复用连接，少做 TLS 握手；
+    所有请求都经过本机共享的限流器。
+    transport='http2'（或环境变量 BRAIN_HTTP_TRANSPORT=http2）时用 HTTP2Adapter，没装 httpx[http2] 时退回 HTTP/1.1。
+    retry=False 时连接池不做 5xx/429 重试（仍然限流），给自己有重试循环的调用方用，避免两层重试叠加；
+    on_response 见 RateLimitedAdapter
+    '''
+    s = requests.Session()
+    s.auth = (username, password)
+    transport = transport or os.environ.get('BRAIN_HTTP_TRANSPORT', 'http1')
+    max_429_retries = 5 if retry else 0
+    adapter = None
+    if transport == 'http2':
+        try:
+            adapter = HTTP2Adapter(account=username, max_429_retries=max_429_retries, on_response=on_response,
+                                   pool_size=pool_size)
+        except ImportError as e:
+            logging.warning(f"HTTP/2 transport unavailable ({e}), falling back to HTTP/1.1.")
+    if adapter is None:
+        adapter = RateLimitedAdapter(account=username, max_429_retries=max_429_retries, on_response=on_response,
+                                     pool_connections=pool_size, pool_maxsize=pool_size,
+                                     max_retries=RETRY_POLICY if retry else 0)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    return s
+
+
+def authenticate(s, biometrics=False):
+    '''
+    POST /authentication；biometrics=True 时遇到人脸认证会提示用户完成后继续
+    '''
+    response = s.post(f'{BRAIN_API_URL}/authentication')
+
+    if biometrics and response.status_code == requests.codes.unauthorized \
+            and response.headers.get("WWW-Authenticate") == "persona":
+        biometrics_url = urljoin(response.url, response.headers["Location"])
+        print(
+            "Complete biometrics authentication by scanning your face. Follow the link: \n"
+            + biometrics_url + "\n"
+        )
+        input("Press any key after you complete the biometrics authentication.")
+
+        # Retry the authentication after biometrics
+        response = s.post(biometrics_url)
+        while response.status_code != 201:
+            input("Biometrics authentication is not complete. Please try again and press any key when completed.")
+            response = s.post(biometrics_url)
+
+        print("Biometrics authentication completed.")
+
+    return response
+
+
+def sign_in(credentials_path='brain_credentials.txt', username=None, password=None, pool_size=10,
+            count_limit=30, biometrics=False, transport=None, retry=True, on_response=None):
+    '''
+    所有脚本共用的登录函数，返回登录好的 session，失败返回 None。
+    没给 username/password 时从 credentials_path 读取；网络错误每 15 秒重试一次，
+    count_limit=None 表示一直重试；retry、on_response 见 new_session
+    '''
+    if username is None:
+        username, password = read_credentials(credentials_path)
+
+    s = new_session(username, password, pool_size, transport, retry, on_response)
+    count = 0
+
+    while True:
+        try:
+            response = authenticate(s, biometrics)
+            if response.status_code == requests.codes.unauthorized:
+                logging.error(f"Incorrect username or password for {username}.")
+                print("\nIncorrect username or password. Please check your credentials.\n")
+                return None
+            response.raise_for_status()
+            break
+        except requests.exceptions.RequestException as e:
+            count += 1
+            logging.error(f"Connection down, trying to login again... {e}")
+            if count_limit is not None and count > count_limit:
+                logging.error(f"{username} failed too many times, returning None.")
+                return None
+            time.sleep(15)
+
+    logging.info("Login to BRAIN successfully.")
+    return s
+
+
+# -------------------------------------------------------------------------
+# 各个接口的封装，s 可以是 requests.Session，也可以是 BrainClient / SessionManager
+# -------------------------------------------------------------------------
+def wait_retry_after(s, url):
+    '''
+    GET url，如果响应带 Retry-After 就按它等待后重试，直到结果就绪
+    '''
+    while True:
+        response = s.get(url)
+        retry_after = float(response.headers.get("Retry-After", 0))
+        if retry_after == 0:
+            return response
+        time.sleep(retry_after)
+
+
+def session_account(s):
+    '''
+    s 登录用的账号：BrainClient 有 username，requests.Session 的 auth 是 (username, password)
+    '''
+    if getattr(s, 'username', None):
+        return s.username
+    auth = getattr(getattr(s, 'session', s), 'auth', None)
+    return auth[0] if isinstance(auth, tuple) else None
+
+
+def simulate(s, payload, dedup=True):
+    '''
+    POST /simulations，payload 是单个 alpha 或 multi-simulation 的 children 列表，返回 Location。
+    dedup=True 时先查去重索引（Location 只有提交它的账号能轮询）:
+    1. 单个 alpha 由同一个账号提交过就直接返回上次的 Location，不再 POST；
+       别的账号已经回测出结果的返回 None（结果用 simulated_result 取），别的账号提交了但还没结果的照常提交
+    2. multi-simulation 只提交上面两种情况以外的 children，全部跳过时返回 None
+    结果要记进索引的话，提交后用 simulation_results 等结果
+    '''
+    index = default_index() if dedup else None
+    account = session_account(s)
+
+    def own(hit):
+        return hit['account'] is not None and hit['account'] == account
+
+    if index is not None:
+        if isinstance(payload, dict):
+            hit = index.lookup(payload)
+            if hit is not None and own(hit):
+                logging.info(f"Duplicate alpha, reusing {hit['location']}: {payload.get('regular')}")
+                return hit['location']
+            if hit is not None and hit['result']:
+                logging.info(f"Alpha was simulated by {hit['account']}, skipping: {payload.get('regular')}")
+                return None
+        else:
+            hits = [index.lookup(alpha) for alpha in payload]
+            payload = [alpha for alpha, hit in zip(payload, hits) if hit is None or not (hit['result'] or own(hit))]
+            if not payload:
+                logging.info("All children were simulated before, skipping this multi-simulation.")
+                return None
+            if len(payload) == 1:
+                payload = payload[0]
+
+    response = s.post(f'{BRAIN_API_URL}/simulations', json=payload)
+    response.raise_for_status()
+    location = response.headers['Location']
+    if index is not None:
+        index.record_posted(payload, location, account)
+    return location
+
+
+def simulated_result(payload):
+    '''
+    去重索引里单个 alpha 已有的结果（alpha 详情，带 id 和指标），没有返回 None；
+    simulate 因为别的账号回测过而返回 None 时，用它代替轮询 Location
+    '''
+    hit = default_index().lookup(payload)
+    return hit['result'] if hit is not None else None
+
+
+def simulation_results(s, location, dedup=True):
+    '''
+    等 simulate 返回的 Location 结束，返回结果列表（multi-simulation 按 child 顺序，每个是 alpha 详情，
+    出错的是 result_sink.error_result，id 为空、带 message 和 simulation_id），dedup=True 时把结果记进去重索引，出错的 alpha 从索引里去掉以便重新提交
+    '''
+    response = wait_retry_after(s, location)
+    response.raise_for_status()
+    progress = response.json()
+    results = []
+    for child in progress.get('children') or [None]:
+        if child is not None:
+            child_response = s.get(f'{BRAIN_API_URL}/simulations/{child}')
+            child_response.raise_for_status()
+            child_progress = child_response.json()
+        else:
+            child_progress = progress
+        alpha_id = child_progress.get('alpha')
+        results.append(get_alpha(s, alpha_id) if alpha_id else error_result(child_progress, child))
+    if dedup:
+        default_index().record_results(location, results)
+    return results
+
+
+def poll(s, location):
+    '''
+    GET 一次 simulation 进度，返回 (response, retry_after)，retry_after == 0 表示已结束
+    '''
+    response = s.get(location)
+    response.raise_for_status()
+    return response, float(response.headers.get("Retry-After", 0))
+
+
+def get_alpha(s, alpha_id):
+    response = wait_retry_after(s, f'{BRAIN_API_URL}/alphas/{alpha_id}')
+    response.raise_for_status()
+    return response.json()
+
+
+def check(s, alpha_id):
+    response = wait_retry_after(s, f'{BRAIN_API_URL}/alphas/{alpha_id}/check')
+    response.raise_for_status()
+    return response.json()
+
+
+def patch_alpha(s, alpha_id, params):
+    response = s.patch(f'{BRAIN_API_URL}/alphas/{alpha_id}', json=params)
+    response.raise_for_status()
+    return response
+
+
+def list_alphas(s, **params):
+    response = s.get(f'{BRAIN_API_URL}/users/self/alphas', params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def data_sets(s, **params):
+    response = cached_get(s, f'{BRAIN_API_URL}/data-sets', params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def data_fields(s, **params):
+    response = cached_get(s, f'{BRAIN_API_URL}/data-fields', params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def iter_pages(s, url, params=None, page_size=50, workers=4, cache=True):
+    '''
+    分页接口（响应是 {"count": ..., "results": [...]}）的并发翻页，逐页 yield 每页的 results:
+    1. 先取 offset=0 的第一页，从里面读真实的 count，不再猜页数
+    2. 剩下的 offset 交给最多 workers 个线程并发取，仍按 offset 顺序 yield（速率由共享的令牌桶控制）
+    3. cache=True 时每一页走 cached_get，各页单独缓存；调用方提前停止迭代时取消还没开始的请求
+    '''
+    get = cached_get if cache else (lambda s, url, params=None: s.get(url, params=params))
+
+    def fetch(offset):
+        response = get(s, url, params={**(params or {}), 'limit': page_size, 'offset': offset})
+        response.raise_for_status()
+        return response.json()
+
+    first_page = fetch(0)
+    yield first_page['results']
+    offsets = range(page_size, first_page['count'], page_size)
+    if not offsets:
+        return
+    pool = ThreadPoolExecutor(max_workers=min(workers, len(offsets)))
+    try:
+        for page in pool.map(fetch, offsets):
+            yield page['results']
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+class BrainClient(SessionManager):
+    '''
+    BRAIN API 客户端：一个账号一个实例，多线程共用
+    1. 底层是 new_session 建的连接池，pool_size 一般取并发数
+    2. 继承 SessionManager，401/断线后 single-flight 重新登录
+    3. get/post/patch 可以当 requests.Session 用，也可以调用各接口的封装方法
+    4. on_response 挂在每次重新登录建的 session 上，见 RateLimitedAdapter
+    '''
+
+    def __init__(self, username, password, pool_size=10, transport=None, on_response=None):
+        self.username = username
+        super().__init__(lambda: sign_in(username=username, password=password, pool_size=pool_size,
+                                         transport=transport, on_response=on_response))
+
+    @classmethod
+    def from_credentials_file(cls, credentials_path='brain_credentials.txt', pool_size=10, transport=None):
+        username, password = read_credentials(credentials_path)
+        return cls(username, password, pool_size, transport)
+
+    def simulate(self, payload, dedup=True):
+        return simulate(self, payload, dedup)
+
+    def simulation_results(self, location, dedup=True):
+        return simulation_results(self, location, dedup)
+
+    def poll(self, location):
+        return poll(self, location)
+
+    def get_alpha(self, alpha_id):
+        return get_alpha(self, alpha_id)
+
+    def check(self, alpha_id):
+        return check(self, alpha_id)
+
+    def patch_alpha(self, alpha_id, params):
+        return patch_alpha(self, alpha_id, params)
+
+    def list_alphas(self, **params):
+        return list_alphas(self, **params)
+
+    def data_sets(self, **params):
+        return data_sets(self, **params)
+
+    def data_fields(self, **params):
+        return data_fields(self, **params)
+
+    def iter_pages(self, url, params=None, page_size=50, workers=4, cache=True):
+        return iter_pages(self, url, params, page_size, workers, cache)
@@ -0,0 +1,118 @@
+'''
+多区域的数据集/字段目录全量抓取:
+1. 对每个 (region, universe, delay) 组合先取数据集列表，再把需要更新的数据集交给线程池并发拉字段；
+   所有请求都经过本机共享的令牌桶（rate_limiter），并发再高也不会超过全局速率
+2. 结果写进本地目录（datafield_catalogue），每拉完一个数据集就落盘；中断后重新运行同一条命令，
+   已经拉过且没有变化的数据集直接跳过，相当于断点续跑
+3. 跑完把这些范围的全部字段写成一个 parquet 快照（需要 pyarrow）
+
+用法:
+    python catalogue_sweep.py --workers 8 --snapshot datafield_snapshot.parquet
+    python catalogue_sweep.py --regions USA CHN --delays 0 1
+'''
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from brain_api import sign_in
+from datafield_catalogue import default_catalogue
+
+# group_factory / trade_when_factory 里用到的区域和各自常用的 universe；没有权限的组合会被跳过
+REGION_UNIVERSES = {
+    'USA': ['TOP3000', 'TOP1000', 'TOP500', 'TOP200', 'TOPSP500'],
+    'CHN': ['TOP2000U'],
+    'TWN': ['TOP500', 'TOP100'],
+    'HKG': ['TOP500', 'TOP800'],
+    'KOR': ['TOP600'],
+    'JPN': ['TOP1600', 'TOP1200'],
+    'EUR': ['TOP2500', 'TOP1200', 'TOP800', 'TOP400'],
+    'GLB': ['TOP3000', 'MINVOL1M'],
+    'ASI': ['MINVOL1M'],
+    'AMR': ['TOP600'],
+}
+
+
+def sweep_scopes(regions=None, delays=(1,), instrument_type='EQUITY', universes=None):
+    '''
+    展开成 [(instrumentType, region, delay, universe), ...]；universes 给了就覆盖每个区域的默认列表
+    '''
+    scopes = []
+    for region in regions or REGION_UNIVERSES:
+        for universe in universes or REGION_UNIVERSES.get(region, []):
+            for delay in delays:
+                scopes.append((instrument_type, region, delay, universe))
+    return scopes
+
+
+def sweep(s, scopes, workers=8, force=False, catalogue=None):
+    '''
+    并发抓取 scopes 下所有（过期的）数据集，返回 {'scopes', 'skipped_scopes', 'refreshed', 'unchanged', 'failed', 'fields'}
+    '''
+    catalogue = catalogue or default_catalogue()
+    summary = {'scopes': len(scopes), 'skipped_scopes': 0, 'refreshed': 0, 'unchanged': 0, 'failed': 0, 'fields': 0}
+
+    def list_scope(scope):
+        try:
+            return catalogue.list_datasets(s, *scope)
+        except requests.exceptions.RequestException as e:
+            # 没有权限的区域/universe 组合会返回 4xx
+            logging.error(f"Cannot list datasets for {scope}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        jobs = {}
+        for scope, datasets in zip(scopes, pool.map(list_scope, scopes)):
+            if datasets is None:
+                summary['skipped_scopes'] += 1
+                continue
+            stored = catalogue.stored_datasets(*scope)
+            for dataset in datasets:
+                if not force and not catalogue.is_stale(dataset, stored):
+                    summary['unchanged'] += 1
+                    continue
+                # 外层已经按数据集并发，单个数据集内部按顺序翻页
+                future = pool.submit(catalogue.refresh_dataset, s, *scope, dataset, 1)
+                jobs[future] = (scope, dataset['id'])
+
+        for done, future in enumerate(as_completed(jobs), start=1):
+            scope, dataset_id = jobs[future]
+            try:
+                summary['fields'] += future.result()
+                summary['refreshed'] += 1
+            except requests.exceptions.RequestException as e:
+                summary['failed'] += 1
+                logging.error(f"Failed to refresh {dataset_id} in {scope}, rerun to resume: {e}")
+            if done % 20 == 0 or done == len(jobs):
+                logging.info(f"Sweep progress: {done}/{len(jobs)} datasets.")
+    return summary
+
+
+def write_snapshot(path, scopes, catalogue=None):
+    catalogue = catalogue or default_catalogue()
+    df = catalogue.table(scopes)
+    df.to_parquet(path, index=False)
+    return len(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sweep datasets and fields for every region/universe/delay')
+    parser.add_argument('--regions', nargs='+', default=None, help=f"default: {' '.join(REGION_UNIVERSES)}")
+    parser.add_argument('--universes', nargs='+', default=None, help='override the per-region universe list')
+    parser.add_argument('--delays', nargs='+', type=int, default=[1])
+    parser.add_argument('--instrument-type', default='EQUITY')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--force', action='store_true', help='re-pull datasets even if they did not change')
+    parser.add_argument('--snapshot', default='datafield_snapshot.parquet', help='parquet snapshot path ("" to skip)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    scopes = sweep_scopes(args.regions, args.delays, args.instrument_type, args.universes)
+    sess = sign_in(pool_size=args.workers)
+    start = time.time()
+    summary = sweep(sess, scopes, args.workers, args.force)
+    print(f"swept {summary['scopes']} scopes in {time.time() - start:.0f}s: {summary}")
+    if args.snapshot:
+        print(f"wrote {write_snapshot(args.snapshot, scopes)} fields to {args.snapshot}")
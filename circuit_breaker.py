@@ -0,0 +1,120 @@
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+# 这些集合名后面跟的路径段是 id，归类时替换成 {id}
+ID_COLLECTIONS = {'alphas', 'simulations', 'users', 'data-sets', 'data-fields', 'operators'}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    '''
+    熔断期间直接抛出，不发请求；是 RequestException 的子类，调用方原有的异常处理照样生效
+    '''
+
+
+def backoff_delay(attempt, base=1.0, cap=120.0):
+    '''
+    第 attempt 次（从 0 开始）重试前的等待秒数：指数退避 base * 2**attempt，封顶 cap，
+    再在 [一半, 全部] 之间随机抖动，避免多个进程同时醒来一起重试
+    '''
+    delay = min(cap, base * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+def endpoint_class(url):
+    '''
+    把 URL 归到接口类别，同一类接口共用一个熔断器，例如
+    .../alphas/abc123/check -> alphas/{id}/check
+    .../simulations/xyz     -> simulations/{id}
+    '''
+    segments = [segment for segment in urlsplit(url).path.split('/') if segment]
+    classes = []
+    for i, segment in enumerate(segments):
+        if i > 0 and segments[i - 1] in ID_COLLECTIONS:
+            classes.append('{id}')
+        else:
+            classes.append(segment)
+    return '/'.join(classes)
+
+
+class CircuitBreaker:
+    '''
+    按接口类别的熔断器:
+    1. closed: 正常放行，连续失败 failure_threshold 次后进入 open
+    2. open: reset_timeout 秒内所有请求直接拒绝（shed load），不再消耗限流额度
+    3. half-open: open 到期后只放行一个探测请求，成功则回到 closed，失败则重新 open
+    '''
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                logging.info(f"Circuit {self.name} half-open, sending a probe request.")
+                self.state = self.HALF_OPEN
+                self._probing = False
+            # half-open: 同一时间只放行一个探测请求
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def seconds_until_retry(self):
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info(f"Circuit {self.name} closed.")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.error(f"Circuit {self.name} open after {self.failures} failures, "
+                                  f"shedding requests for {self.reset_timeout}s.")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url):
+    '''
+    取 url 所属接口类别的熔断器，进程内共享
+    '''
+    name = endpoint_class(url)
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+from collections import deque
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+class AIMDController:
+    '''
+    AIMD（加性增、乘性减）并发窗口控制器:
+    1. 每个请求结束后调用 record(latency, status_code, retry_after)
+    2. 延迟健康时，每完成约一个窗口的请求窗口 +additive_increase
+    3. 遇到 429 或 Retry-After 超过 retry_after_spike 秒时，窗口乘以 multiplicative_decrease，
+       cooldown 秒内的连续 429 只减一次，避免一次限流风暴把窗口打到底
+    4. window 在 [min_window, max_window] 之间，max_window 一般就是账号的 max_concurrent
+    '''
+
+    def __init__(self, max_window, min_window=1, initial_window=None, additive_increase=1.0,
+                 multiplicative_decrease=0.5, latency_threshold=10.0, retry_after_spike=30.0,
+                 cooldown=10.0, sample_size=500):
+        self.max_window = max_window
+        self.min_window = min_window
+        self._window = float(max_window if initial_window is None else initial_window)
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.latency_threshold = latency_threshold
+        self.retry_after_spike = retry_after_spike
+        self.cooldown = cooldown
+        self._samples = deque(maxlen=sample_size)
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def window(self):
+        with self._lock:
+            return max(int(self._window), self.min_window)
+
+    def record(self, latency, status_code, retry_after=None):
+        throttled = status_code == 429
+        spiked = retry_after is not None and float(retry_after) >= self.retry_after_spike
+        with self._lock:
+            self._samples.append((latency, throttled))
+            now = time.monotonic()
+            if throttled or spiked:
+                if now - self._last_decrease >= self.cooldown:
+                    self._window = max(self._window * self.multiplicative_decrease, self.min_window)
+                    self._last_decrease = now
+                    logging.info(f"Throttled (status {status_code}, Retry-After {retry_after}), "
+                                 f"concurrency window cut to {self._window:.2f}.")
+            elif latency <= self.latency_threshold:
+                # 每个请求加 additive_increase / window，一个窗口的请求合计 +additive_increase
+                self._window = min(self._window + self.additive_increase / max(self._window, 1), self.max_window)
+
+    def stats(self):
+        with self._lock:
+            latencies = [latency for latency, _ in self._samples]
+            throttled = sum(1 for _, is_throttled in self._samples if is_throttled)
+            return {
+                'window': max(int(self._window), self.min_window),
+                'p50_latency': percentile(latencies, 50),
+                'p95_latency': percentile(latencies, 95),
+                'rate_429': throttled / len(self._samples) if self._samples else 0.0,
+            }
+
+    def publish(self):
+        stats = self.stats()
+        p50 = 'n/a' if stats['p50_latency'] is None else f"{stats['p50_latency']:.2f}s"
+        p95 = 'n/a' if stats['p95_latency'] is None else f"{stats['p95_latency']:.2f}s"
+        logging.info(f"Concurrency window: {stats['window']}, latency p50: {p50}, p95: {p95}, "
+                     f"429 rate: {stats['rate_429']:.1%}")
+        return stats
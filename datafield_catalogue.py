@@ -0,0 +1,269 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from brain_api import BRAIN_API_URL, iter_pages
+from fast_json import loads
+
+# 数据集上这些字段变了才重新拉它的字段列表
+SIGNATURE_KEYS = ('fieldCount', 'dateModified', 'dateUpdated', 'lastUpdated')
+# 即使签名没变，字段的 coverage/userCount/alphaCount 也会慢慢变，超过这么久强制重拉
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+
+def scope_key(instrument_type, region, delay, universe):
+    # world*.py 里 delay 是字符串 '1'，machine_lib 里是整数 1，统一成整数
+    return (instrument_type, region, int(delay), universe)
+
+
+def dataset_signature(dataset):
+    return json.dumps({key: dataset.get(key) for key in SIGNATURE_KEYS}, sort_keys=True)
+
+
+def field_row(scope, dataset_id, field):
+    return scope + (dataset_id, field['id'], field.get('type'), field.get('coverage'), field.get('userCount'),
+                    field.get('alphaCount'), field.get('description'), json.dumps(field, ensure_ascii=False))
+
+
+class DatafieldCatalogue:
+    '''
+    数据集和数据字段的本地目录（SQLite），按 (instrumentType, region, delay, universe, dataset) 分区:
+    1. refresh 先取一次数据集列表，只重新拉签名（fieldCount / 更新时间）变了或者超过 max_age 的数据集的字段
+    2. get_datafields 优先读本地目录，目录里没有或过期了才调 API，world*.py 启动时不再每次翻几十页
+    3. query_fields 走索引查询，比如 "数据集 X 里 coverage > 0.8 的 MATRIX 字段"；
+       返回的 DataFrame 和 API 返回的字段一样（原始 JSON 原样保存）
+    '''
+
+    def __init__(self, db_path='datafield_catalogue.sqlite', max_age=DEFAULT_MAX_AGE):
+        self.db_path = db_path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS datasets (
+                                 instrument_type TEXT,
+                                 region TEXT,
+                                 delay INTEGER,
+                                 universe TEXT,
+                                 dataset_id TEXT,
+                                 name TEXT,
+                                 field_count INTEGER,
+                                 signature TEXT,
+                                 raw TEXT,
+                                 refreshed REAL,
+                                 PRIMARY KEY (instrument_type, region, delay, universe, dataset_id))''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS fields (
+                                 instrument_type TEXT,
+                                 region TEXT,
+                                 delay INTEGER,
+                                 universe TEXT,
+                                 dataset_id TEXT,
+                                 field_id TEXT,
+                                 type TEXT,
+                                 coverage REAL,
+                                 user_count INTEGER,
+                                 alpha_count INTEGER,
+                                 description TEXT,
+                                 raw TEXT,
+                                 PRIMARY KEY (instrument_type, region, delay, universe, dataset_id, field_id))''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS fields_type_coverage ON fields '
+                          '(instrument_type, region, delay, universe, dataset_id, type, coverage)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS fields_id ON fields (field_id)')
+
+    def _write(self, statements):
+        '''
+        statements 是 [(sql, rows), ...]，在一个事务里执行
+        '''
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for sql, rows in statements:
+                    self.conn.executemany(sql, rows)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def stored_datasets(self, instrument_type='EQUITY', region='USA', delay=1, universe='TOP3000'):
+        '''
+        返回 {dataset_id: (signature, refreshed)}
+        '''
+        with self._lock:
+            rows = self.conn.execute('SELECT dataset_id, signature, refreshed FROM datasets WHERE instrument_type = ? '
+                                     'AND region = ? AND delay = ? AND universe = ?',
+                                     scope_key(instrument_type, region, delay, universe)).fetchall()
+        return {dataset_id: (signature, refreshed) for dataset_id, signature, refreshed in rows}
+
+    def list_datasets(self, s, instrument_type='EQUITY', region='USA', delay=1, universe='TOP3000'):
+        params = {'instrumentType': instrument_type, 'region': region, 'delay': delay, 'universe': universe}
+        return [dataset for page in iter_pages(s, f'{BRAIN_API_URL}/data-sets', params, cache=False)
+                for dataset in page]
+
+    def fetch_fields(self, s, instrument_type, region, delay, universe, dataset_id, workers=4):
+        params = {'instrumentType': instrument_type, 'region': region, 'delay': delay, 'universe': universe,
+                  'dataset.id': dataset_id}
+        return [field for page in iter_pages(s, f'{BRAIN_API_URL}/data-fields', params, workers=workers, cache=False)
+                for field in page]
+
+    def store(self, instrument_type, region, delay, universe, dataset, fields):
+        '''
+        整个数据集的字段一次替换掉（数据集里删掉的字段也会从目录里消失）
+        '''
+        scope = scope_key(instrument_type, region, delay, universe)
+        dataset_id = dataset['id']
+        self._write([
+            ('DELETE FROM fields WHERE instrument_type = ? AND region = ? AND delay = ? AND universe = ? '
+             'AND dataset_id = ?', [scope + (dataset_id,)]),
+            ('INSERT INTO fields VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+             [field_row(scope, dataset_id, field) for field in fields]),
+            ('INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+             [scope + (dataset_id, dataset.get('name'), dataset.get('fieldCount', len(fields)),
+                       dataset_signature(dataset), json.dumps(dataset, ensure_ascii=False), time.time())]),
+        ])
+
+    def refresh(self, s, instrument_type='EQUITY', region='USA', delay=1, universe='TOP3000', dataset_ids=None,
+                force=False, workers=4):
+        '''
+        增量刷新一个范围：dataset_ids 为 None 时刷新该范围下的所有数据集。
+        返回 {'refreshed': [...], 'unchanged': [...]}
+        '''
+        stored = self.stored_datasets(instrument_type, region, delay, universe)
+        summary = {'refreshed': [], 'unchanged': []}
+        for dataset in self.list_datasets(s, instrument_type, region, delay, universe):
+            dataset_id = dataset['id']
+            if dataset_ids is not None and dataset_id not in dataset_ids:
+                continue
+            if not force and not self.is_stale(dataset, stored):
+                summary['unchanged'].append(dataset_id)
+                continue
+            self.refresh_dataset(s, instrument_type, region, delay, universe, dataset, workers)
+            summary['refreshed'].append(dataset_id)
+        return summary
+
+    def is_stale(self, dataset, stored):
+        '''
+        stored 是 stored_datasets 的返回值；签名变了、没拉过或者超过 max_age 都算过期
+        '''
+        signature, refreshed = stored.get(dataset['id'], (None, 0))
+        return signature != dataset_signature(dataset) or time.time() - refreshed >= self.max_age
+
+    def refresh_dataset(self, s, instrument_type, region, delay, universe, dataset, workers=4):
+        '''
+        重新拉一个数据集（data-sets 列表里的一项）的全部字段，返回字段数
+        '''
+        fields = self.fetch_fields(s, instrument_type, region, delay, universe, dataset['id'], workers)
+        self.store(instrument_type, region, delay, universe, dataset, fields)
+        logging.info(f"Catalogue refreshed {dataset['id']} ({region}/{delay}/{universe}): {len(fields)} fields.")
+        return len(fields)
+
+    def is_fresh(self, instrument_type, region, delay, universe, dataset_id):
+        stored = self.stored_datasets(instrument_type, region, delay, universe)
+        return dataset_id in stored and time.time() - stored[dataset_id][1] < self.max_age
+
+    def get_datafields(self, s, instrument_type='EQUITY', region='USA', delay=1, universe='TOP3000', dataset_id=''):
+        '''
+        和 machine_lib.get_datafields(dataset_id=...) 返回一样的 DataFrame，目录里是新的就不调 API；
+        /data-sets 没有列出这个数据集时（目录无从记录）直接按 dataset.id 调 /data-fields，不返回空表
+        '''
+        if not self.is_fresh(instrument_type, region, delay, universe, dataset_id):
+            summary = self.refresh(s, instrument_type, region, delay, universe, dataset_ids=[dataset_id])
+            if dataset_id not in summary['refreshed'] + summary['unchanged']:
+                logging.warning(f"{dataset_id} is not listed by /data-sets for {region}/{delay}/{universe}, "
+                                f"fetching its fields from the API.")
+                return pd.DataFrame(self.fetch_fields(s, instrument_type, region, delay, universe, dataset_id))
+        return self.query_fields(instrument_type, region, delay, universe, dataset_id=dataset_id)
+
+    def query_fields(self, instrument_type='EQUITY', region='USA', delay=1, universe='TOP3000', dataset_id=None,
+                     field_type=None, min_coverage=None, search=None, order_by=None):
+        '''
+        按条件查字段，返回 DataFrame:
+        field_type: 'MATRIX' / 'VECTOR' / 'GROUP'；min_coverage: coverage 下限；search: id 或描述里包含的文字；
+        order_by: 'coverage' / 'user_count' / 'alpha_count'，加 '-' 前缀表示降序
+        '''
+        sql = 'SELECT raw FROM fields WHERE instrument_type = ? AND region = ? AND delay = ? AND universe = ?'
+        args = list(scope_key(instrument_type, region, delay, universe))
+        if dataset_id:
+            sql += ' AND dataset_id = ?'
+            args.append(dataset_id)
+        if field_type:
+            sql += ' AND type = ?'
+            args.append(field_type)
+        if min_coverage is not None:
+            sql += ' AND coverage > ?'
+            args.append(min_coverage)
+        if search:
+            sql += ' AND (field_id LIKE ? OR description LIKE ?)'
+            args += [f'%{search}%', f'%{search}%']
+        if order_by:
+            column = order_by.lstrip('-')
+            if column not in ('coverage', 'user_count', 'alpha_count', 'field_id'):
+                raise ValueError(f"Cannot order fields by {order_by}")
+            sql += f" ORDER BY {column} {'DESC' if order_by.startswith('-') else 'ASC'}"
+        with self._lock:
+            rows = self.conn.execute(sql, args).fetchall()
+        return pd.DataFrame([loads(raw) for raw, in rows])
+
+    def query_datasets(self, instrument_type='EQUITY', region='USA', delay=1, universe='TOP3000'):
+        with self._lock:
+            rows = self.conn.execute('SELECT raw FROM datasets WHERE instrument_type = ? AND region = ? '
+                                     'AND delay = ? AND universe = ?',
+                                     scope_key(instrument_type, region, delay, universe)).fetchall()
+        return pd.DataFrame([loads(raw) for raw, in rows])
+
+    def table(self, scopes=None):
+        '''
+        全部字段（不含原始 JSON）的扁平表，每行带 范围 和 数据集；scopes 给了就只取这些 (instrumentType, region,
+        delay, universe)
+        '''
+        columns = ['instrument_type', 'region', 'delay', 'universe', 'dataset_id', 'field_id', 'type', 'coverage',
+                   'user_count', 'alpha_count', 'description']
+        with self._lock:
+            rows = self.conn.execute(f"SELECT {', '.join(columns)} FROM fields").fetchall()
+        df = pd.DataFrame(rows, columns=columns)
+        if scopes is not None:
+            wanted = pd.DataFrame([scope_key(*scope) for scope in scopes], columns=columns[:4])
+            df = df.merge(wanted.drop_duplicates(), on=columns[:4]) if len(wanted) else df.iloc[0:0]
+        return df
+
+
+_default_catalogue = None
+_default_catalogue_lock = threading.Lock()
+
+
+def default_catalogue():
+    '''
+    进程内共享的目录，位置可以用环境变量 BRAIN_DATAFIELD_CATALOGUE 指定
+    '''
+    global _default_catalogue
+    with _default_catalogue_lock:
+        if _default_catalogue is None:
+            _default_catalogue = DatafieldCatalogue(os.environ.get('BRAIN_DATAFIELD_CATALOGUE',
+                                                                   'datafield_catalogue.sqlite'))
+        return _default_catalogue
+
+
+if __name__ == "__main__":
+    from brain_api import sign_in
+
+    parser = argparse.ArgumentParser(description='Refresh the local datafield catalogue')
+    parser.add_argument('--instrument-type', default='EQUITY')
+    parser.add_argument('--region', default='USA')
+    parser.add_argument('--delay', type=int, default=1)
+    parser.add_argument('--universe', default='TOP3000')
+    parser.add_argument('--dataset', action='append', help='only refresh these datasets (repeatable)')
+    parser.add_argument('--force', action='store_true', help='re-pull even if the dataset did not change')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sess = sign_in()
+    summary = default_catalogue().refresh(sess, args.instrument_type, args.region, args.delay, args.universe,
+                                          args.dataset, args.force, args.workers)
+    print(f"refreshed {len(summary['refreshed'])} datasets, {len(summary['unchanged'])} unchanged")
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 提交了但一直没有结果的记录（提交后进程崩了、或者是只管提交不取结果的脚本提交的），超过这么久就当作没提交过
+PENDING_TTL = 6 * 3600
+
+
+def payload_key(alpha):
+    '''
+    simulation 请求体的内容哈希：只看 type/settings/regular，键排序后的紧凑 JSON 做 sha256，
+    settings 里键的顺序不同、表达式首尾空白不同都算同一个 alpha
+    '''
+    canonical = {
+        'type': alpha.get('type', 'REGULAR'),
+        'settings': alpha.get('settings'),
+        'regular': (alpha.get('regular') or '').strip(),
+    }
+    text = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class DedupIndex:
+    '''
+    已提交 simulation 的去重索引（SQLite，跨进程、跨运行持久化）:
+    1. 提交成功后 record_posted 记下 payload 哈希 -> Location、提交账号和提交时间（multi-simulation 还记下 child 序号）
+    2. 回测结束后 record_results 按 Location 补上 alpha id 和结果；没有 alpha id 的（请求出错）删掉，允许重新提交
+    3. 提交前 lookup 命中就不再 POST：有结果的直接用结果；只提交过、没有结果的记录超过 pending_ttl 不再算命中，
+       Location 只有提交它的账号能轮询，调用方还要按 account 判断能不能接着用
+    '''
+
+    def __init__(self, db_path='simulated_index.sqlite'):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS simulations (
+                                 key TEXT PRIMARY KEY,
+                                 regular TEXT,
+                                 location TEXT,
+                                 child INTEGER,
+                                 alpha_id TEXT,
+                                 result TEXT,
+                                 updated REAL,
+                                 account TEXT,
+                                 posted REAL)''')
+        # 旧版本建的表没有 account/posted 两列
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(simulations)')}
+        for column, column_type in (('account', 'TEXT'), ('posted', 'REAL')):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE simulations ADD COLUMN {column} {column_type}')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS simulations_location ON simulations (location)')
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM simulations').fetchone()[0]
+
+    def lookup(self, alpha, pending_ttl=PENDING_TTL):
+        '''
+        返回 {'location', 'alpha_id', 'result', 'account', 'posted'}，没提交过返回 None；
+        没有结果且提交时间早于 pending_ttl 秒之前的记录（旧版本没记提交时间的也一样）按没提交过处理
+        '''
+        with self._lock:
+            row = self.conn.execute('SELECT location, alpha_id, result, account, posted FROM simulations WHERE key = ?',
+                                    (payload_key(alpha),)).fetchone()
+        if row is None:
+            return None
+        location, alpha_id, result, account, posted = row
+        if not result and (posted is None or time.time() - posted > pending_ttl):
+            return None
+        return {'location': location, 'alpha_id': alpha_id, 'result': json.loads(result) if result else None,
+                'account': account, 'posted': posted}
+
+    def record_posted(self, alphas, location, account=None):
+        '''
+        alphas 是单个 alpha 或 multi-simulation 的 children 列表，child 序号与 children 结果的顺序一致；
+        account 是提交用的账号，只有它能轮询这个 Location
+        '''
+        if isinstance(alphas, dict):
+            alphas = [alphas]
+        now = time.time()
+        rows = [(payload_key(alpha), alpha.get('regular'), location, child, now, account, now)
+                for child, alpha in enumerate(alphas)]
+        with self._lock:
+            self.conn.executemany('INSERT OR REPLACE INTO simulations (key, regular, location, child, updated, account, '
+                                  'posted) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def record_results(self, location, results):
+        '''
+        results 按 child 顺序排列（普通 simulation 只有一个）
+        '''
+        now = time.time()
+        with self._lock:
+            keys = [row[0] for row in self.conn.execute('SELECT key FROM simulations WHERE location = ? ORDER BY child',
+                                                        (location,))]
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for key, result in zip(keys, results):
+                    if result.get('id'):
+                        self.conn.execute('UPDATE simulations SET alpha_id = ?, result = ?, updated = ? WHERE key = ?',
+                                          (result['id'], json.dumps(result, ensure_ascii=False), now, key))
+                    else:
+                        self.conn.execute('DELETE FROM simulations WHERE key = ?', (key,))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def iter_results(self):
+        '''
+        逐行返回已经有结果的 (regular, result)，按批从 SQLite 读，不一次性载入内存
+        '''
+        last = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute('SELECT rowid, regular, result FROM simulations WHERE result IS NOT NULL '
+                                         'AND rowid > ? ORDER BY rowid LIMIT 1000', (last,)).fetchall()
+            if not rows:
+                return
+            for last, regular, result in rows:
+                yield regular, json.loads(result)
+
+    def forget(self, alpha):
+        with self._lock:
+            self.conn.execute('DELETE FROM simulations WHERE key = ?', (payload_key(alpha),))
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def default_index():
+    '''
+    所有提交路径共用的索引，位置可以用环境变量 BRAIN_DEDUP_INDEX 指定
+    '''
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = DedupIndex(os.environ.get('BRAIN_DEDUP_INDEX', 'simulated_index.sqlite'))
+        return _default_index
@@ -0,0 +1,32 @@
+import json
+
+import requests
+
+# orjson 装了就用 orjson 解析（大页面的 alpha 列表快好几倍），没装退回标准库
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(requests.Response):
+    '''
+    响应体只解析一次的 Response：第一次调用 json() 时用 loads 解析 content，
+    之后再调用直接返回同一个对象（调用方不要原地修改它）
+    '''
+
+    def json(self, **kwargs):
+        if kwargs:
+            return super().json(**kwargs)
+        if '_parsed_json' not in self.__dict__:
+            try:
+                self._parsed_json = loads(self.content)
+            except ValueError as e:
+                raise requests.exceptions.JSONDecodeError(str(e), self.text, 0)
+        return self._parsed_json
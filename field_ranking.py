@@ -0,0 +1,120 @@
+import logging
+import re
+
+import pandas as pd
+
+from datafield_catalogue import default_catalogue
+from dedup_index import default_index
+
+# 各项得分的权重，得分都先归一化到 0~1
+DEFAULT_WEIGHTS = {
+    'coverage': 1.0,   # 覆盖率越高越好
+    'value': 0.5,      # 数据集的 valueScore
+    'crowding': 1.0,   # alphaCount/userCount 越少（越没被挖过）越好
+    'history': 2.0,    # 我们自己用这个字段回测出好 alpha 的比例
+}
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def is_hit(result, sharpe_th=1.2, fitness_th=1.0):
+    '''
+    和 get_alphas 的筛选一致：sharpe、fitness 同号且绝对值都过线（负的取反后也能用）
+    '''
+    metrics = result.get('is') or {}
+    sharpe, fitness = metrics.get('sharpe'), metrics.get('fitness')
+    if sharpe is None or fitness is None:
+        return False
+    return (sharpe >= sharpe_th and fitness >= fitness_th) or (sharpe <= -sharpe_th and fitness <= -fitness_th)
+
+
+def percentile_rank(values):
+    return values.rank(pct=True, method='average').fillna(0.5) if len(values) else values
+
+
+class FieldRanker:
+    '''
+    回测前给数据字段排序，先花额度在更有希望的字段上:
+    1. 元数据得分：coverage、数据集 valueScore、拥挤度（alphaCount、userCount 的分位数，越低越好）
+    2. 历史得分：从去重索引里已有结果的 alpha 统计每个字段出好 alpha 的比例，
+       用全局命中率做先验平滑（prior_strength 次虚拟回测），回测少的字段不会因为一两次运气排到最前
+    3. rank 返回按 score 降序的字段表，附带 score/tries/hits 列；process_datafields(df, ranker=...) 按这个顺序生成
+    '''
+
+    def __init__(self, catalogue=None, index=None, weights=DEFAULT_WEIGHTS, sharpe_th=1.2, fitness_th=1.0,
+                 prior_strength=20):
+        self.catalogue = catalogue or default_catalogue()
+        self.index = index or default_index()
+        self.weights = weights
+        self.sharpe_th = sharpe_th
+        self.fitness_th = fitness_th
+        self.prior_strength = prior_strength
+
+    def field_history(self, field_ids):
+        '''
+        返回 {field_id: (tries, hits)}；只统计 field_ids 里的字段，表达式里出现一次就算这个字段回测过一次
+        '''
+        field_ids = set(field_ids)
+        history = {}
+        for regular, result in self.index.iter_results():
+            hit = is_hit(result, self.sharpe_th, self.fitness_th)
+            for field_id in set(IDENTIFIER.findall(regular or '')) & field_ids:
+                tries, hits = history.get(field_id, (0, 0))
+                history[field_id] = (tries + 1, hits + hit)
+        return history
+
+    def dataset_values(self, instrument_type, region, delay, universe):
+        datasets = self.catalogue.query_datasets(instrument_type, region, delay, universe)
+        if datasets.empty or 'valueScore' not in datasets:
+            return {}
+        return dict(zip(datasets['id'], datasets['valueScore'].fillna(0)))
+
+    def rank(self, df, instrument_type='EQUITY', region=None, delay=None, universe=None):
+        '''
+        df 是 get_datafields / 目录查出来的字段表（至少有 id 列）；返回加了 score、tries、hits 的新表，按 score 降序。
+        region/delay/universe 不给时取 df 里的对应列（API 返回的字段都带这几列），用来查数据集的 valueScore
+        '''
+        if df.empty:
+            return df.assign(score=[], tries=[], hits=[])
+        df = df.copy()
+        region = region or (df['region'].iloc[0] if 'region' in df else 'USA')
+        delay = delay if delay is not None else (df['delay'].iloc[0] if 'delay' in df else 1)
+        universe = universe or (df['universe'].iloc[0] if 'universe' in df else 'TOP3000')
+        coverage = pd.to_numeric(df.get('coverage', pd.Series(0.0, index=df.index)), errors='coerce').fillna(0.0)
+        crowding_columns = [column for column in ('alphaCount', 'userCount') if column in df]
+        crowding = sum(percentile_rank(pd.to_numeric(df[column], errors='coerce'))
+                       for column in crowding_columns) / len(crowding_columns) if crowding_columns else 0.5
+
+        values = self.dataset_values(instrument_type, region, delay, universe)
+        dataset_ids = df['dataset'].map(lambda d: d.get('id') if isinstance(d, dict) else d) \
+            if 'dataset' in df else pd.Series('', index=df.index)
+        value = dataset_ids.map(values).fillna(0.0).astype(float)
+        value = value / value.max() if value.max() > 0 else value
+
+        history = self.field_history(df['id'])
+        df['tries'] = df['id'].map(lambda field_id: history.get(field_id, (0, 0))[0])
+        df['hits'] = df['id'].map(lambda field_id: history.get(field_id, (0, 0))[1])
+        total_tries = df['tries'].sum()
+        prior = df['hits'].sum() / total_tries if total_tries else 0.0
+        hit_rate = (df['hits'] + prior * self.prior_strength) / (df['tries'] + self.prior_strength)
+        hit_rate = hit_rate / hit_rate.max() if hit_rate.max() > 0 else hit_rate
+
+        df['score'] = (self.weights['coverage'] * coverage
+                       + self.weights['value'] * value
+                       + self.weights['crowding'] * (1 - crowding)
+                       + self.weights['history'] * hit_rate)
+        logging.info(f"Ranked {len(df)} fields, global hit rate {prior:.3f} over {total_tries} simulated uses.")
+        return df.sort_values('score', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def rank_fields(df, top=None, min_coverage=None, ranker=None, **scope):
+    '''
+    排序后截断：top 只保留前 top 个字段，min_coverage 去掉覆盖率太低的字段
+    '''
+    ranker = ranker or FieldRanker()
+    ranked = ranker.rank(df, **scope)
+    if min_coverage is not None and 'coverage' in ranked:
+        ranked = ranked[ranked['coverage'] >= min_coverage]
+    if top is not None:
+        ranked = ranked.head(top)
+    return ranked.reset_index(drop=True)
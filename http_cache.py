@@ -0,0 +1,217 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from requests.structures import CaseInsensitiveDict
+
+from circuit_breaker import endpoint_class
+from fast_json import FastJSONResponse
+
+# 每类接口的缓存秒数；不在表里的接口不缓存
+# 数据集/字段目录几乎不变，alpha 详情在回测结束后只有 name/tags/状态会被改，
+# 这些改动都经过 PATCH/POST，发出去的时候 invalidate 掉对应的缓存
+DEFAULT_TTLS = {
+    'data-sets': 24 * 3600,
+    'data-fields': 24 * 3600,
+    'data-sets/{id}': 24 * 3600,
+    'operators': 7 * 24 * 3600,
+    'alphas/{id}': 3600,
+}
+
+
+def normalize_url(url, params=None):
+    '''
+    同一个资源的 URL 归一成同一个键：查询参数排序、去掉空参数（如 "?&region=USA"）
+    '''
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k]
+    if params:
+        query += [(k, str(v)) for k, v in params.items() if v is not None]
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(sorted(query)), ''))
+
+
+def resource_urls(url):
+    '''
+    url 本身和它的各级上级资源（不带查询参数），如 .../alphas/abc/submit -> .../alphas/abc/submit、.../alphas/abc、.../alphas
+    '''
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split('/') if segment]
+    return [urlunsplit((parts.scheme, parts.netloc.lower(), '/' + '/'.join(segments[:i]), '', ''))
+            for i in range(len(segments), 0, -1)]
+
+
+def session_account(s):
+    '''
+    缓存按账号隔离（不同账号看到的数据集权限不同）；s 可以是 requests.Session 或 BrainClient
+    '''
+    if getattr(s, 'username', None):
+        return s.username
+    auth = getattr(getattr(s, 'session', None) or s, 'auth', None)
+    if isinstance(auth, tuple):
+        return auth[0]
+    return getattr(auth, 'username', '') or ''
+
+
+def build_response(url, status_code, headers, content):
+    response = FastJSONResponse()
+    response.url = url
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = content
+    response.encoding = 'utf-8'
+    return response
+
+
+class ResponseCache:
+    '''
+    GET 响应的磁盘缓存（SQLite）:
+    1. 键是 账号 + 归一化 URL，每类接口有自己的 TTL（ttls，按 endpoint_class 归类）
+    2. 过期后如果服务器给过 ETag/Last-Modified，就带 If-None-Match/If-Modified-Since 重新验证，
+       304 时直接续期，不再下载响应体
+    3. 只缓存没有 Retry-After 的 200 响应（还在排队的 alpha 不会被缓存）
+    4. 总大小超过 max_bytes 时按最近访问时间淘汰（LRU）
+    '''
+
+    def __init__(self, db_path='http_cache.sqlite', max_bytes=256 * 1024 * 1024, ttls=DEFAULT_TTLS):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                 key TEXT PRIMARY KEY,
+                                 url TEXT,
+                                 status INTEGER,
+                                 headers TEXT,
+                                 body BLOB,
+                                 etag TEXT,
+                                 last_modified TEXT,
+                                 fetched REAL,
+                                 accessed REAL,
+                                 size INTEGER)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    def ttl_for(self, url):
+        return self.ttls.get(endpoint_class(url), 0)
+
+    def get(self, s, url, params=None, ttl=None, **kwargs):
+        '''
+        用法和 s.get(url, params=...) 一样，返回 requests.Response；ttl 不给时按接口类别取默认值
+        '''
+        ttl = self.ttl_for(url) if ttl is None else ttl
+        if ttl <= 0:
+            return s.get(url, params=params, **kwargs)
+
+        normalized = normalize_url(url, params)
+        key = hashlib.sha256(f'{session_account(s)} {normalized}'.encode('utf-8')).hexdigest()
+        with self._lock:
+            row = self.conn.execute('SELECT status, headers, body, etag, last_modified, fetched FROM responses '
+                                    'WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row and now - row[5] < ttl:
+            self.hits += 1
+            self._touch(key, now, refresh=False)
+            return build_response(normalized, row[0], json.loads(row[1]), row[2])
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if row and row[3]:
+            headers['If-None-Match'] = row[3]
+        if row and row[4]:
+            headers['If-Modified-Since'] = row[4]
+        response = s.get(normalized, headers=headers, **kwargs)
+
+        if row and response.status_code == 304:
+            self.revalidated += 1
+            self._touch(key, now, refresh=True)
+            return build_response(normalized, row[0], json.loads(row[1]), row[2])
+
+        self.misses += 1
+        if response.status_code == 200 and not response.headers.get('Retry-After'):
+            self._store(key, normalized, response, now)
+        return response
+
+    def _touch(self, key, now, refresh):
+        with self._lock:
+            if refresh:
+                self.conn.execute('UPDATE responses SET fetched = ?, accessed = ? WHERE key = ?', (now, now, key))
+            else:
+                self.conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+
+    def _store(self, key, url, response, now):
+        body = response.content
+        headers = {name: response.headers[name] for name in ('Content-Type', 'ETag', 'Last-Modified')
+                   if name in response.headers}
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (key, url, response.status_code, json.dumps(headers), body,
+                               response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                               now, now, len(body)))
+            self._evict()
+
+    def _evict(self):
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                total -= size
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        logging.info(f"HTTP cache evicted down to {total} bytes.")
+
+    def invalidate(self, url):
+        '''
+        去掉 url 及其上级资源在所有账号下的缓存（PATCH /alphas/{id}、POST /alphas/{id}/submit 之后用）
+        '''
+        urls = [resource_url for resource_url in resource_urls(url) if self.ttl_for(resource_url) > 0]
+        if not urls:
+            return
+        with self._lock:
+            self.conn.execute(f'DELETE FROM responses WHERE url IN ({", ".join("?" * len(urls))})', urls)
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute('DELETE FROM responses')
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache():
+    '''
+    进程内共享的缓存，位置可以用环境变量 BRAIN_HTTP_CACHE 指定
+    '''
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(os.environ.get('BRAIN_HTTP_CACHE', 'http_cache.sqlite'))
+        return _default_cache
+
+
+def cached_get(s, url, params=None, ttl=None, **kwargs):
+    return default_cache().get(s, url, params=params, ttl=ttl, **kwargs)
+
+
+def invalidate(url):
+    '''
+    改了资源的请求（非 GET）发出后调用；url 和上级资源都不缓存时不打开缓存库
+    '''
+    if any(DEFAULT_TTLS.get(endpoint_class(resource_url)) for resource_url in resource_urls(url)):
+        default_cache().invalidate(url)
@@ -6,11 +6,17 @@ import json
 import pandas as pd
 import random
 import pickle
-from urllib.parse import urljoin
+from itertools import islice
 from itertools import product
 from itertools import combinations
 from collections import defaultdict
 import pickle
+
+import brain_api
+from brain_api import BRAIN_API_URL
+from datafield_catalogue import default_catalogue
+from http_cache import cached_get
+from pending_queue import PendingQueue
  
  
  
@@ -21,21 +27,12 @@ ts_ops = ["ts_rank", "ts_zscore", "ts_delta",  "ts_sum", "ts_delay",
  
 ops_set = basic_ops + ts_ops 
 
-def login():
-    
-    username = "xuzhiquan1@163.com"
-    password = "johnadams123"
- 
-    # Create a session to persistently store the headers
-    s = requests.Session()
- 
-    # Save credentials into session
-    s.auth = (username, password)
- 
-    # Send a POST request to the /authentication API
-    response = s.post('https://api.worldquantbrain.com/authentication')
-    print(response.content)
-    return s  
+def login(credentials_path='brain_credentials.txt'):
+    '''
+    账号密码和其他脚本一样从 brain_credentials.txt 读取（格式: ["your email","password"]），
+    登录走 brain_api.sign_in：调好连接池的 session，网络错误重试，失败返回 None
+    '''
+    return brain_api.sign_in(credentials_path)
 
 
 def get_datasets(
@@ -45,13 +42,35 @@ def get_datasets(
     delay: int = 1,
     universe: str = 'TOP3000'
 ):
-    url = "https://api.worldquantbrain.com/data-sets?" +\
-        f"instrumentType={instrument_type}&region={region}&delay={str(delay)}&universe={universe}"
-    result = s.get(url)
-    datasets_df = pd.DataFrame(result.json()['results'])
+    # 按真实 count 翻页，不再只取第一页
+    params = {'instrumentType': instrument_type, 'region': region, 'delay': delay, 'universe': universe}
+    pages = brain_api.iter_pages(s, BRAIN_API_URL + "/data-sets", params)
+    datasets_df = pd.DataFrame([dataset for page in pages for dataset in page])
     return datasets_df
 
 
+def iter_datafield_pages(
+    s,
+    instrument_type: str = 'EQUITY',
+    region: str = 'USA',
+    delay: int = 1,
+    universe: str = 'TOP3000',
+    dataset_id: str = '',
+    search: str = '',
+    workers: int = 4
+):
+    '''
+    逐页返回数据字段（每页最多 50 个）：总数取第一页的 count，其余页并发取，
+    search 模式也按真实 count 翻完，不再只取前 100 个
+    '''
+    params = {'instrumentType': instrument_type, 'region': region, 'delay': delay, 'universe': universe}
+    if dataset_id:
+        params['dataset.id'] = dataset_id
+    if search:
+        params['search'] = search
+    return brain_api.iter_pages(s, BRAIN_API_URL + "/data-fields", params, workers=workers)
+
+
 def get_datafields(
     s,
     instrument_type: str = 'EQUITY',
@@ -59,34 +78,26 @@ def get_datafields(
     delay: int = 1,
     universe: str = 'TOP3000',
     dataset_id: str = '',
-    search: str = ''
+    search: str = '',
+    workers: int = 4,
+    use_catalogue: bool = True
 ):
-    if len(search) == 0:
-        url_template = "https://api.worldquantbrain.com/data-fields?" +\
-            f"&instrumentType={instrument_type}" +\
-            f"&region={region}&delay={str(delay)}&universe={universe}&dataset.id={dataset_id}&limit=50" +\
-            "&offset={x}"
-        print(s.get(url_template.format(x=0)).json())
-        count = s.get(url_template.format(x=0)).json()['count'] 
-        
-    else:
-        url_template = "https://api.worldquantbrain.com/data-fields?" +\
-            f"&instrumentType={instrument_type}" +\
-            f"&region={region}&delay={str(delay)}&universe={universe}&limit=50" +\
-            f"&search={search}" +\
-            "&offset={x}"
-        count = 100
-    
-    datafields_list = []
-    for x in range(0, count, 50):
-        datafields = s.get(url_template.format(x=x))
-        datafields_list.append(datafields.json()['results'])
- 
-    datafields_list_flat = [item for sublist in datafields_list for item in sublist]
- 
-    datafields_df = pd.DataFrame(datafields_list_flat)
+    if use_catalogue and dataset_id and not search:
+        # 按数据集取字段时读本地目录（datafield_catalogue），目录里是新的就不调 API
+        return default_catalogue().get_datafields(s, instrument_type, region, delay, universe, dataset_id)
+    pages = iter_datafield_pages(s, instrument_type, region, delay, universe, dataset_id, search, workers)
+    datafields_df = pd.DataFrame([field for page in pages for field in page])
     return datafields_df
 
+
+def get_datafields_in_scope(s, searchScope, dataset_id: str = '', search: str = ''):
+    '''
+    world*.py 的调用方式：范围放在 searchScope 字典里
+    （{'region': 'USA', 'delay': '1', 'universe': 'TOP3000', 'instrumentType': 'EQUITY'}）
+    '''
+    return get_datafields(s, searchScope['instrumentType'], searchScope['region'], searchScope['delay'],
+                          searchScope['universe'], dataset_id, search)
+
 def get_vec_fields(fields):
 
     # 请在此处添加获得权限的Vector操作符
@@ -103,11 +114,24 @@ def get_vec_fields(fields):
  
     return(vec_fields)
 
-def process_datafields(df):
-
+def process_datafields(df, ranker=None, top=None):
+    '''
+    ranker（field_ranking.FieldRanker）给了就按字段得分从高到低生成（MATRIX 和 VECTOR 混排），
+    top 只保留得分最高的 top 个字段；不给时按目录顺序，先 MATRIX 后 VECTOR
+    '''
     datafields = []
-    datafields += df[df['type'] == "MATRIX"]["id"].tolist()
-    datafields += get_vec_fields(df[df['type'] == "VECTOR"]["id"].tolist())
+    if ranker is not None:
+        df = ranker.rank(df)
+        if top is not None:
+            df = df.head(top)
+        for field, field_type in zip(df['id'], df['type']):
+            if field_type == "MATRIX":
+                datafields.append(field)
+            elif field_type == "VECTOR":
+                datafields += get_vec_fields([field])
+    else:
+        datafields += df[df['type'] == "MATRIX"]["id"].tolist()
+        datafields += get_vec_fields(df[df['type'] == "VECTOR"]["id"].tolist())
     return ["winsorize(ts_backfill(%s, 120), std=4)"%field for field in datafields]
 
 def ts_factory(op, field):
@@ -122,49 +146,58 @@ def ts_factory(op, field):
     
     return output
 
-def first_order_factory(fields, ops_set):
-    alpha_set = []
-    #for field in fields:
-    for field in fields:
-        #reverse op does the work
-        alpha_set.append(field)
-        #alpha_set.append("-%s"%field)
-        for op in ops_set:
- 
-            if op == "ts_percentage":
+def first_order_expressions(field, ops_set):
+    '''
+    一个字段的全部一阶表达式，按 ops_set 的顺序逐个 yield
+    '''
+    #reverse op does the work
+    yield field
+    #yield "-%s"%field
+    for op in ops_set:
  
-                alpha_set += ts_comp_factory(op, field, "percentage", [0.5])
+        if op == "ts_percentage":
  
-            elif op == "ts_decay_exp_window":
+            yield from ts_comp_factory(op, field, "percentage", [0.5])
  
-                alpha_set += ts_comp_factory(op, field, "factor", [0.5])
+        elif op == "ts_decay_exp_window":
  
-            elif op == "ts_moment":
+            yield from ts_comp_factory(op, field, "factor", [0.5])
  
-                alpha_set += ts_comp_factory(op, field, "k", [2, 3, 4])
+        elif op == "ts_moment":
  
-            elif op == "ts_entropy":
+            yield from ts_comp_factory(op, field, "k", [2, 3, 4])
  
-                alpha_set += ts_comp_factory(op, field, "buckets", [10])
+        elif op == "ts_entropy":
  
-            elif op.startswith("ts_") or op == "inst_tvr":
+            yield from ts_comp_factory(op, field, "buckets", [10])
  
-                alpha_set += ts_factory(op, field)
+        elif op.startswith("ts_") or op == "inst_tvr":
  
-            elif op.startswith("vector"):
+            yield from ts_factory(op, field)
  
-                alpha_set += vector_factory(op, field)
+        elif op.startswith("vector"):
  
-            elif op == "signed_power":
+            yield from vector_factory(op, field)
  
-                alpha = "%s(%s, 2)"%(op, field)
-                alpha_set.append(alpha)
+        elif op == "signed_power":
  
-            else:
-                alpha = "%s(%s)"%(op, field)
-                alpha_set.append(alpha)
+            yield "%s(%s, 2)"%(op, field)
  
-    return alpha_set
+        else:
+            yield "%s(%s)"%(op, field)
+
+
+def iter_first_order_factory(fields, ops_set, max_per_field=None):
+    '''
+    first_order_factory 的惰性版本：边生成边返回，内存里不攒整个列表，fields 也可以是生成器；
+    max_per_field: 每个字段最多生成多少个表达式（按 ops_set 的顺序截断），None 表示不限
+    '''
+    for field in fields:
+        yield from islice(first_order_expressions(field, ops_set), max_per_field)
+
+
+def first_order_factory(fields, ops_set, max_per_field=None):
+    return list(iter_first_order_factory(fields, ops_set, max_per_field))
 
 
 def load_task_pool(alpha_list, limit_of_children_simulations, limit_of_multi_simulations):
@@ -187,7 +220,7 @@ def multi_simulate(alpha_pools, neut, region, universe, start):
 
     s = login()
 
-    brain_api_url = 'https://api.worldquantbrain.com'
+    brain_api_url = BRAIN_API_URL
 
     for x, pool in enumerate(alpha_pools):
         if x < start: continue
@@ -196,11 +229,12 @@ def multi_simulate(alpha_pools, neut, region, universe, start):
             # 10 tasks, 10 alpha in each task
             sim_data_list = generate_sim_data(task, region, universe, neut)
             try:
-                simulation_response = s.post('https://api.worldquantbrain.com/simulations', json=sim_data_list)
-                simulation_progress_url = simulation_response.headers['Location']
-                progress_urls.append(simulation_progress_url)
-            except:
-                print("location key error: %s"%simulation_response.content)
+                # 已经回测过的 children 不再提交，全部回测过时返回 None
+                simulation_progress_url = brain_api.simulate(s, sim_data_list)
+                if simulation_progress_url:
+                    progress_urls.append(simulation_progress_url)
+            except Exception as e:
+                print("location key error: %s"%e)
                 sleep(600)
                 s = login()
 
@@ -208,24 +242,15 @@ def multi_simulate(alpha_pools, neut, region, universe, start):
 
         for j, progress in enumerate(progress_urls):
             try:
-                while True:
-                    simulation_progress = s.get(progress)
-                    if simulation_progress.headers.get("Retry-After", 0) == 0:
-                        break
-                    #print("Sleeping for " + simulation_progress.headers["Retry-After"] + " seconds")
-                    sleep(float(simulation_progress.headers["Retry-After"]))
-
-                status = simulation_progress.json().get("status", 0)
-                if status != "COMPLETE":
+                # 等到结束并把结果记进去重索引，出错的 children 从索引里去掉，之后可以重新提交
+                results = brain_api.simulation_results(s, progress)
+                # 没有 alpha id 的是出错的 child，message 里是出错原因
+                if any(not result.get("id") for result in results):
                     print("Not complete : %s"%(progress))
 
                 """
-                #alpha_id = simulation_progress.json()["alpha"]
-                children = simulation_progress.json().get("children", 0)
-                children_list = []
-                for child in children:
-                    child_progress = s.get(brain_api_url + "/simulations/" + child)
-                    alpha_id = child_progress.json()["alpha"]
+                for result in results:
+                    alpha_id = result["id"]
 
                     set_alpha_properties(s,
                             alpha_id,
@@ -242,8 +267,10 @@ def multi_simulate(alpha_pools, neut, region, universe, start):
     
     print("Simulate done")
 
-def generate_sim_data(alpha_list, region, uni, neut):
-    sim_data_list = []
+def iter_sim_data(alpha_list, region, uni, neut):
+    '''
+    generate_sim_data 的惰性版本，alpha_list 可以是生成器
+    '''
     for alpha, decay in alpha_list:
         simulation_data = {
             'type': 'REGULAR',
@@ -264,8 +291,40 @@ def generate_sim_data(alpha_list, region, uni, neut):
             },
             'regular': alpha}
 
-        sim_data_list.append(simulation_data)
-    return sim_data_list
+        yield simulation_data
+
+
+def generate_sim_data(alpha_list, region, uni, neut):
+    return list(iter_sim_data(alpha_list, region, uni, neut))
+
+
+def chunked(iterable, size):
+    '''
+    把任意可迭代对象按 size 个一组切成列表，最后一组可能不满
+    '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def enqueue_alphas(queue, alpha_list, region, uni, neut, decay=None, chunk_size=1000):
+    '''
+    把生成器产出的表达式边生成边写进 AlphaSimulator 的 SQLite 待回测队列，每 chunk_size 个提交一次，
+    内存里最多只有一批，模拟器不用等全部生成完就能开始取:
+    queue 是 PendingQueue 或它的数据库路径（alpha_list_pending_simulated.sqlite）；
+    decay 给了时 alpha_list 是表达式字符串，否则是 (alpha, decay) 元组，返回写入的个数
+    '''
+    if isinstance(queue, str):
+        queue = PendingQueue(queue)
+    if decay is not None:
+        alpha_list = ((alpha, decay) for alpha in alpha_list)
+    count = 0
+    for chunk in chunked(iter_sim_data(alpha_list, region, uni, neut), chunk_size):
+        count += queue.push(chunk)
+    return count
 
 def set_alpha_properties(
     s,
@@ -290,7 +349,7 @@ def set_alpha_properties(
         "selection": {"description": selection_desc},
     }
     response = s.patch(
-        "https://api.worldquantbrain.com/alphas/" + alpha_id, json=params
+        BRAIN_API_URL + "/alphas/" + alpha_id, json=params
     )
 
 def get_alphas(start_date, end_date, sharpe_th, fitness_th, region, alpha_num, usage):
@@ -300,12 +359,12 @@ def get_alphas(start_date, end_date, sharpe_th, fitness_th, region, alpha_num, u
     count = 0
     for i in range(0, alpha_num, 100):
         print(i)
-        url_e = "https://api.worldquantbrain.com/users/self/alphas?limit=100&offset=%d"%(i) \
+        url_e = BRAIN_API_URL + "/users/self/alphas?limit=100&offset=%d"%(i) \
                 + "&status=UNSUBMITTED%1FIS_FAIL&dateCreated%3E=2025-" + start_date  \
                 + "T00:00:00-04:00&dateCreated%3C2025-" + end_date \
                 + "T00:00:00-04:00&is.fitness%3E" + str(fitness_th) + "&is.sharpe%3E" \
                 + str(sharpe_th) + "&settings.region=" + region + "&order=-is.sharpe&hidden=false&type!=SUPER"
-        url_c = "https://api.worldquantbrain.com/users/self/alphas?limit=100&offset=%d"%(i) \
+        url_c = BRAIN_API_URL + "/users/self/alphas?limit=100&offset=%d"%(i) \
                 + "&status=UNSUBMITTED%1FIS_FAIL&dateCreated%3E=2025-" + start_date  \
                 + "T00:00:00-04:00&dateCreated%3C2025-" + end_date \
                 + "T00:00:00-04:00&is.fitness%3C-" + str(fitness_th) + "&is.sharpe%3C-" \
@@ -376,12 +435,18 @@ def prune(next_alpha_recs, prefix, keep_num):
             output.append([exp,decay])
     return output
 
-def get_group_second_order_factory(first_order, group_ops, region):
-    second_order = []
+def iter_group_second_order_factory(first_order, group_ops, region):
+    '''
+    get_group_second_order_factory 的惰性版本：USA 上每个一阶表达式每个 group_op 要展开二十多个 group，
+    几千个一阶表达式就是几百万个字符串，逐个 yield 可以边生成边入队
+    '''
     for fo in first_order:
         for group_op in group_ops:
-            second_order += group_factory(group_op, fo, region)
-    return second_order
+            yield from group_factory(group_op, fo, region)
+
+
+def get_group_second_order_factory(first_order, group_ops, region):
+    return list(iter_group_second_order_factory(first_order, group_ops, region))
 
 
 def group_factory(op, field, region):
@@ -618,17 +683,18 @@ def check_submission(alpha_bag, gold_bag, start):
 
 def get_check_submission(s, alpha_id):
     while True:
-        result = s.get("https://api.worldquantbrain.com/alphas/" + alpha_id + "/check")
+        result = s.get(BRAIN_API_URL + "/alphas/" + alpha_id + "/check")
         if "retry-after" in result.headers:
             time.sleep(float(result.headers["Retry-After"]))
         else:
             break
     try:
-        if result.json().get("is", 0) == 0:
+        check = result.json()
+        if check.get("is", 0) == 0:
             print("logged out")
             return "sleep"
         checks_df = pd.DataFrame(
-                result.json()["is"]["checks"]
+                check["is"]["checks"]
         )
         pc = checks_df[checks_df.name == "PROD_CORRELATION"]["value"].values[0]
         if not any(checks_df["result"] == "FAIL"):
@@ -656,13 +722,12 @@ def view_alphas(gold_bag):
  
 def locate_alpha(s, alpha_id):
     while True:
-        alpha = s.get("https://api.worldquantbrain.com/alphas/" + alpha_id)
+        alpha = cached_get(s, BRAIN_API_URL + "/alphas/" + alpha_id)
         if "retry-after" in alpha.headers:
             time.sleep(float(alpha.headers["Retry-After"]))
         else:
             break
-    string = alpha.content.decode('utf-8')
-    metrics = json.loads(string)
+    metrics = alpha.json()
     #print(metrics["regular"]["code"])
     
     dateCreated = metrics["dateCreated"]
@@ -727,35 +792,15 @@ def login_hk():
     username = ""
     password = ""
     
-    # Create a session to persistently store the headers
-    s = requests.Session()
+    # 共用brain_api里调好连接池的session
+    s = brain_api.new_session(username, password)
     
-    # Save credentials into session
-    s.auth = (username, password)
-    
-    # Send a POST request to the /authentication API
-    response = s.post('https://api.worldquantbrain.com/authentication')
+    # Send a POST request to the /authentication API, 需要时走人脸认证
+    response = brain_api.authenticate(s, biometrics=True)
     
     if response.status_code == requests.codes.unauthorized:
-        # Check if biometrics is required
-        if response.headers.get("WWW-Authenticate") == "persona":
-            print(
-                "Complete biometrics authentication by scanning your face. Follow the link: \n"
-                + urljoin(response.url, response.headers["Location"]) + "\n"
-            )
-            input("Press any key after you complete the biometrics authentication.")
-            
-            # Retry the authentication after biometrics
-            biometrics_response = s.post(urljoin(response.url, response.headers["Location"]))
-            
-            while biometrics_response.status_code != 201:
-                input("Biometrics authentication is not complete. Please try again and press any key when completed.")
-                biometrics_response = s.post(urljoin(response.url, response.headers["Location"]))
-                
-            print("Biometrics authentication completed.")
-        else:
-            print("\nIncorrect username or password. Please check your credentials.\n")
+        print("\nIncorrect username or password. Please check your credentials.\n")
     else:
         print("Logged in successfully.")
     
-    return s 
+    return s
@@ -0,0 +1,184 @@
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from circuit_breaker import endpoint_class
+
+# 请求耗时直方图的桶（秒），POST /simulations 偶尔会到几十秒
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# simulation 从提交到结束的耗时桶（秒）
+SIMULATION_BUCKETS = (30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+HELP = {
+    'brain_http_request_duration_seconds': 'Latency of BRAIN API calls by endpoint class and method.',
+    'brain_http_responses_total': 'BRAIN API responses by endpoint class, method and status code.',
+    'brain_http_retries_total': 'Retries by endpoint class and reason.',
+    'brain_simulation_duration_seconds': 'Time from POST /simulations to a finished result.',
+    'brain_simulator_inflight': 'Simulations currently in flight.',
+    'brain_simulator_queue_depth': 'Alphas waiting to be simulated.',
+    'brain_simulator_window': 'Current AIMD concurrency window.',
+    'brain_simulator_completions_total': 'Finished simulations.',
+    'brain_simulator_completions_per_minute': 'Finished simulations in the last 60 seconds.',
+    'brain_simulator_duplicates_skipped_total': 'Alphas skipped by the dedup index.',
+}
+
+
+def label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+class Metrics:
+    '''
+    进程内的指标注册表，线程安全:
+    1. counter / gauge / histogram 三种指标，按 名字 + 标签 区分
+    2. observe_request 记录每次 API 调用的耗时直方图和状态码计数（按 endpoint_class 归类）
+    3. export 把当前值写成 Prometheus textfile（给 node_exporter 的 textfile collector）和 JSON 快照，
+       start_exporter 在后台线程里每 interval 秒导出一次，进程退出时再导出一次
+    '''
+
+    def __init__(self, process=None):
+        if process is None:
+            # 进程名取脚本名，交互式/python -c 运行时叫 python
+            process = os.path.splitext(os.path.basename(sys.argv[0]))[0] if sys.argv and sys.argv[0] else ''
+        self.process = process if process not in ('', '-', '-c') else 'python'
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._exporter = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets),
+                                                    'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def observe_request(self, method, url, status, seconds):
+        '''
+        status 是 HTTP 状态码，连接失败等没有响应的记为 'error'
+        '''
+        endpoint = endpoint_class(url)
+        self.observe('brain_http_request_duration_seconds', seconds, endpoint=endpoint, method=method)
+        self.inc('brain_http_responses_total', endpoint=endpoint, method=method, status=status)
+
+    def count_retry(self, url, reason):
+        self.inc('brain_http_retries_total', endpoint=endpoint_class(url), reason=reason)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'process': self.process,
+                'time': time.time(),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self.counters.items()],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in self.gauges.items()],
+                'histograms': [{'name': name, 'labels': dict(labels), 'buckets': list(h['buckets']),
+                                'counts': list(h['counts']), 'sum': h['sum'], 'count': h['count']}
+                               for (name, labels), h in self.histograms.items()],
+            }
+
+    def prometheus_text(self):
+        process = (('process', self.process),)
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                header(name, 'counter')
+                lines.append(f'{name}{format_labels(labels, process)} {value}')
+            for (name, labels), value in sorted(self.gauges.items()):
+                header(name, 'gauge')
+                lines.append(f'{name}{format_labels(labels, process)} {value}')
+            for (name, labels), h in sorted(self.histograms.items()):
+                header(name, 'histogram')
+                cumulative = 0
+                for bound, count in zip(h['buckets'], h['counts']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels, process + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(labels, process + (("le", "+Inf"),))} {h["count"]}')
+                lines.append(f'{name}_sum{format_labels(labels, process)} {h["sum"]}')
+                lines.append(f'{name}_count{format_labels(labels, process)} {h["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, directory=None):
+        '''
+        写 <directory>/brain_<process>.prom 和 .json；先写临时文件再 os.replace，采集方不会读到半个文件
+        '''
+        directory = directory or os.environ.get('BRAIN_METRICS_DIR', 'metrics')
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f'brain_{self.process}')
+        for path, content in ((base + '.prom', self.prometheus_text()),
+                              (base + '.json', json.dumps(self.snapshot(), ensure_ascii=False, indent=1))):
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+    def start_exporter(self, interval=15, directory=None):
+        '''
+        后台定期导出；重复调用只会启动一个线程
+        '''
+        with self._lock:
+            if self._exporter is not None:
+                return
+            self._exporter = threading.Thread(target=self._export_loop, args=(interval, directory), daemon=True)
+        self._exporter.start()
+        atexit.register(self.export, directory)
+
+    def _export_loop(self, interval, directory):
+        while True:
+            time.sleep(interval)
+            try:
+                self.export(directory)
+            except OSError as e:
+                logging.error(f"Failed to export metrics: {e}")
+
+
+_default_metrics = None
+_default_metrics_lock = threading.Lock()
+
+
+def default_metrics():
+    '''
+    进程内共享的指标注册表，导出目录可以用环境变量 BRAIN_METRICS_DIR 指定
+    '''
+    global _default_metrics
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics()
+        return _default_metrics
@@ -0,0 +1,569 @@
+'''
+本地的 BRAIN API 替身服务器，离线压测 / 回归测试用，不消耗真实额度:
+1. 实现 /authentication、/simulations（单个和 multi）、带 Retry-After 的 Location 轮询、/alphas/{id}、
+   /alphas/{id}/check、PATCH /alphas/{id}、/users/self/alphas、/data-sets、/data-fields
+2. 响应延迟、429 比例、登录过期（401）、simulation 耗时都可以配置，延迟和耗时按对数正态分布抽样
+3. GET 的 200 响应带 ETag（响应体的哈希），If-None-Match 对得上时回 304，用来测 http_cache 的重新验证
+4. GET /__stats 返回各接口的请求计数，GET /__simulations 返回每个 simulation 的提交/完成时间（JSON）
+
+用法:
+    python mock_brain_server.py --port 8766 --latency 0.05 --rate-429 0.02 --session-ttl 600 --sim-duration 20
+    BRAIN_API_URL=http://127.0.0.1:8766 python AlphaSimulator.py
+也可以在进程内使用: server = MockBrainServer(MockBrainConfig(sim_duration=1)).start(); server.url
+'''
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from circuit_breaker import endpoint_class
+
+
+class MockBrainConfig:
+    '''
+    latency / sim_duration 是中位数（秒），*_sigma 是对数正态分布的 sigma，0 表示固定值
+    '''
+
+    def __init__(self, latency=0.02, latency_sigma=0.5, rate_429=0.0, retry_after_429=1.0,
+                 session_ttl=None, sim_duration=5.0, sim_sigma=0.3, poll_interval=1.0,
+                 sim_error_rate=0.0, check_duration=1.0, max_children=10, fields_per_dataset=120,
+                 seed=None):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.retry_after_429 = retry_after_429
+        # None 表示登录永不过期，否则过期后所有请求返回 401，直到重新 POST /authentication
+        self.session_ttl = session_ttl
+        self.sim_duration = sim_duration
+        self.sim_sigma = sim_sigma
+        self.poll_interval = poll_interval
+        self.sim_error_rate = sim_error_rate
+        self.check_duration = check_duration
+        self.max_children = max_children
+        self.fields_per_dataset = fields_per_dataset
+        self.seed = seed
+
+
+DATASETS = [
+    ('fundamental6', 'Company Fundamental Data for Equity', 'fundamental'),
+    ('fundamental2', 'Report Footnotes', 'fundamental'),
+    ('analyst4', 'Analyst Estimate Data for Equity', 'analyst'),
+    ('pv1', 'Price Volume Data for Equity', 'pv'),
+    ('news12', 'US News Data', 'news'),
+    ('model16', 'Fundamental Scores', 'model'),
+]
+
+
+def sample(rng, median, sigma):
+    if median <= 0:
+        return 0.0
+    if sigma <= 0:
+        return median
+    return rng.lognormvariate(math.log(median), sigma)
+
+
+def seeded(text):
+    return random.Random(int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:16], 16))
+
+
+def lookup(obj, dotted):
+    for key in dotted.split('.'):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def parse_filters(query):
+    '''
+    /users/self/alphas 的过滤条件，形如 is.sharpe%3E1.25、dateCreated%3E=2025-01-01、type!=SUPER、
+    status=UNSUBMITTED%1FIS_FAIL（%1F 分隔多个取值）。返回 [(field, op, value), ...]
+    '''
+    filters = []
+    for part in query.split('&'):
+        part = unquote(part)
+        for op in ('>=', '<=', '!=', '>', '<', '='):
+            if op in part:
+                field, value = part.split(op, 1)
+                if op in ('>', '<') and value.startswith('='):
+                    op, value = op + '=', value[1:]
+                filters.append((field, op, value))
+                break
+    return filters
+
+
+def matches(alpha, field, op, value):
+    actual = lookup(alpha, field)
+    if actual is None:
+        return op == '!='
+    if op == '=':
+        return str(actual) in value.split('\x1f')
+    if op == '!=':
+        return str(actual) != value
+    try:
+        actual, value = float(actual), float(value)
+    except (TypeError, ValueError):
+        actual, value = str(actual), value
+    return {'>': actual > value, '<': actual < value, '>=': actual >= value, '<=': actual <= value}[op]
+
+
+class MockBrainState:
+    '''
+    服务器的全部状态，所有方法在 self.lock 下操作
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        # 可重入：处理函数持锁时 send_json 还要再拿一次锁记计数
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.tokens = {}
+        self.simulations = {}
+        self.submitted = []
+        self.alphas = {}
+        self.checks = {}
+        self.stats = {}
+
+    def count(self, method, path, status):
+        key = f'{method} {endpoint_class(path)} {status}'
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    def new_id(self, prefix):
+        return f'{prefix}{next(self.ids):07d}'
+
+    def login(self):
+        token = self.new_id('t')
+        ttl = self.config.session_ttl
+        self.tokens[token] = None if ttl is None else time.time() + ttl
+        return token
+
+    def authorized(self, token):
+        if token not in self.tokens:
+            return False
+        expiry = self.tokens[token]
+        return expiry is None or time.time() < expiry
+
+    def create_simulation(self, payload):
+        sim_id = self.new_id('S')
+        now = time.time()
+        done_at = now + sample(self.rng, self.config.sim_duration, self.config.sim_sigma)
+        simulation = {'id': sim_id, 'created': now, 'done_at': done_at, 'finished': None,
+                      'payload': payload, 'children': None, 'result': None}
+        if isinstance(payload, list):
+            simulation['children'] = []
+            for child_payload in payload:
+                child_id = self.new_id('S')
+                self.simulations[child_id] = {'id': child_id, 'done_at': done_at, 'payload': child_payload,
+                                              'children': None, 'result': None}
+                simulation['children'].append(child_id)
+        self.simulations[sim_id] = simulation
+        self.submitted.append(sim_id)
+        return sim_id
+
+    def timeline(self):
+        '''
+        每个提交的 simulation（multi 算一个）的 POST 时间和客户端第一次拿到结果的时间，压测算槽位利用率用
+        '''
+        timeline = []
+        for sim_id in self.submitted:
+            simulation = self.simulations[sim_id]
+            alphas = len(simulation['children']) if simulation['children'] is not None else 1
+            timeline.append({'id': sim_id, 'alphas': alphas, 'created': simulation['created'],
+                             'finished': simulation['finished']})
+        return timeline
+
+    def finish(self, simulation):
+        if simulation['result'] is not None:
+            return simulation['result']
+        simulation['finished'] = time.time()
+        if simulation['children'] is not None:
+            for child_id in simulation['children']:
+                self.finish(self.simulations[child_id])
+            simulation['result'] = {'id': simulation['id'], 'type': 'REGULAR', 'status': 'COMPLETE',
+                                    'children': simulation['children']}
+        elif self.rng.random() < self.config.sim_error_rate:
+            simulation['result'] = {'id': simulation['id'], 'type': 'REGULAR', 'status': 'ERROR',
+                                    'message': 'Attempted to use unknown variable'}
+        else:
+            alpha = self.create_alpha(simulation['payload'])
+            simulation['result'] = {'id': simulation['id'], 'type': 'REGULAR', 'status': 'COMPLETE',
+                                    'alpha': alpha['id']}
+        return simulation['result']
+
+    def create_alpha(self, payload):
+        code = payload.get('regular', '')
+        settings = payload.get('settings', {})
+        # 同一个表达式+设置总是得到同样的指标，方便回归对比
+        rng = seeded(json.dumps([code, settings], sort_keys=True))
+        sharpe = round(rng.gauss(0.6, 0.8), 2)
+        turnover = round(rng.uniform(0.01, 0.8), 4)
+        fitness = round(sharpe * math.sqrt(abs(rng.gauss(0.1, 0.05)) / max(turnover, 0.125)), 2)
+        alpha_id = self.new_id('A')
+        created = datetime.now(timezone(timedelta(hours=-4)))
+        alpha = {
+            'id': alpha_id,
+            'type': payload.get('type', 'REGULAR'),
+            'author': 'MOCK',
+            'settings': settings,
+            'regular': {'code': code, 'description': None, 'operatorCount': code.count('(')},
+            'dateCreated': created.isoformat(timespec='seconds'),
+            'dateSubmitted': None,
+            'dateModified': created.isoformat(timespec='seconds'),
+            'name': None,
+            'favorite': False,
+            'hidden': False,
+            'color': None,
+            'category': None,
+            'tags': [],
+            'classifications': [],
+            'grade': rng.choice(['SPECTACULAR', 'EXCELLENT', 'GOOD', 'AVERAGE', 'INFERIOR']),
+            'stage': 'IS',
+            'status': 'UNSUBMITTED',
+            'is': {
+                'pnl': int(rng.gauss(2e6, 3e6)),
+                'bookSize': 20000000,
+                'longCount': rng.randint(0, 1600),
+                'shortCount': rng.randint(0, 1600),
+                'turnover': turnover,
+                'returns': round(rng.gauss(0.05, 0.1), 4),
+                'drawdown': round(rng.uniform(0.01, 0.4), 4),
+                'margin': round(rng.gauss(0.0005, 0.001), 6),
+                'sharpe': sharpe,
+                'fitness': fitness,
+                'startDate': '2018-01-20',
+                'checks': [
+                    {'name': 'LOW_SHARPE', 'result': 'PASS' if sharpe >= 1.25 else 'FAIL', 'limit': 1.25, 'value': sharpe},
+                    {'name': 'LOW_FITNESS', 'result': 'PASS' if fitness >= 1.0 else 'FAIL', 'limit': 1.0, 'value': fitness},
+                    {'name': 'LOW_TURNOVER', 'result': 'PASS' if turnover >= 0.01 else 'FAIL', 'limit': 0.01, 'value': turnover},
+                    {'name': 'HIGH_TURNOVER', 'result': 'PASS' if turnover <= 0.7 else 'FAIL', 'limit': 0.7, 'value': turnover},
+                    {'name': 'SELF_CORRELATION', 'result': 'PENDING'},
+                ],
+            },
+        }
+        self.alphas[alpha_id] = alpha
+        return alpha
+
+    def check(self, alpha_id):
+        '''
+        第一次调用开始计时，check_duration 秒内返回 None（调用方回 Retry-After），之后返回检查结果
+        '''
+        started = self.checks.setdefault(alpha_id, time.time())
+        if time.time() - started < self.config.check_duration:
+            return None
+        alpha = self.alphas[alpha_id]
+        rng = seeded('check' + alpha_id)
+        self_correlation = round(rng.uniform(0.2, 0.95), 4)
+        prod_correlation = round(rng.uniform(0.2, 0.95), 4)
+        checks = [c for c in alpha['is']['checks'] if c['name'] != 'SELF_CORRELATION']
+        checks += [
+            {'name': 'SELF_CORRELATION', 'result': 'PASS' if self_correlation < 0.7 else 'FAIL',
+             'limit': 0.7, 'value': self_correlation},
+            {'name': 'PROD_CORRELATION', 'result': 'PASS' if prod_correlation < 0.7 else 'FAIL',
+             'limit': 0.7, 'value': prod_correlation},
+        ]
+        return {'is': {'checks': checks}}
+
+    def datasets(self, region, delay, universe):
+        results = []
+        for dataset_id, name, category in DATASETS:
+            results.append({'id': dataset_id, 'name': name, 'description': name,
+                            'category': {'id': category, 'name': category.title()},
+                            'region': region, 'delay': int(delay), 'universe': universe,
+                            'coverage': round(seeded(dataset_id).uniform(0.3, 1.0), 2),
+                            'valueScore': round(seeded(dataset_id + 'v').uniform(1, 10), 1),
+                            'fieldCount': self.config.fields_per_dataset,
+                            'userCount': seeded(dataset_id + 'u').randint(0, 5000),
+                            'alphaCount': seeded(dataset_id + 'a').randint(0, 50000)})
+        return results
+
+    def datafields(self, region, delay, universe):
+        fields = []
+        for dataset_id, name, category in DATASETS:
+            for i in range(self.config.fields_per_dataset):
+                rng = seeded(f'{dataset_id}{i}')
+                fields.append({
+                    'id': f'{dataset_id}_field_{i:04d}',
+                    'description': f'{name} field {i}',
+                    'dataset': {'id': dataset_id, 'name': name},
+                    'category': {'id': category, 'name': category.title()},
+                    'region': region, 'delay': int(delay), 'universe': universe,
+                    'type': 'VECTOR' if rng.random() < 0.2 else 'MATRIX',
+                    'coverage': round(rng.uniform(0.05, 1.0), 4),
+                    'userCount': rng.randint(0, 3000),
+                    'alphaCount': rng.randint(0, 20000),
+                })
+        return fields
+
+
+class MockBrainHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def send_json(self, status, body=None, headers=None):
+        content = json.dumps(body if body is not None else {}).encode('utf-8')
+        headers = dict(headers or {})
+        if self.command == 'GET' and status == 200 and 'Retry-After' not in headers:
+            headers['ETag'] = f'"{hashlib.sha1(content).hexdigest()[:16]}"'
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status, content = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+        with self.state.lock:
+            self.state.count(self.command, urlsplit(self.path).path, status)
+
+    def read_body(self):
+        return json.loads(self.body) if self.body else None
+
+    def token(self):
+        for cookie in (self.headers.get('Cookie') or '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == 't':
+                return value
+        return None
+
+    def preflight(self):
+        '''
+        所有接口共用：模拟网络延迟、随机 429、登录过期 401。返回 False 表示已经回复了错误
+        '''
+        config = self.state.config
+        # 先把请求体读完，提前回 429/401 时请求体不会留在 keep-alive 连接上被当成下一个请求
+        self.body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(sample(self.state.rng, config.latency, config.latency_sigma))
+        path = urlsplit(self.path).path
+        if path.startswith('/__'):
+            return True
+        if config.rate_429 and self.state.rng.random() < config.rate_429:
+            # 429 的 Retry-After 按 RFC 写整数秒，urllib3 不接受小数
+            retry_after = max(1, math.ceil(config.retry_after_429))
+            self.send_json(429, {'message': 'Too many requests'}, {'Retry-After': str(retry_after)})
+            return False
+        if path == '/authentication':
+            return True
+        with self.state.lock:
+            authorized = self.state.authorized(self.token())
+        if not authorized:
+            self.send_json(401, {'detail': 'Incorrect authentication credentials.'})
+            return False
+        return True
+
+    def do_POST(self):
+        if not self.preflight():
+            return
+        path = urlsplit(self.path).path
+        if path == '/authentication':
+            return self.authenticate()
+        if path == '/simulations':
+            return self.post_simulation()
+        self.send_json(404, {'detail': 'Not found.'})
+
+    def do_GET(self):
+        if not self.preflight():
+            return
+        parts = urlsplit(self.path)
+        segments = [segment for segment in parts.path.split('/') if segment]
+        query = dict(parse_qsl(parts.query))
+        if segments == ['__stats']:
+            with self.state.lock:
+                return self.send_json(200, dict(self.state.stats))
+        if segments == ['__simulations']:
+            with self.state.lock:
+                return self.send_json(200, self.state.timeline())
+        if len(segments) == 2 and segments[0] == 'simulations':
+            return self.get_simulation(segments[1])
+        if len(segments) == 2 and segments[0] == 'alphas':
+            return self.get_alpha(segments[1])
+        if len(segments) == 3 and segments[0] == 'alphas' and segments[2] == 'check':
+            return self.get_check(segments[1])
+        if segments == ['users', 'self', 'alphas']:
+            return self.list_alphas(parts.query)
+        if segments == ['data-sets']:
+            return self.get_datasets(query)
+        if segments == ['data-fields']:
+            return self.get_datafields(query)
+        self.send_json(404, {'detail': 'Not found.'})
+
+    def do_PATCH(self):
+        if not self.preflight():
+            return
+        segments = [segment for segment in urlsplit(self.path).path.split('/') if segment]
+        if len(segments) == 2 and segments[0] == 'alphas':
+            return self.patch_alpha(segments[1])
+        self.send_json(404, {'detail': 'Not found.'})
+
+    def authenticate(self):
+        auth = self.headers.get('Authorization') or ''
+        if not auth.startswith('Basic ') or ':' not in base64.b64decode(auth[6:]).decode('utf-8', 'replace'):
+            return self.send_json(401, {'detail': 'Invalid credentials.'}, {'WWW-Authenticate': 'Basic'})
+        with self.state.lock:
+            token = self.state.login()
+        self.send_json(201, {'user': {'id': 'MOCK'}, 'token': {'expiry': self.state.config.session_ttl}},
+                       {'Set-Cookie': f't={token}; Path=/; HttpOnly'})
+
+    def post_simulation(self):
+        payload = self.read_body()
+        if isinstance(payload, list) and not 2 <= len(payload) <= self.state.config.max_children:
+            return self.send_json(400, {'detail': f'Multi-simulation needs 2 to {self.state.config.max_children} children.'})
+        if not isinstance(payload, (dict, list)):
+            return self.send_json(400, {'detail': 'Invalid simulation payload.'})
+        with self.state.lock:
+            sim_id = self.state.create_simulation(payload)
+        host = self.headers.get('Host') or f'127.0.0.1:{self.server.server_port}'
+        self.send_json(201, {}, {'Location': f'http://{host}/simulations/{sim_id}'})
+
+    def get_simulation(self, sim_id):
+        with self.state.lock:
+            simulation = self.state.simulations.get(sim_id)
+            if simulation is None:
+                return self.send_json(404, {'detail': 'Not found.'})
+            remaining = simulation['done_at'] - time.time()
+            if remaining > 0:
+                duration = max(self.state.config.sim_duration, 1e-6)
+                progress = round(max(0.0, 1 - remaining / duration), 2)
+                retry_after = min(self.state.config.poll_interval, max(remaining, 0.01))
+                return self.send_json(200, {'progress': progress}, {'Retry-After': f'{retry_after:.2f}'})
+            result = self.state.finish(simulation)
+        self.send_json(200, result)
+
+    def get_alpha(self, alpha_id):
+        with self.state.lock:
+            alpha = self.state.alphas.get(alpha_id)
+        if alpha is None:
+            return self.send_json(404, {'detail': 'Not found.'})
+        self.send_json(200, alpha)
+
+    def get_check(self, alpha_id):
+        with self.state.lock:
+            if alpha_id not in self.state.alphas:
+                return self.send_json(404, {'detail': 'Not found.'})
+            result = self.state.check(alpha_id)
+        if result is None:
+            return self.send_json(200, {}, {'Retry-After': f'{self.state.config.poll_interval:.2f}'})
+        self.send_json(200, result)
+
+    def patch_alpha(self, alpha_id):
+        params = self.read_body() or {}
+        with self.state.lock:
+            alpha = self.state.alphas.get(alpha_id)
+            if alpha is None:
+                return self.send_json(404, {'detail': 'Not found.'})
+            for key in ('name', 'color', 'tags', 'category', 'favorite', 'hidden'):
+                if key in params:
+                    alpha[key] = params[key]
+            if isinstance(params.get('regular'), dict):
+                alpha['regular'].update(params['regular'])
+        self.send_json(200, alpha)
+
+    def list_alphas(self, raw_query):
+        query = dict(parse_qsl(raw_query))
+        limit = int(query.get('limit', 30))
+        offset = int(query.get('offset', 0))
+        order = query.get('order')
+        filters = [(field, op, value) for field, op, value in parse_filters(raw_query)
+                   if field not in ('limit', 'offset', 'order', 'hidden')]
+        with self.state.lock:
+            alphas = [alpha for alpha in self.state.alphas.values()
+                      if all(matches(alpha, field, op, value) for field, op, value in filters)]
+        if order:
+            field = order.lstrip('-')
+            alphas.sort(key=lambda alpha: lookup(alpha, field) or 0, reverse=order.startswith('-'))
+        self.send_json(200, {'count': len(alphas), 'results': alphas[offset:offset + limit]})
+
+    def get_datasets(self, query):
+        results = self.state.datasets(query.get('region', 'USA'), query.get('delay', 1),
+                                      query.get('universe', 'TOP3000'))
+        self.send_json(200, {'count': len(results), 'results': results})
+
+    def get_datafields(self, query):
+        fields = self.state.datafields(query.get('region', 'USA'), query.get('delay', 1),
+                                       query.get('universe', 'TOP3000'))
+        if query.get('dataset.id'):
+            fields = [field for field in fields if field['dataset']['id'] == query['dataset.id']]
+        if query.get('search'):
+            search = query['search'].lower()
+            fields = [field for field in fields if search in field['id'] or search in field['description'].lower()]
+        limit = int(query.get('limit', 50))
+        offset = int(query.get('offset', 0))
+        self.send_json(200, {'count': len(fields), 'results': fields[offset:offset + limit]})
+
+
+class MockBrainServer:
+    '''
+    在后台线程里跑 MockBrainHandler；port=0 时随机选一个空闲端口
+    '''
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), MockBrainHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = MockBrainState(config or MockBrainConfig())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-in for the BRAIN API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.02, help='median response latency in seconds')
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--rate-429', type=float, default=0.0, help='probability of answering 429')
+    parser.add_argument('--retry-after-429', type=float, default=1.0)
+    parser.add_argument('--session-ttl', type=float, default=None, help='seconds until a login expires (401)')
+    parser.add_argument('--sim-duration', type=float, default=5.0, help='median simulation duration in seconds')
+    parser.add_argument('--sim-sigma', type=float, default=0.3)
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Retry-After while a simulation runs')
+    parser.add_argument('--sim-error-rate', type=float, default=0.0)
+    parser.add_argument('--check-duration', type=float, default=1.0)
+    parser.add_argument('--fields-per-dataset', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    config = MockBrainConfig(latency=args.latency, latency_sigma=args.latency_sigma, rate_429=args.rate_429,
+                             retry_after_429=args.retry_after_429, session_ttl=args.session_ttl,
+                             sim_duration=args.sim_duration, sim_sigma=args.sim_sigma,
+                             poll_interval=args.poll_interval, sim_error_rate=args.sim_error_rate,
+                             check_duration=args.check_duration, fields_per_dataset=args.fields_per_dataset,
+                             seed=args.seed)
+    server = MockBrainServer(config, args.host, args.port)
+    print(f"Mock BRAIN API listening on {server.url}")
+    print(f"Run the scripts with BRAIN_API_URL={server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
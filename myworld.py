@@ -15,16 +15,8 @@ logging.basicConfig(filename='simulation2.log', level=logging.INFO,
 # =========================
 # 登录函数
 # =========================
-def sign_in():
-    with open(expanduser('brain_credentials.txt')) as f:
-        credentials = json.load(f)
-    username, password = credentials
-    sess = requests.Session()
-    sess.auth = HTTPBasicAuth(username, password)
-    response = sess.post('https://api.worldquantbrain.com/authentication')
-    if response.status_code !=  200 and response.status_code!= 201:
-        raise Exception(f"Login failed: {response.status_code}, {response.text}")
-    return sess
+# 登录统一走 brain_api：带连接池和重试策略的 session
+from brain_api import sign_in, simulate
 
 # =========================
 # 断点续跑函数
@@ -102,14 +94,9 @@ def generate_and_submit_alphas(basic_factors,
                         failure_count = 0
                         while keep_trying:
                             try:
-                                resp = sess.post(
-                                    'https://api.worldquantbrain.com/simulations',
-                                    json=alpha_json
-                                )
-                                if 'Location' not in resp.headers:
-                                    raise Exception("No Location header")
-                                logging.info(f"{index}: {alpha_expr}, Location: {resp.headers['Location']}")
-                                print(f"{index}: {alpha_expr}, Location: {resp.headers['Location']}")
+                                location = simulate(sess, alpha_json)
+                                logging.info(f"{index}: {alpha_expr}, Location: {location}")
+                                print(f"{index}: {alpha_expr}, Location: {location}")
                                 keep_trying = False
                                 save_progress(index + 1)
                             except Exception as e:
@@ -0,0 +1,238 @@
+import ast
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# 校验导入位置时比对偏移前面多少字节
+FINGERPRINT_BYTES = 4096
+# csv 全部导入后超过这么多秒没有再写入，就截断到只剩表头
+COMPACT_IDLE = 600
+
+
+class QueuedAlpha(dict):
+    '''
+    从队列里取出的 alpha，本身就是 POST /simulations 用的 dict，
+    queue_id 只挂在属性上，不会被序列化进请求体
+    '''
+    queue_id = None
+
+
+class PendingQueue:
+    '''
+    基于 SQLite 的持久化待回测队列，替代每次整表重写 alpha_list_pending_simulated.csv:
+    1. pending 表按自增 id 排队，pop 只读写 batch_size 行
+    2. pop 在同一个事务里把行从 pending 挪到 inflight，多个进程同时取也不会重复
+    3. settings 以 JSON 存储，取出时不再需要 ast.literal_eval
+    4. import_csv 按字节偏移增量导入老的 csv 队列，csv 不改名，生成脚本可以一直往里追加；
+       全部导入且空闲一段时间后截断到只剩表头，文件不会无限增长
+    5. inflight 表同时是在途状态日志：queued -> posted(记录 Location) -> complete(删除)，
+       进程被杀后用 restore 按账号恢复，已经提交的 simulation 继续轮询，没提交的重新排队
+    '''
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS pending (
+                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 type TEXT,
+                                 settings TEXT,
+                                 regular TEXT)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS inflight (
+                                 id INTEGER PRIMARY KEY,
+                                 type TEXT,
+                                 settings TEXT,
+                                 regular TEXT)''')
+        # 旧版本建的 inflight 表没有状态列，这里补上
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(inflight)')}
+        for column, definition in (('owner', "TEXT DEFAULT ''"), ('state', "TEXT DEFAULT 'queued'"),
+                                   ('location', 'TEXT'), ('updated', 'REAL')):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE inflight ADD COLUMN {column} {definition}')
+        # 每个 csv 已经导入到哪个字节，fingerprint 是偏移前 FINGERPRINT_BYTES 字节的哈希；
+        # inode 变了、文件变短或者偏移前的内容对不上（文件被删掉重建）就从头导入
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS csv_imports (
+                                 path TEXT PRIMARY KEY,
+                                 inode INTEGER,
+                                 offset INTEGER,
+                                 header TEXT)''')
+        if 'fingerprint' not in {row[1] for row in self.conn.execute('PRAGMA table_info(csv_imports)')}:
+            self.conn.execute('ALTER TABLE csv_imports ADD COLUMN fingerprint TEXT')
+
+    def __len__(self):
+        # pop 总是删除最小的 id，剩下的 id 是连续的，所以不用 COUNT(*) 全表扫描
+        with self._lock:
+            low, high = self.conn.execute('SELECT MIN(id), MAX(id) FROM pending').fetchone()
+        return 0 if low is None else high - low + 1
+
+    def push(self, alphas):
+        rows = ((alpha.get('type', 'REGULAR'), json.dumps(alpha['settings']), alpha['regular']) for alpha in alphas)
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = self.conn.executemany('INSERT INTO pending (type, settings, regular) VALUES (?, ?, ?)', rows)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return cursor.rowcount
+
+    def pop(self, batch_size, owner=''):
+        '''
+        取出最多 batch_size 个 alpha，同时原子地登记到 inflight（state=queued，owner 一般是账号）
+        '''
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.conn.execute('SELECT id, type, settings, regular FROM pending ORDER BY id LIMIT ?',
+                                         (batch_size,)).fetchall()
+                if rows:
+                    now = time.time()
+                    self.conn.executemany('''INSERT OR REPLACE INTO inflight (id, type, settings, regular, owner, state, updated)
+                                             VALUES (?, ?, ?, ?, ?, 'queued', ?)''',
+                                          (row + (owner, now) for row in rows))
+                    self.conn.execute('DELETE FROM pending WHERE id <= ?', (rows[-1][0],))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+        return [self._to_alpha(*row) for row in rows]
+
+    @staticmethod
+    def _to_alpha(queue_id, alpha_type, settings, regular):
+        alpha = QueuedAlpha(type=alpha_type, settings=json.loads(settings), regular=regular)
+        alpha.queue_id = queue_id
+        return alpha
+
+    def mark_posted(self, queue_ids, location):
+        '''
+        拿到 Location 后立刻落盘，multi-simulation 的所有 children 共用 parent 的 Location
+        '''
+        now = time.time()
+        with self._lock:
+            self.conn.executemany("UPDATE inflight SET state = 'posted', location = ?, updated = ? WHERE id = ?",
+                                  ((location, now, queue_id) for queue_id in queue_ids))
+
+    def restore(self, owner=''):
+        '''
+        启动时恢复 owner 的在途状态，返回 (queued_alphas, {location: [queue_id, ...]})
+        '''
+        with self._lock:
+            rows = self.conn.execute('SELECT id, type, settings, regular, state, location FROM inflight '
+                                     'WHERE owner = ? ORDER BY id', (owner,)).fetchall()
+        queued = []
+        posted = {}
+        for queue_id, alpha_type, settings, regular, state, location in rows:
+            if state == 'posted' and location:
+                posted.setdefault(location, []).append(queue_id)
+            else:
+                queued.append(self._to_alpha(queue_id, alpha_type, settings, regular))
+        if rows:
+            logging.info(f"Restored {len(queued)} queued alphas and {len(posted)} posted simulations for {owner}.")
+        return queued, posted
+
+    def complete(self, queue_ids):
+        '''
+        alpha 回测结束（或最终失败）后从 inflight 删除
+        '''
+        with self._lock:
+            self.conn.executemany('DELETE FROM inflight WHERE id = ?', ((queue_id,) for queue_id in queue_ids))
+
+    def import_csv(self, csv_path):
+        '''
+        导入 csv 队列（headers: type,settings,regular）里上次之后新追加的行:
+        1. 记下每个文件导入到的字节偏移和偏移前内容的指纹，只读偏移之后完整的行，写了一半的最后一行留到下次；
+           文件被删掉重建时即使 inode 被复用、长度也够，指纹对不上就从头导入
+        2. 读文件、插入 pending、更新偏移在同一个事务里，多个进程同时导入也不会重复
+        3. 不改名 csv，正在追加的生成脚本不会丢行；全部导入且 COMPACT_IDLE 秒没有写入时，
+           在同一个事务里截断到只剩表头
+        '''
+        return self._import_new_rows(csv_path)
+
+    def _import_new_rows(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        key = os.path.abspath(path)
+
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute('SELECT inode, offset, header, fingerprint FROM csv_imports WHERE path = ?',
+                                        (key,)).fetchone()
+                inode, offset, header, fingerprint = row or (None, 0, None, None)
+                if inode != stat.st_ino or stat.st_size < offset:
+                    offset, header = 0, None
+                start = max(0, offset - FINGERPRINT_BYTES)
+                with open(path, 'rb') as file:
+                    file.seek(start)
+                    data = file.read()
+                # 旧版本没有记指纹的照旧按偏移导入
+                if offset and fingerprint is not None and _fingerprint(data[:offset - start]) != fingerprint:
+                    logging.info(f"{path} was recreated, importing it from the beginning.")
+                    offset, header, start = 0, None, 0
+                    with open(path, 'rb') as file:
+                        data = file.read()
+                data = data[offset - start:]
+                end = data.rfind(b'\n') + 1
+                reader = csv.reader(io.StringIO(data[:end].decode('utf-8'), newline=''))
+                if header is None:
+                    header = json.dumps(next(reader, None))
+                fields = json.loads(header)
+                rows = []
+                for values in reader:
+                    if not values or fields is None:
+                        continue
+                    alpha = dict(zip(fields, values))
+                    try:
+                        alpha['settings'] = ast.literal_eval(alpha['settings'])
+                    except (ValueError, SyntaxError):
+                        print(f"Error evaluating settings: {alpha['settings']}")
+                        continue
+                    rows.append((alpha.get('type') or 'REGULAR', json.dumps(alpha['settings']), alpha['regular']))
+                self.conn.executemany('INSERT INTO pending (type, settings, regular) VALUES (?, ?, ?)', rows)
+                offset += end
+                if fields is not None and offset == stat.st_size and time.time() - stat.st_mtime > COMPACT_IDLE:
+                    offset = self._compact(path, stat) or offset
+                with open(path, 'rb') as file:
+                    file.seek(max(0, offset - FINGERPRINT_BYTES))
+                    fingerprint = _fingerprint(file.read(offset - max(0, offset - FINGERPRINT_BYTES)))
+                self.conn.execute('INSERT OR REPLACE INTO csv_imports (path, inode, offset, header, fingerprint) '
+                                  'VALUES (?, ?, ?, ?, ?)',
+                                  (key, stat.st_ino, offset, header if fields is not None else None, fingerprint))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+        if rows:
+            logging.info(f"Imported {len(rows)} alphas from {path} into {self.db_path}")
+        return len(rows)
+
+    @staticmethod
+    def _compact(path, stat):
+        '''
+        把已经全部导入的 csv 截断到只剩表头，返回新的偏移；截断前文件又有写入（长度或修改时间变了）就不截断，返回 None
+        '''
+        with open(path, 'r+b') as file:
+            header_end = len(file.readline())
+            current = os.fstat(file.fileno())
+            if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns) or header_end >= stat.st_size:
+                return None
+            file.truncate(header_end)
+        logging.info(f"Truncated {path} after importing all of its rows.")
+        return header_end
+
+
+def _fingerprint(data):
+    return hashlib.sha1(data).hexdigest()
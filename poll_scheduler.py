@@ -0,0 +1,123 @@
+import heapq
+import threading
+import time
+
+
+class PollScheduler:
+    '''
+    按 Retry-After 安排 simulation 轮询的最小堆调度器:
+    1. 堆里存 (next_poll_time, location)，只有到期的 location 才会被取出去 GET
+    2. 同一个 location 重新 schedule 时采用懒删除，旧的堆元素在出堆时丢弃
+    3. next_ready / wait 是阻塞原语，主循环可以一直睡到最早的 Retry-After 到期；
+       别的线程有事要主循环处理时（后台提交拿到了 Location）用 wake 叫醒它
+    '''
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+        self._woken = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._due)
+
+    def __contains__(self, location):
+        with self._cond:
+            return location in self._due
+
+    def schedule(self, location, delay=0):
+        '''
+        delay 秒后再轮询 location，delay 一般直接取 Retry-After
+        '''
+        next_poll_time = time.monotonic() + max(float(delay), 0)
+        with self._cond:
+            self._due[location] = next_poll_time
+            heapq.heappush(self._heap, (next_poll_time, location))
+            self._cond.notify_all()
+
+    def remove(self, location):
+        with self._cond:
+            self._due.pop(location, None)
+            self._cond.notify_all()
+
+    def wake(self):
+        '''
+        让正在 wait 的线程马上返回 False（没有 wait 的话，下一次 wait 立即返回）
+        '''
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def _discard_stale(self):
+        while self._heap:
+            next_poll_time, location = self._heap[0]
+            if self._due.get(location) == next_poll_time:
+                return
+            heapq.heappop(self._heap)
+
+    def seconds_until_next(self):
+        '''
+        距离最早到期的 location 还有多少秒，没有在途 simulation 时返回 None
+        '''
+        with self._cond:
+            self._discard_stale()
+            if not self._heap:
+                return None
+            return max(self._heap[0][0] - time.monotonic(), 0)
+
+    def pop_ready(self):
+        '''
+        非阻塞：取出所有已经到期的 location
+        '''
+        ready = []
+        now = time.monotonic()
+        with self._cond:
+            self._discard_stale()
+            while self._heap and self._heap[0][0] <= now:
+                _, location = heapq.heappop(self._heap)
+                del self._due[location]
+                ready.append(location)
+                self._discard_stale()
+        return ready
+
+    def wait(self, timeout=None):
+        '''
+        阻塞到至少有一个 location 到期、被 wake 或者超时，返回是否有到期的 location
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._discard_stale()
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    return True
+                if self._woken:
+                    self._woken = False
+                    return False
+                waits = []
+                if self._heap:
+                    waits.append(self._heap[0][0] - now)
+                if deadline is not None:
+                    if deadline <= now:
+                        return False
+                    waits.append(deadline - now)
+                self._cond.wait(min(waits) if waits else None)
+
+    def next_ready(self, timeout=None):
+        '''
+        阻塞：等待并取出下一个到期的 location，超时返回 None
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not self.wait(remaining):
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None
+                continue
+            with self._cond:
+                self._discard_stale()
+                if self._heap and self._heap[0][0] <= time.monotonic():
+                    _, location = heapq.heappop(self._heap)
+                    del self._due[location]
+                    return location
@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from circuit_breaker import endpoint_class
+
+# 每类接口的 (每秒令牌数, 桶容量)；不在表里的用 DEFAULT_RATE
+ENDPOINT_RATES = {
+    'simulations': (1.0, 5),
+    'simulations/{id}': (8.0, 16),
+    'alphas/{id}': (4.0, 8),
+    'alphas/{id}/check': (1.0, 3),
+    'data-fields': (4.0, 8),
+    'data-sets': (2.0, 4),
+}
+DEFAULT_RATE = (4.0, 8)
+
+
+class RateLimiter:
+    '''
+    同一台机器上所有脚本共享的令牌桶限流器，按 账号 + 接口类别 分桶:
+    1. 桶的状态存在 state_dir 下的 JSON 文件里，读写时用 O_CREAT|O_EXCL 建的锁文件互斥，
+       Windows/Linux 都能用，不依赖 fcntl
+    2. reserve 先预约一个令牌，返回需要等待的秒数，调用方自己 sleep（同步）或 asyncio.sleep（异步）
+    3. 收到 429 时 penalize：按 Retry-After 暂停整个桶，发放速率减半，
+       之后在 recovery 秒内线性恢复到默认速率，各进程不再各自撞 429 再各自 sleep 15 秒
+    '''
+
+    def __init__(self, state_dir=None, rates=ENDPOINT_RATES, default_rate=DEFAULT_RATE,
+                 min_rate=0.1, recovery=120.0, stale_lock=10.0):
+        state_dir = state_dir or os.path.join(tempfile.gettempdir(), 'brain_rate_limit')
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_path = os.path.join(state_dir, 'buckets.json')
+        self.lock_path = os.path.join(state_dir, 'buckets.lock')
+        self.rates = rates
+        self.default_rate = default_rate
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.stale_lock = stale_lock
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            while True:
+                try:
+                    os.close(os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    break
+                except FileExistsError:
+                    # 持锁的进程被杀掉后锁文件会留下来，超过 stale_lock 秒视为失效
+                    try:
+                        if time.time() - os.path.getmtime(self.lock_path) > self.stale_lock:
+                            os.remove(self.lock_path)
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    time.sleep(0.002)
+            try:
+                yield
+            finally:
+                os.remove(self.lock_path)
+
+    def _load(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save(self, state):
+        tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _bucket(self, state, key, endpoint, now):
+        base_rate, burst = self.rates.get(endpoint, self.default_rate)
+        bucket = state.setdefault(key, {'tokens': burst, 'rate': base_rate, 'updated': now, 'blocked_until': 0.0})
+        elapsed = max(0.0, now - bucket['updated'])
+        bucket['rate'] = min(base_rate, bucket['rate'] + elapsed * base_rate / self.recovery)
+        bucket['tokens'] = min(burst, bucket['tokens'] + elapsed * bucket['rate'])
+        bucket['updated'] = now
+        return bucket
+
+    def reserve(self, url, account=''):
+        '''
+        预约一个令牌，返回发送请求前要等待的秒数（0 表示可以立即发送）
+        '''
+        endpoint = endpoint_class(url)
+        with self._locked():
+            state = self._load()
+            now = time.time()
+            bucket = self._bucket(state, f'{account}:{endpoint}', endpoint, now)
+            bucket['tokens'] -= 1
+            wait = max(0.0, -bucket['tokens'] / bucket['rate'], bucket['blocked_until'] - now)
+            self._save(state)
+        return wait
+
+    def acquire(self, url, account=''):
+        wait = self.reserve(url, account)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, url, retry_after=None, account=''):
+        '''
+        收到 429 后调用：整个桶暂停 retry_after 秒，发放速率减半
+        '''
+        endpoint = endpoint_class(url)
+        with self._locked():
+            state = self._load()
+            now = time.time()
+            bucket = self._bucket(state, f'{account}:{endpoint}', endpoint, now)
+            bucket['rate'] = max(self.min_rate, bucket['rate'] / 2)
+            bucket['tokens'] = min(bucket['tokens'], 0.0)
+            if retry_after:
+                bucket['blocked_until'] = max(bucket['blocked_until'], now + float(retry_after))
+            self._save(state)
+        logging.info(f"Rate limited on {endpoint}, slowing down to {bucket['rate']:.2f} req/s.")
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def scaled_rates(scale):
+    return ({endpoint: (rate * scale, burst * scale) for endpoint, (rate, burst) in ENDPOINT_RATES.items()},
+            (DEFAULT_RATE[0] * scale, DEFAULT_RATE[1] * scale))
+
+
+def default_limiter():
+    '''
+    进程内共享的限流器，状态目录可以用环境变量 BRAIN_RATE_LIMIT_DIR 指定（默认在系统临时目录下）；
+    BRAIN_RATE_LIMIT_SCALE 把所有速率和桶容量乘一个倍数（对着本地替身服务器压测时放开限流）
+    '''
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            rates, default_rate = scaled_rates(float(os.environ.get('BRAIN_RATE_LIMIT_SCALE', 1)))
+            _default_limiter = RateLimiter(os.environ.get('BRAIN_RATE_LIMIT_DIR'), rates, default_rate)
+        return _default_limiter
@@ -0,0 +1,128 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+# 结果文件的固定列，顺序即写出顺序；alpha JSON 里不在这里的键直接丢弃，缺的键写 None
+RESULT_FIELDS = [
+    'id', 'type', 'status', 'name', 'dateCreated', 'grade', 'stage',
+    'regular.code',
+    'settings.instrumentType', 'settings.region', 'settings.universe', 'settings.delay',
+    'settings.decay', 'settings.neutralization', 'settings.truncation', 'settings.pasteurization',
+    'settings.unitHandling', 'settings.nanHandling', 'settings.language',
+    'is.pnl', 'is.bookSize', 'is.longCount', 'is.shortCount', 'is.turnover', 'is.returns',
+    'is.drawdown', 'is.margin', 'is.sharpe', 'is.fitness', 'is.startDate', 'is.checks',
+    'message', 'simulation_id',
+]
+
+# 数值列；其余列一律按字符串写 parquet，保证每个 part 文件的列类型一致
+NUMERIC_FIELDS = {
+    'settings.delay', 'settings.decay', 'settings.truncation',
+    'is.pnl', 'is.bookSize', 'is.longCount', 'is.shortCount', 'is.turnover', 'is.returns',
+    'is.drawdown', 'is.margin', 'is.sharpe', 'is.fitness',
+}
+
+
+def error_result(progress, simulation_id=None):
+    '''
+    没有产生 alpha 的 simulation（ERROR/FAIL，或 multi-simulation 里失败的 child）写成的一行:
+    1. progress 里的 id 是 simulation id 不是 alpha id，放到 simulation_id 列，id 留空（去重索引据此把它删掉以便重提）
+    2. 保留 message，regular 是表达式字符串时放进 regular.code，方便查哪个表达式出错
+    '''
+    regular = progress.get('regular')
+    return {
+        'id': None,
+        'type': progress.get('type'),
+        'status': progress.get('status') or 'ERROR',
+        'message': progress.get('message'),
+        'simulation_id': simulation_id or progress.get('id'),
+        'settings': progress.get('settings'),
+        'regular': {'code': regular} if isinstance(regular, str) else regular,
+    }
+
+
+def flatten_alpha(alpha, fields=RESULT_FIELDS):
+    '''
+    把嵌套的 alpha JSON 压平成固定 schema 的一行，例如 alpha['is']['sharpe'] -> row['is.sharpe']。
+    值是 list/dict 时（如 is.checks）存成 JSON 字符串，保证每一列都是标量
+    '''
+    row = {}
+    for field in fields:
+        value = alpha
+        for key in field.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+            if value is None:
+                break
+        if isinstance(value, (list, dict)):
+            value = json.dumps(value, ensure_ascii=False)
+        row[field] = value
+    return row
+
+
+class ResultSink:
+    '''
+    回测结果的缓冲写出器:
+    1. add() 只把压平后的行放进内存缓冲，不在轮询循环里逐行 open/close 文件
+    2. 缓冲达到 flush_rows 行时批量写出；后台线程每 flush_interval 秒把剩下的也写出，队列空闲时结果不会一直留在内存里
+    3. path 以 .jsonl 结尾时追加写 JSON Lines；以 .parquet 结尾时 path 是一个目录，
+       每批写一个 part 文件，pandas.read_parquet(path) 一次读回全部结果（需要 pyarrow）
+    '''
+
+    def __init__(self, path, flush_interval=30, flush_rows=100, fields=RESULT_FIELDS):
+        self.path = path
+        self.format = 'parquet' if path.endswith('.parquet') else 'jsonl'
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.fields = fields
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._parts = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        threading.Thread(target=self._flush_periodically, name='result-sink-flush', daemon=True).start()
+        atexit.register(self.close)
+
+    def add(self, alpha):
+        with self._lock:
+            self._buffer.append(flatten_alpha(alpha, self.fields))
+            due = (len(self._buffer) >= self.flush_rows
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+            if not rows:
+                return
+            if self.format == 'parquet':
+                self._write_parquet(rows)
+            else:
+                self._write_jsonl(rows)
+        logging.info(f"Flushed {len(rows)} simulation results to {self.path}")
+
+    def _write_jsonl(self, rows):
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+    def _write_parquet(self, rows):
+        import pandas as pd
+
+        os.makedirs(self.path, exist_ok=True)
+        self._parts += 1
+        part_path = os.path.join(self.path, f'part-{int(time.time())}-{os.getpid()}-{id(self)}-{self._parts:05d}.parquet')
+        df = pd.DataFrame(rows, columns=self.fields)
+        for field in self.fields:
+            df[field] = df[field].astype('float64' if field in NUMERIC_FIELDS else 'string')
+        df.to_parquet(part_path, index=False)
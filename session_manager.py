@@ -0,0 +1,65 @@
+import logging
+import threading
+
+import requests
+
+
+class SessionManager:
+    '''
+    多个并发请求共享的登录 session，重新登录是 single-flight 的:
+    1. login 是一个无参函数，返回新的 requests.Session（失败返回 None），比如各脚本里的 sign_in
+    2. 请求失败的调用方把自己手里那个失效的 session 交给 reauthenticate，
+       第一个进来的线程负责重新登录，其余线程在锁上等待，拿到的是同一个新 session，不会各自再登录一次
+    3. request() 只在 401 时走 reauthenticate：幂等请求换新 session 重发一次，POST 不自动重发（服务器可能已经受理），
+       把 401 交给调用方；网络异常不重新登录，直接抛给调用方，由连接池的重试策略和调用方的重试循环处理
+    '''
+
+    def __init__(self, login, session=None):
+        self._login = login
+        self._session = session
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        return self._session
+
+    def reauthenticate(self, stale_session=None):
+        '''
+        stale_session 是调用方发现已经失效的 session；如果在等锁期间别的线程已经换过 session，
+        直接返回新的 session，不再重复登录
+        '''
+        with self._lock:
+            if self._session is not stale_session and self._session is not None:
+                return self._session
+            logging.info("Session expired, signing in again...")
+            session = self._login()
+            if session is not None:
+                self._session = session
+            return self._session
+
+    def _fresh_session(self, stale_session):
+        session = self.reauthenticate(stale_session)
+        if session is None:
+            raise requests.exceptions.ConnectionError("Failed to sign in to BRAIN.")
+        return session
+
+    def request(self, method, url, **kwargs):
+        session = self._session or self._fresh_session(None)
+        response = session.request(method, url, **kwargs)
+        if response.status_code != 401:
+            return response
+
+        fresh_session = self._fresh_session(session)
+        if method.upper() == 'POST':
+            logging.error(f"{method} {url} got 401, signed in again; leaving the retry to the caller.")
+            return response
+        return fresh_session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
@@ -0,0 +1,241 @@
+'''
+流水线各组件的回归测试，对着进程内的替身服务器（mock_brain_server.MockBrainServer）跑，不消耗真实额度:
+1. PendingQueue 的 pop / restore / complete 和 csv 增量导入
+2. PollScheduler 按 Retry-After 到期顺序出堆
+3. CircuitBreaker 的 closed -> open -> half-open 状态切换
+4. 去重索引跨账号复用结果
+5. http_cache 过期后用 ETag 重新验证，PATCH 后失效
+6. AlphaSimulator 把队列跑空
+
+用法:
+    python -m pytest -q test_pipeline.py
+'''
+import glob
+import json
+import os
+import tempfile
+import time
+
+import pytest
+
+from mock_brain_server import MockBrainConfig, MockBrainServer
+
+WORKDIR = tempfile.mkdtemp(prefix='brain_test_')
+SERVER = MockBrainServer(MockBrainConfig(latency=0.001, sim_duration=0.2, sim_sigma=0, poll_interval=0.1,
+                                         seed=1)).start()
+# 这些环境变量必须在 import brain_api 之前设置
+os.environ['BRAIN_API_URL'] = SERVER.url
+os.environ['BRAIN_DEDUP_INDEX'] = os.path.join(WORKDIR, 'simulated_index.sqlite')
+os.environ['BRAIN_HTTP_CACHE'] = os.path.join(WORKDIR, 'http_cache.sqlite')
+os.environ['BRAIN_RATE_LIMIT_DIR'] = os.path.join(WORKDIR, 'rate_limit')
+os.environ['BRAIN_METRICS_DIR'] = os.path.join(WORKDIR, 'metrics')
+os.environ['BRAIN_RATE_LIMIT_SCALE'] = '100'
+
+import brain_api  # noqa: E402
+from circuit_breaker import CircuitBreaker  # noqa: E402
+from http_cache import ResponseCache, default_cache  # noqa: E402
+from machine_lib import generate_sim_data  # noqa: E402
+from pending_queue import PendingQueue  # noqa: E402
+from poll_scheduler import PollScheduler  # noqa: E402
+
+
+@pytest.fixture(scope='module', autouse=True)
+def mock_server():
+    yield SERVER
+    SERVER.stop()
+
+
+def make_alphas(*expressions):
+    return generate_sim_data([(expression, 4) for expression in expressions], 'USA', 'TOP3000', 'SUBINDUSTRY')
+
+
+def post_count():
+    return sum(count for key, count in SERVER.state.stats.items() if key.startswith('POST simulations '))
+
+
+def write_csv(path, mode, expressions, header=False):
+    with open(path, mode, newline='') as f:
+        if header:
+            f.write('type,settings,regular\n')
+        for expression in expressions:
+            f.write(f'REGULAR,"{{\'region\': \'USA\'}}",{expression}\n')
+
+
+def test_pending_queue_pop_restore_complete(tmp_path):
+    queue = PendingQueue(str(tmp_path / 'queue.sqlite'))
+    assert queue.push(make_alphas('close', 'open', 'volume')) == 3
+
+    posted, queued = queue.pop(2, owner='a@example.com')
+    assert [posted['regular'], queued['regular']] == ['close', 'open']
+    assert len(queue) == 1
+    queue.mark_posted([posted.queue_id], 'http://mock/simulations/S1')
+
+    restored_queued, restored_posted = queue.restore('a@example.com')
+    assert [alpha['regular'] for alpha in restored_queued] == ['open']
+    assert restored_queued[0]['settings'] == queued['settings']
+    assert restored_posted == {'http://mock/simulations/S1': [posted.queue_id]}
+    # 别的账号恢复不到 a 的在途状态
+    assert queue.restore('b@example.com') == ([], {})
+
+    queue.complete([posted.queue_id, queued.queue_id])
+    assert queue.restore('a@example.com') == ([], {})
+    assert [alpha['regular'] for alpha in queue.pop(10)] == ['volume']
+
+
+def test_pending_queue_imports_only_new_csv_rows(tmp_path):
+    queue = PendingQueue(str(tmp_path / 'queue.sqlite'))
+    csv_path = str(tmp_path / 'alphas.csv')
+
+    write_csv(csv_path, 'w', ['a1', 'a2'], header=True)
+    assert queue.import_csv(csv_path) == 2
+    assert queue.import_csv(csv_path) == 0
+    # 写了一半的行留到下次
+    with open(csv_path, 'a') as f:
+        f.write('REGULAR,"{\'region\': \'USA\'}",a3')
+    assert queue.import_csv(csv_path) == 0
+    with open(csv_path, 'a') as f:
+        f.write('\n')
+    assert queue.import_csv(csv_path) == 1
+
+    # 原地重写（inode 不变）而且比上次的偏移还长，也要从头导入
+    inode = os.stat(csv_path).st_ino
+    write_csv(csv_path, 'r+', ['b1', 'b2', 'b3', 'b4'], header=True)
+    assert os.stat(csv_path).st_ino == inode
+    assert queue.import_csv(csv_path) == 4
+    assert [alpha['regular'] for alpha in queue.pop(10)] == ['a1', 'a2', 'a3', 'b1', 'b2', 'b3', 'b4']
+
+
+def test_pending_queue_truncates_idle_csv(tmp_path):
+    queue = PendingQueue(str(tmp_path / 'queue.sqlite'))
+    csv_path = str(tmp_path / 'alphas.csv')
+    write_csv(csv_path, 'w', ['a1', 'a2'], header=True)
+    idle = time.time() - 3600
+    os.utime(csv_path, (idle, idle))
+
+    assert queue.import_csv(csv_path) == 2
+    with open(csv_path) as f:
+        assert f.read() == 'type,settings,regular\n'
+
+    write_csv(csv_path, 'a', ['c1'])
+    assert queue.import_csv(csv_path) == 1
+    assert [alpha['regular'] for alpha in queue.pop(10)] == ['a1', 'a2', 'c1']
+
+
+def test_poll_scheduler_pops_in_due_order():
+    scheduler = PollScheduler()
+    scheduler.schedule('c', 0.4)
+    scheduler.schedule('a', 0)
+    scheduler.schedule('b', 0.2)
+    # 重新 schedule 时旧的堆元素作废
+    scheduler.schedule('a', 0.6)
+    assert scheduler.pop_ready() == []
+    assert len(scheduler) == 3
+
+    assert scheduler.next_ready(timeout=2) == 'b'
+    assert scheduler.next_ready(timeout=2) == 'c'
+    assert scheduler.next_ready(timeout=2) == 'a'
+    assert scheduler.seconds_until_next() is None
+    assert scheduler.next_ready(timeout=0.05) is None
+
+
+def test_poll_scheduler_wake_interrupts_wait():
+    scheduler = PollScheduler()
+    scheduler.schedule('a', 30)
+    scheduler.wake()
+    start = time.monotonic()
+    assert scheduler.wait(timeout=5) is False
+    assert time.monotonic() - start < 1
+    assert 'a' in scheduler
+
+
+def test_circuit_breaker_state_changes():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.2)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.seconds_until_retry() <= 0.2
+
+    time.sleep(0.25)
+    # half-open 只放行一个探测请求，探测失败重新 open
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.25)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.seconds_until_retry() == 0.0
+
+
+def test_dedup_reuses_results_across_accounts():
+    first = brain_api.sign_in(username='first@example.com', password='secret')
+    second = brain_api.sign_in(username='second@example.com', password='secret')
+    finished, pending = make_alphas('rank(ts_delta(close, 3))', 'rank(ts_delta(close, 4))')
+
+    location = brain_api.simulate(first, finished)
+    alpha_id = brain_api.simulation_results(first, location)[0]['id']
+    pending_location = brain_api.simulate(first, pending)
+    posts = post_count()
+
+    # 同一个账号直接复用 Location，别的账号复用已经有的结果，都不再 POST
+    assert brain_api.simulate(first, finished) == location
+    assert brain_api.simulate(second, finished) is None
+    assert brain_api.simulated_result(finished)['id'] == alpha_id
+    assert post_count() == posts
+
+    # 别的账号提交了但还没结果的，Location 只有提交的账号能轮询，照常提交
+    assert brain_api.simulate(second, pending) not in (None, pending_location)
+    assert post_count() == posts + 1
+
+
+def test_http_cache_revalidates_with_etag(tmp_path):
+    s = brain_api.sign_in(username='cache@example.com', password='secret')
+    location = brain_api.simulate(s, make_alphas('rank(ts_delta(volume, 5))')[0])
+    url = f"{SERVER.url}/alphas/{brain_api.simulation_results(s, location)[0]['id']}"
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+
+    body = cache.get(s, url, ttl=0.2).json()
+    assert (cache.hits, cache.misses, cache.revalidated) == (0, 1, 0)
+    assert cache.get(s, url, ttl=0.2).json() == body
+    assert cache.hits == 1
+
+    time.sleep(0.25)
+    assert cache.get(s, url, ttl=0.2).json() == body
+    assert cache.revalidated == 1
+    assert SERVER.state.stats.get('GET alphas/{id} 304') == 1
+
+
+def test_http_cache_is_invalidated_by_patch():
+    s = brain_api.sign_in(username='patch@example.com', password='secret')
+    location = brain_api.simulate(s, make_alphas('rank(ts_delta(volume, 6))')[0])
+    alpha_id = brain_api.simulation_results(s, location)[0]['id']
+    url = f'{SERVER.url}/alphas/{alpha_id}'
+    cache = default_cache()
+
+    assert not brain_api.cached_get(s, url).json().get('tags')
+    misses = cache.misses
+    brain_api.patch_alpha(s, alpha_id, {'tags': ['checked']})
+    assert brain_api.cached_get(s, url).json()['tags'] == ['checked']
+    assert cache.misses == misses + 1
+
+
+def test_alpha_simulator_drains_queue(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from AlphaSimulator import AlphaSimulator
+
+    simulator = AlphaSimulator(3, 'drain@example.com', 'secret', 'alpha_list_pending_simulated.csv', 0,
+                               multi_simulation_size=2)
+    simulator.pending_queue.push(make_alphas(*[f'rank(ts_mean(close, {i}))' for i in range(2, 9)]))
+    simulator.manage_simulations(stop_when_empty=True)
+
+    with open(glob.glob('simulated_alphas_*.jsonl')[0]) as f:
+        rows = [json.loads(line) for line in f]
+    assert sorted(row['regular.code'] for row in rows) == sorted(f'rank(ts_mean(close, {i}))' for i in range(2, 9))
+    assert all(row['id'] for row in rows)
+    assert simulator.pending_queue.restore('drain@example.com') == ([], {})
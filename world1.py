@@ -3,25 +3,10 @@ import json
 from os.path import expanduser
 from requests.auth import HTTPBasicAuth
 
-# 加载凭据文件
-with open(expanduser('brain_credentials.txt')) as f:
-    credentials = json.load(f)
+# 登录统一走 brain_api：带连接池和重试策略的 session
+from brain_api import sign_in, simulate, simulated_result
 
-# 从列表中提取用户名和密码
-username, password = credentials
-
-# 创建会话对象
-sess = requests.Session()
-
-# 设置基本身份验证
-sess.auth = HTTPBasicAuth(username, password)
-
-# 向API发送POST请求进行身份验证
-response = sess.post('https://api.worldquantbrain.com/authentication')
-
-# 打印响应状态和内容以调试
-print(response.status_code)
-print(response.json())
+sess = sign_in()
 
 simulation_data = {
     'type': 'REGULAR',
@@ -44,20 +29,18 @@ simulation_data = {
 
 from time import sleep
 
-sim_resp = sess.post(
-    'https://api.worldquantbrain.com/simulations',
-    json=simulation_data,
-)
-
-sim_progress_url = sim_resp.headers['Location']
+sim_progress_url = simulate(sess, simulation_data)
 
-while True:
-    sim_progress_resp = sess.get(sim_progress_url)
-    retry_after_sec = float(sim_progress_resp.headers.get("Retry-After", 0))
-    if retry_after_sec == 0:  # simulation done!模拟完成!
-        break
-    sleep(retry_after_sec)
+if sim_progress_url is None:  # 别的账号已经回测过，直接用去重索引里的结果
+    alpha_id = simulated_result(simulation_data)["id"]
+else:
+    while True:
+        sim_progress_resp = sess.get(sim_progress_url)
+        retry_after_sec = float(sim_progress_resp.headers.get("Retry-After", 0))
+        if retry_after_sec == 0:  # simulation done!模拟完成!
+            break
+        sleep(retry_after_sec)
 
-alpha_id = sim_progress_resp.json()["alpha"]  # the final simulation result 模拟最终模拟结果
+    alpha_id = sim_progress_resp.json()["alpha"]  # the final simulation result 模拟最终模拟结果
 
 print(alpha_id)
@@ -5,27 +5,9 @@ from os.path import expanduser
 from requests.auth import HTTPBasicAuth
 
 #1029
-def sign_in():
-    # Load credentials # 加载凭证
-    with open(expanduser('brain_credentials.txt')) as f:
-        credentials = json.load(f)
-
-    # Extract username and password from the list # 从列表中提取用户名和密码
-    username, password = credentials
-
-    # Create a session object # 创建会话对象
-    sess = requests.Session()
-
-    # Set up basic authentication # 设置基本身份验证
-    sess.auth = HTTPBasicAuth(username, password)
-
-    # Send a POST request to the API for authentication # 向API发送POST请求进行身份验证
-    response = sess.post('https://api.worldquantbrain.com/authentication')
-
-    # Print response status and content for debugging # 打印响应状态和内容以调试
-    print(response.status_code)
-    print(response.json())
-    return sess
+# 登录统一走 brain_api：带连接池和重试策略的 session
+from brain_api import sign_in, simulate
+from machine_lib import get_datafields_in_scope as get_datafields
 
 
 sess = sign_in()
@@ -33,42 +15,6 @@ sess = sign_in()
 # -------------------------------------------------------------------------
 # 获取数据集ID为fundamental6（Company Fundamental Data for Equity）下的所有数据字段
 # -------------------------------------------------------------------------
-def get_datafields(
-        s,
-        searchScope,
-        dataset_id: str = '',
-        search: str = ''
-):
-    import pandas as pd
-    instrument_type = searchScope['instrumentType']
-    region = searchScope['region']
-    delay = searchScope['delay']
-    universe = searchScope['universe']
-
-    if len(search) == 0:
-        url_template = "https://api.worldquantbrain.com/data-fields?" + \
-                       f"&instrumentType={instrument_type}" + \
-                       f"&region={region}&delay={str(delay)}&universe={universe}&dataset.id={dataset_id}&limit=50" + \
-                       "&offset={x}"
-        count = s.get(url_template.format(x=0)).json()['count']
-    else:
-        url_template = "https://api.worldquantbrain.com/data-fields?" + \
-                       f"&instrumentType={instrument_type}" + \
-                       f"&region={region}&delay={str(delay)}&universe={universe}&limit=50" + \
-                       f"&search={search}" + \
-                       "&offset={x}"
-        count = 100
-
-    datafields_list = []
-    for x in range(0, count, 50):
-        datafields = s.get(url_template.format(x=x))
-        datafields_list.append(datafields.json()['results'])
-
-    datafields_list_flat = [item for sublist in datafields_list for item in sublist]
-
-    datafields_df = pd.DataFrame(datafields_list_flat)
-    return datafields_df
-
 
 # 定义搜索范围
 searchScope = {'region': 'USA', 'delay': '1', 'universe': 'TOP3000', 'instrumentType': 'EQUITY'}
@@ -184,12 +130,7 @@ for index in range(0, len(alpha_list)):
 
     while keep_trying:
         try:
-            sim_resp = sess.post(
-                'https://api.worldquantbrain.com/simulations',
-                json=alpha
-            )
-
-            sim_progress_url = sim_resp.headers['Location']
+            sim_progress_url = simulate(sess, alpha)
             logging.info(f'Alpha location is: {sim_progress_url}')
             print(f'Alpha location is: {sim_progress_url}')
 
@@ -5,60 +5,16 @@ from os.path import expanduser
 from requests.auth import HTTPBasicAuth
 
 #1029
-def sign_in():
-    # Load credentials
-    with open(expanduser('brain_credentials.txt')) as f:
-        credentials = json.load(f)
-
-    # Extract username and password
-    username, password = credentials
-
-    # Create a session object
-    sess = requests.Session()
-    sess.auth = HTTPBasicAuth(username, password)
-
-    # Authentication
-    response = sess.post('https://api.worldquantbrain.com/authentication')
-    print(response.status_code)
-    print(response.json())
-    return sess
+# 登录统一走 brain_api：带连接池和重试策略的 session
+from brain_api import sign_in, simulate
+from machine_lib import get_datafields_in_scope as get_datafields
 
 sess = sign_in()
 
 
 # ======================================================
-# 获取数据字段（原样保留）
+# 获取数据字段（machine_lib 里共用的并发翻页）
 # ======================================================
-def get_datafields(s, searchScope, dataset_id: str = '', search: str = ''):
-    import pandas as pd
-    instrument_type = searchScope['instrumentType']
-    region = searchScope['region']
-    delay = searchScope['delay']
-    universe = searchScope['universe']
-
-    if len(search) == 0:
-        url_template = "https://api.worldquantbrain.com/data-fields?" + \
-                       f"&instrumentType={instrument_type}" + \
-                       f"&region={region}&delay={str(delay)}&universe={universe}&dataset.id={dataset_id}&limit=50" + \
-                       "&offset={x}"
-        count = s.get(url_template.format(x=0)).json()['count']
-    else:
-        url_template = "https://api.worldquantbrain.com/data-fields?" + \
-                       f"&instrumentType={instrument_type}" + \
-                       f"&region={region}&delay={str(delay)}&universe={universe}&limit=50" + \
-                       f"&search={search}" + \
-                       "&offset={x}"
-        count = 100
-
-    datafields_list = []
-    for x in range(0, count, 50):
-        datafields = s.get(url_template.format(x=x))
-        datafields_list.append(datafields.json()['results'])
-
-    datafields_list_flat = [item for sublist in datafields_list for item in sublist]
-    datafields_df = pd.DataFrame(datafields_list_flat)
-    return datafields_df
-
 
 searchScope = {'region': 'USA', 'delay': '1', 'universe': 'TOP3000', 'instrumentType': 'EQUITY'}
 fnd6 = get_datafields(s=sess, searchScope=searchScope, dataset_id='fundamental6')
@@ -171,15 +127,7 @@ for index in range(start_index, len(alpha_list)):
 
     while keep_trying:
         try:
-            sim_resp = sess.post(
-                'https://api.worldquantbrain.com/simulations',
-                json=alpha
-            )
-
-            if 'Location' not in sim_resp.headers:
-                raise Exception("No Location header found")
-
-            sim_progress_url = sim_resp.headers['Location']
+            sim_progress_url = simulate(sess, alpha)
             logging.info(f'Alpha location is: {sim_progress_url}')
             print(f'Alpha location is: {sim_progress_url}')
 
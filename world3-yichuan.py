@@ -93,14 +93,8 @@ def load_progress(default_start=0):
 # =========================
 # 登录 Brain
 # =========================
-def sign_in():
-    with open(os.path.expanduser('brain_credentials.txt')) as f:
-        username, password = json.load(f)
-    sess = requests.Session()
-    sess.auth = HTTPBasicAuth(username, password)
-    resp = sess.post('https://api.worldquantbrain.com/authentication')
-    print(resp.status_code, resp.json())
-    return sess
+# 登录统一走 brain_api：带连接池和重试策略的 session
+from brain_api import sign_in, simulate
 
 # =========================
 # 提交 Alpha
@@ -124,10 +118,7 @@ def submit_alpha(sess, alpha_expr):
         },
         "regular": alpha_expr
     }
-    resp = sess.post('https://api.worldquantbrain.com/simulations', json=alpha_data)
-    if 'Location' not in resp.headers:
-        raise Exception("No Location header")
-    return resp.headers['Location']
+    return simulate(sess, alpha_data)
 
 # =========================
 # GA + 自动提交主函数
@@ -17,15 +17,8 @@ logging.basicConfig(filename='simulation_lowmem.log', level=logging.INFO,
 # =========================
 # 登录
 # =========================
-def sign_in():
-    with open(expanduser('brain_credentials.txt')) as f:
-        username, password = json.load(f)
-    sess = requests.Session()
-    sess.auth = HTTPBasicAuth(username, password)
-    resp = sess.post('https://api.worldquantbrain.com/authentication')
-    if resp.status_code != 201:
-        raise Exception(f"Login failed: {resp.status_code} {resp.text}")
-    return sess
+# 登录统一走 brain_api：带连接池和重试策略的 session
+from brain_api import sign_in, simulate
 
 sess = sign_in()
 
@@ -121,13 +114,7 @@ alpha_list = [pack_alpha(expr) for expr in alpha_expressions]
 # =========================
 def get_alpha_history_vector(alpha, sess, ts_length=100, max_poll=10, poll_sleep=2):
     try:
-        resp = sess.post('https://api.worldquantbrain.com/simulations', json=alpha)
-        if resp.status_code != 201:
-            print(f"POST 无 Location: {resp.status_code}, {resp.text}")
-            return None
-
-        alpha_id = resp.json()['id']
-        url = f"https://api.worldquantbrain.com/simulations/{alpha_id}"
+        url = simulate(sess, alpha)
 
         for _ in range(max_poll):
             r = sess.get(url)
@@ -16,15 +16,8 @@ logging.basicConfig(filename='simulation_flow.log', level=logging.INFO,
 # =========================
 # 登录
 # =========================
-def sign_in():
-    with open(expanduser('brain_credentials.txt')) as f:
-        username, password = json.load(f)
-    sess = requests.Session()
-    sess.auth = HTTPBasicAuth(username, password)
-    resp = sess.post('https://api.worldquantbrain.com/authentication')
-    if resp.status_code != 201:
-        raise Exception(f"Login failed: {resp.status_code} {resp.text}")
-    return sess
+# 登录统一走 brain_api：带连接池和重试策略的 session
+from brain_api import sign_in, simulate
 
 sess = sign_in()
 
@@ -133,15 +126,7 @@ for index in range(start_index, len(alpha_list)):
 
     while keep_trying:
         try:
-            sim_resp = sess.post(
-                'https://api.worldquantbrain.com/simulations',
-                json=alpha
-            )
-
-            if 'Location' not in sim_resp.headers:
-                raise Exception("No Location header found")
-
-            sim_progress_url = sim_resp.headers['Location']
+            sim_progress_url = simulate(sess, alpha)
             logging.info(f'Alpha location is: {sim_progress_url}')
             print(f'Alpha location is: {sim_progress_url}')
 